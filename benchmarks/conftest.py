@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from mxtools.batch import PutBatch
+from mxtools.eiger import EigerSingleTriggerV26
+from mxtools.eiger_files import FRAME_SHAPES
+from mxtools.settle import wait_for_readback
+from mxtools.vector_program import VectorProgram
+from mxtools.zebra import Zebra
+
+# Search the PVs on localhost only, where the sim fixture serves them. Set before
+# any benchmark creates a PV, as the channel access client reads them once.
+os.environ.update({"EPICS_CA_ADDR_LIST": "127.0.0.1", "EPICS_CA_AUTO_ADDR_LIST": "NO"})
+
+# N for the N x N raster grids
+DEFAULT_RASTER_SIZES = (10, 50, 100)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("mxtools", "mxtools benchmarks")
+    group.addoption(
+        "--sim-time-scale",
+        type=float,
+        default=1.0,
+        help="factor applied to the durations of the simulated devices (default: 1, real time)",
+    )
+    group.addoption(
+        "--raster-sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_RASTER_SIZES),
+        help="sizes N of the N x N raster grids to benchmark (default: %(default)s)",
+    )
+    group.addoption(
+        "--eiger-detector",
+        choices=sorted(FRAME_SHAPES),
+        default="9M",
+        help="Eiger model, for the frame size of the synthetic files read by the handler (default: %(default)s)",
+    )
+    group.addoption(
+        "--eiger-frames", type=int, default=200, help="frames in the synthetic files (default: %(default)s)"
+    )
+    group.addoption(
+        "--eiger-images-per-file",
+        type=int,
+        default=50,
+        help="frames per synthetic data file (default: %(default)s)",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "raster_size" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("raster_sizes")
+        metafunc.parametrize("raster_size", sizes, ids=[f"{size}x{size}" for size in sizes])
+
+
+@pytest.fixture(scope="session")
+def sim(request):
+    """Serve the simulated vector program, Zebra and Eiger for the whole session."""
+    sim_iocs = pytest.importorskip("mxtools.sim_iocs")
+    time_scale = request.config.getoption("sim_time_scale")
+    # small frames: the benchmarks measure the collection overhead, not the file writing
+    with sim_iocs.serve_in_subprocess("--time-scale", time_scale, "--frame-shape", 64, 64):
+        yield sim_iocs
+
+
+@pytest.fixture(scope="session")
+def connected_devices(sim):
+    """The devices, connected once like they are at the beamline."""
+    vector = VectorProgram(sim.VECTOR_PREFIX, name="vector")
+    zebra = Zebra(sim.ZEBRA_PREFIX, name="zebra")
+    eiger = EigerSingleTriggerV26(sim.EIGER_PREFIX, name="eiger")
+    for device in (vector, zebra, eiger):
+        device.wait_for_connection(timeout=10)
+    return vector, zebra, eiger
+
+
+def reset_detector(eiger, timeout=10):
+    """Disarm the detector and set one image per trigger.
+
+    The flyers only write the parameters they use: the rasters do not set
+    the number of images, and after an MXFlyer collection the detector would
+    wait for that many frames per trigger, staying armed after the raster.
+    """
+    eiger.cam.acquire.put(0)
+    if not wait_for_readback(eiger.cam.armed, 0, timeout=timeout):
+        raise RuntimeError("the detector did not disarm")
+    PutBatch(timeout=timeout).put(eiger.cam.num_images, 1).wait()
+
+
+@pytest.fixture
+def devices(connected_devices):
+    """The connected devices, with the detector reset so that each benchmark starts from the same state."""
+    reset_detector(connected_devices[2])
+    return connected_devices
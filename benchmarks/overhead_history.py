@@ -0,0 +1,41 @@
+"""Print the overhead recorded by the autosaved benchmark runs, one line per benchmark and run.
+
+Usage: python benchmarks/overhead_history.py [--storage .benchmarks] [-k raster]
+"""
+
+import argparse
+import json
+import pathlib
+
+
+def load_runs(storage):
+    """Yield the runs saved by ``--benchmark-autosave``/``--benchmark-save``, oldest first."""
+    for path in sorted(pathlib.Path(storage).glob("*/*.json")):
+        with open(path) as f:
+            yield json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", default=".benchmarks", help="the pytest-benchmark storage directory")
+    parser.add_argument("-k", dest="keyword", default="", help="only the benchmarks with this in their name")
+    args = parser.parse_args(argv)
+    print(f"{'date':20} {'commit':10} {'benchmark':40} {'overhead_s':>10} {'per_row_s':>10} {'row_gap_s':>10}")
+    for run in load_runs(args.storage):
+        commit = run.get("commit_info", {})
+        for bench in run["benchmarks"]:
+            info = bench.get("extra_info", {})
+            if "overhead_s" not in info or args.keyword not in bench["name"]:
+                continue
+            per_row = info.get("overhead_per_row_s")
+            gap = info.get("row_gap_s")
+            print(
+                f"{run['datetime'][:19]:20} {commit.get('id', '')[:8]:10} {bench['name']:40} "
+                f"{info['overhead_s']:10.3f} "
+                f"{'' if per_row is None else format(per_row, '.4f'):>10} "
+                f"{'' if gap is None else format(gap, '.4f'):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
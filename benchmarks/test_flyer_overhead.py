@@ -0,0 +1,223 @@
+"""Overhead of full collection cycles of the flyers against the simulated devices.
+
+Each round runs ``update_parameters``, ``detector_arm``, then ``kickoff``,
+``complete`` and ``collect`` (which calls ``collect_asset_docs``) through the
+RunEngine. The time the vector program is moving is measured from its
+``Sts:Running`` monitor, and what remains of the cycle is the overhead: the
+benchmark ``extra_info`` has it per collection (``overhead_s``) and, for the
+rasters, per row (``overhead_per_row_s``) together with the mean dead time
+between two rows (``row_gap_s``).
+"""
+
+import threading
+import time as ttime
+from collections import defaultdict
+
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+
+from mxtools.flyer import MXFlyer
+from mxtools.raster_flyer import MXRasterFlyer
+from mxtools.timing import RingBufferSink
+
+ROUNDS = 3
+
+BEAMLINE = dict(
+    detector_dead_time=0.001,
+    x_beam=32,
+    y_beam=32,
+    wavelength=1.0,
+    det_distance_m=0.2,
+    num_images_per_file=100,
+)
+
+# 180 frames of 0.1 deg
+SWEEP = dict(
+    BEAMLINE,
+    angle_start=0,
+    scan_width=18,
+    img_width=0.1,
+    exposure_period_per_image=0.01,
+    num_images=180,
+    x_start_um=0,
+    x_end_um=0,
+    y_start_um=0,
+    y_end_um=0,
+    z_start_um=0,
+    z_end_um=0,
+)
+
+# with img_width == 0, scan_width is the number of frames
+STILL = dict(SWEEP, scan_width=10, img_width=0, exposure_period_per_image=0.1, num_images=10)
+
+
+class MotionClock:
+    """Record the intervals during which the vector program is moving."""
+
+    def __init__(self, vector):
+        self.vector = vector
+        self.intervals = []
+        self._started = None
+        self._lock = threading.Lock()
+        self._cid = vector.active.subscribe(self._update, run=False)
+
+    def _update(self, value, timestamp, **kwargs):
+        with self._lock:
+            if value == 1 and self._started is None:
+                self._started = timestamp
+            elif value == 0 and self._started is not None:
+                self.intervals.append((self._started, timestamp))
+                self._started = None
+
+    def reset(self):
+        with self._lock:
+            self.intervals = []
+            self._started = None
+
+    def motion_time(self):
+        return sum(end - start for start, end in self.intervals)
+
+    def gaps(self):
+        """The times between the end of a motion and the start of the next one."""
+        return [start - end for (_, end), (start, _) in zip(self.intervals[:-1], self.intervals[1:])]
+
+    def close(self):
+        self.vector.active.unsubscribe(self._cid)
+
+
+class OverheadRecorder:
+    """Run collection cycles and compute their overhead, for ``benchmark.extra_info``."""
+
+    def __init__(self, flyer, clock, rows=None):
+        self.flyer = flyer
+        self.clock = clock
+        self.rows = rows
+        self.sink = RingBufferSink()
+        flyer.timing.sinks.append(self.sink)
+        self.cycles = []
+        self.motions = []
+        self.gaps = []
+        self.phases = []
+
+    def run(self, cycle):
+        self.clock.reset()
+        self.sink.clear()
+        start = ttime.time()
+        cycle()
+        self.cycles.append(ttime.time() - start)
+        self.motions.append(self.clock.motion_time())
+        self.gaps.extend(self.clock.gaps())
+        phases = defaultdict(float)
+        for record in self.sink.records():
+            if record["parent"] is None:
+                phases[record["name"]] += record["duration"]
+        self.phases.append(phases)
+
+    def extra_info(self):
+        # the first cycle is the warm-up one (connections, setpoint cache)
+        cycles, motions, phases = self.cycles[1:], self.motions[1:], self.phases[1:]
+        overheads = np.subtract(cycles, motions)
+        info = {
+            "cycle_s": float(np.mean(cycles)),
+            "motion_s": float(np.mean(motions)),
+            "overhead_s": float(np.mean(overheads)),
+            "overhead_max_s": float(np.max(overheads)),
+            "phases_s": {name: float(np.mean([p.get(name, 0.0) for p in phases])) for name in phases[0]},
+        }
+        if self.rows is not None:
+            info["rows"] = self.rows
+            info["overhead_per_row_s"] = info["overhead_s"] / self.rows
+            info["row_gap_s"] = float(np.mean(self.gaps)) if self.gaps else 0.0
+        return info
+
+
+@pytest.fixture
+def clock(devices):
+    vector, _, _ = devices
+    clock = MotionClock(vector)
+    yield clock
+    clock.close()
+
+
+def _fly(flyer, rows=None):
+    """Kick off, complete and collect the flyer, once or for each of ``rows``."""
+
+    @bpp.run_decorator()
+    def plan():
+        for row in rows or [None]:
+            if row is not None and row["row_index"] > 0:
+                flyer.update_parameters(**row)
+            yield from bps.kickoff(flyer, wait=True)
+            yield from bps.complete(flyer, wait=True)
+            yield from bps.collect(flyer)
+
+    return plan()
+
+
+def _benchmark_collection(benchmark, recorder, cycle):
+    benchmark.pedantic(recorder.run, args=(cycle,), rounds=ROUNDS, warmup_rounds=1)
+    if benchmark.disabled:  # run once, without statistics
+        return
+    benchmark.extra_info.update(recorder.extra_info())
+
+
+@pytest.mark.parametrize("params", [SWEEP, STILL], ids=["sweep", "still"])
+def test_mxflyer_overhead(benchmark, devices, clock, tmp_path, params):
+    flyer = MXFlyer(*devices)
+    RE = RunEngine()
+    params = dict(params, file_prefix="bench", file_number_start=1, data_directory_name=str(tmp_path))
+
+    def cycle():
+        flyer.update_parameters(**params)
+        flyer.detector_arm(**params).wait(10)
+        RE(_fly(flyer))
+        params["file_number_start"] += 1
+
+    _benchmark_collection(benchmark, OverheadRecorder(flyer, clock), cycle)
+
+
+def _raster(size, tmp_path):
+    """The rows of a size x size raster, 10 um apart, and the parameters they share."""
+    rows = [dict(y_start_um=10 * i, y_end_um=10 * i, row_index=i) for i in range(size)]
+    common = dict(
+        BEAMLINE,
+        angle_start=0,
+        scan_width=size * 0.1,
+        img_width=0.1,
+        exposure_period_per_image=0.005,
+        num_images=size,
+        x_start_um=0,
+        x_end_um=10 * size,
+        z_start_um=0,
+        z_end_um=0,
+        protocol="raster",
+        total_num_images=size * size,
+        file_prefix="raster",
+        file_number_start=1,
+        data_directory_name=str(tmp_path),
+    )
+    return rows, common
+
+
+@pytest.mark.parametrize("mode", ["rows", "grid"])
+def test_raster_overhead(benchmark, devices, clock, tmp_path, raster_size, mode):
+    """A kickoff/complete/collect per row ("rows") or one for the whole grid ("grid")."""
+    flyer = MXRasterFlyer(*devices)
+    RE = RunEngine()
+    rows, common = _raster(raster_size, tmp_path)
+
+    def cycle():
+        if mode == "grid":
+            flyer.configure_grid(rows, **common)
+            flyer.detector_arm(**common).wait(10)
+            RE(_fly(flyer))
+        else:
+            flyer.update_parameters(**common, **rows[0])
+            flyer.detector_arm(**common).wait(10)
+            RE(_fly(flyer, [{**common, **row} for row in rows]))
+        common["file_number_start"] += 1
+
+    _benchmark_collection(benchmark, OverheadRecorder(flyer, clock, rows=raster_size), cycle)
@@ -0,0 +1,162 @@
+"""Read throughput of EigerHandlerMX on a synthetic Eiger collection.
+
+The collection is written once per session by
+:func:`mxtools.eiger_files.write_synthetic_collection`, with bitshuffle-LZ4
+compressed frames of the size of ``--eiger-detector``. Each benchmark reads
+it through a new handler and a cleared file pool, and its ``extra_info`` has
+the throughput of the decompressed frames (``gb_per_s``, ``frames_per_s``),
+the peak resident memory of the process during the benchmark
+(``peak_rss_mb``, next to ``rss_before_mb``) and the number of files opened
+per read (``file_opens``, the misses of the pool). The files are in the page
+cache after the first round, so the reads are not limited by the disk.
+"""
+
+import resource
+
+import numpy as np
+import pytest
+
+from mxtools.eiger_files import FRAME_SHAPES, write_synthetic_collection
+from mxtools.handlers import EigerHandlerMX, H5FilePool
+
+ROUNDS = 3
+SEQ_ID = 1
+RANDOM_FRAMES = 20
+STRIDE = 10
+READERS = ["h5py", "direct"]
+
+
+class PeakRSS:
+    """Peak resident memory of the process, reset with :meth:`reset` where Linux allows it."""
+
+    def reset(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # resets VmHWM, the peak resident set size
+        except OSError:
+            pass  # the peak is then the one since the start of the process
+        return self.current()
+
+    @staticmethod
+    def _status(field):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def current(self):
+        return self._status("VmRSS")
+
+    def peak(self):
+        peak = self._status("VmHWM")
+        if peak is None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+        return peak
+
+
+@pytest.fixture(scope="session")
+def eiger_collection(request, tmp_path_factory):
+    """Prefix of the synthetic collection, its number of frames and their shape."""
+    pytest.importorskip("hdf5plugin")
+    config = request.config
+    shape = FRAME_SHAPES[config.getoption("eiger_detector")]
+    num_images = config.getoption("eiger_frames")
+    fpath = tmp_path_factory.mktemp("eiger") / "synthetic"
+    write_synthetic_collection(
+        fpath,
+        seq_id=SEQ_ID,
+        num_images=num_images,
+        images_per_file=config.getoption("eiger_images_per_file"),
+        frame_shape=shape,
+    )
+    return fpath, num_images, shape
+
+
+def _benchmark_reads(benchmark, fpath, read, reader="h5py", frames=0, frame_nbytes=0):
+    """Benchmark ``read(handler)`` on a new handler and pool each round, reading ``frames`` frames."""
+    if reader == "direct":
+        pytest.importorskip("bitshuffle")
+    pool = H5FilePool()
+    opens = []
+    rss = PeakRSS()
+    rss_before = rss.reset()
+
+    def setup():
+        pool.clear()
+        pool.reset_stats()
+        handler = EigerHandlerMX(fpath, SEQ_ID, pool=pool, reader=reader)
+        return (handler,), {}
+
+    def run(handler):
+        read(handler)
+        opens.append(pool.misses)
+
+    benchmark.pedantic(run, setup=setup, rounds=ROUNDS, warmup_rounds=1)
+    pool.clear()
+    if benchmark.disabled:  # run once, without statistics
+        return
+    mean = benchmark.stats.stats.mean
+    benchmark.extra_info.update(
+        {
+            "frames": frames,
+            "gb_per_s": frames * frame_nbytes / mean / 1e9,
+            "frames_per_s": frames / mean,
+            "peak_rss_mb": rss.peak(),
+            "rss_before_mb": rss_before,
+            "file_opens": float(np.mean(opens)),
+        }
+    )
+
+
+def _frame_nbytes(shape):
+    return int(np.prod(shape)) * np.dtype("uint32").itemsize
+
+
+@pytest.mark.parametrize("reader", READERS)
+def test_full_sweep(benchmark, eiger_collection, reader):
+    """All the frames, reduced frame by frame so that they are not all in memory at once."""
+    fpath, num_images, shape = eiger_collection
+
+    def read(handler):
+        handler("data").sum(axis=(1, 2)).compute()
+
+    _benchmark_reads(benchmark, fpath, read, reader, num_images, _frame_nbytes(shape))
+
+
+@pytest.mark.parametrize("reader", READERS)
+def test_random_single_frames(benchmark, eiger_collection, reader):
+    """``RANDOM_FRAMES`` frames read one at a time, anywhere in the collection."""
+    fpath, num_images, shape = eiger_collection
+    frames = np.random.default_rng(0).integers(0, num_images, RANDOM_FRAMES)
+
+    def read(handler):
+        for frame in frames:
+            handler("data", frame_num=int(frame)).compute()
+
+    _benchmark_reads(benchmark, fpath, read, reader, len(frames), _frame_nbytes(shape))
+
+
+@pytest.mark.parametrize("reader", READERS)
+def test_strided(benchmark, eiger_collection, reader):
+    """Every ``STRIDE``-th frame, as when previewing a collection."""
+    fpath, num_images, shape = eiger_collection
+
+    def read(handler):
+        handler("data", frame_num=slice(None, None, STRIDE)).sum(axis=(1, 2)).compute()
+
+    frames = len(range(0, num_images, STRIDE))
+    _benchmark_reads(benchmark, fpath, read, reader, frames, _frame_nbytes(shape))
+
+
+def test_metadata_only(benchmark, eiger_collection):
+    """The omega angles and detector metadata, without reading any frame."""
+    fpath, _, _ = eiger_collection
+
+    def read(handler):
+        return handler("omega").compute(), handler("detector/count_time").compute(), handler("data").shape
+
+    _benchmark_reads(benchmark, fpath, read)
@@ -0,0 +1,249 @@
+import logging
+import math
+import numbers
+import threading
+
+from ophyd.signal import EpicsSignalBase, Signal
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PUT_TIMEOUT = 10.0
+
+
+def _same_value(a, b):
+    if isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+    try:
+        return bool(a == b)
+    except ValueError:  # arrays
+        return False
+
+
+class SetpointCache:
+    """Write-through shadow of the values written to signals.
+
+    The cache remembers the last value written to each signal and the last
+    value its monitor reported. A put of a value equal to both can be skipped.
+    A signal is forgotten as soon as its monitor reports a different value
+    (someone else changed it) or its connection state changes (the IOC
+    restarted), so the next put to it is always issued.
+    """
+
+    def __init__(self):
+        self._written = {}
+        self._readback = {}
+        self._subscribed = set()
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.skipped = 0
+
+    def is_current(self, signal, value):
+        """Return True if ``value`` was the last value written to ``signal`` and is still there."""
+        with self._lock:
+            if signal not in self._written or not _same_value(self._written[signal], value):
+                return False
+            readback = self._readback.get(signal, value)
+            return _same_value(readback, value)
+
+    def record(self, signal, value):
+        """Remember that ``value`` was written to ``signal``."""
+        self._subscribe(signal)
+        with self._lock:
+            self._written[signal] = value
+
+    def count(self, issued):
+        with self._lock:
+            if issued:
+                self.issued += 1
+            else:
+                self.skipped += 1
+
+    def invalidate(self, *objs):
+        """Forget the given signals or devices, or everything if none are given."""
+        with self._lock:
+            if not objs:
+                self._written.clear()
+                self._readback.clear()
+                return
+            for obj in objs:
+                signals = [walk.item for walk in obj.walk_signals()] if hasattr(obj, "walk_signals") else [obj]
+                for signal in signals:
+                    self._written.pop(signal, None)
+                    self._readback.pop(signal, None)
+
+    def stats(self):
+        with self._lock:
+            return {"issued": self.issued, "skipped": self.skipped, "cached": len(self._written)}
+
+    def _subscribe(self, signal):
+        with self._lock:
+            if signal in self._subscribed:
+                return
+            self._subscribed.add(signal)
+
+        def value_changed(value, obj, **kwargs):
+            with self._lock:
+                self._readback[obj] = value
+                if obj in self._written and not _same_value(self._written[obj], value):
+                    logger.debug(f"{obj.name} changed externally to {value!r}, forgetting its setpoint")
+                    del self._written[obj]
+
+        connected = [getattr(signal, "connected", True)]
+
+        def connection_changed(obj, **kwargs):
+            # Metadata callbacks also carry alarms, limits, etc.: only react to (re)connections.
+            if "connected" in kwargs and kwargs["connected"] != connected[0]:
+                connected[0] = kwargs["connected"]
+                logger.debug(f"{obj.name} connection changed, forgetting its setpoint")
+                self.invalidate(obj)
+
+        signal.subscribe(value_changed, event_type=signal.SUB_VALUE, run=False)
+        signal.subscribe(connection_changed, event_type=signal.SUB_META, run=False)
+
+
+def _start_put(obj, value):
+    """Start writing ``value`` to ``obj`` and return a status finished when the write completes.
+
+    EPICS signals are written with a Channel Access put with completion
+    callback (``put(..., wait=True)`` without blocking), so that the write
+    is complete when the IOC has processed it, whatever readback it then
+    reports. ``signal.set`` would instead poll the readback until it equals
+    the setpoint, forever if the IOC rounds or coerces the value. Soft
+    signals are written synchronously, and anything else (positioners) with
+    ``set``.
+    """
+    if isinstance(obj, EpicsSignalBase):
+        status = Status(obj=obj)
+
+        def put_done(*args, **kwargs):
+            status.set_finished()
+
+        try:
+            obj.put(value, use_complete=True, callback=put_done)
+        except Exception as exc:
+            status.set_exception(exc)
+        return status
+    if isinstance(obj, Signal):
+        status = Status(obj=obj)
+        try:
+            obj.put(value)
+        except Exception as exc:
+            status.set_exception(exc)
+        else:
+            status.set_finished()
+        return status
+    return obj.set(value)
+
+
+class PutBatch:
+    """Collect signal writes and issue them concurrently.
+
+    Writes added between two calls to :meth:`barrier` form a stage. All writes
+    of a stage are started at once with a Channel Access put with completion
+    callback (see :func:`_start_put`) and the next stage only starts when all
+    of them have completed. One aggregate status, with one timeout, covers the
+    batch: a put the IOC never completes fails the batch, but does not block
+    later batches.
+
+    Example::
+
+        batch = PutBatch(timeout=5)
+        batch.put(cam.acquire_time, 0.1)
+        batch.barrier()  # the acquire time must be set before the acquire period
+        batch.put(cam.acquire_period, 0.1).put(cam.trigger_mode, EXTERNAL_SERIES)
+        batch.barrier()
+        batch.put(cam.num_images, 100)
+        batch.wait()
+
+    Parameters
+    ----------
+    timeout : float, optional
+        time allowed for all the writes of the batch to complete
+    cache : SetpointCache, optional
+        if given, writes of values the signals already hold are skipped
+    """
+
+    def __init__(self, timeout=DEFAULT_PUT_TIMEOUT, cache=None):
+        self.timeout = timeout
+        self.cache = cache
+        self._stages = [[]]
+        self._stage = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def put(self, signal, value):
+        """Add a write of ``value`` to ``signal`` to the current stage."""
+        self._stages[-1].append((signal, value))
+        return self
+
+    def barrier(self):
+        """Start a new stage: the following writes wait for the previous ones to complete."""
+        if self._stages[-1]:
+            self._stages.append([])
+        return self
+
+    def __len__(self):
+        return sum(len(stage) for stage in self._stages)
+
+    def execute(self):
+        """Start the writes and return the aggregate status of the batch."""
+        stages = [stage for stage in self._stages if stage]
+        status = Status(obj=self, timeout=self.timeout)
+
+        def report(status):
+            if not status.success:
+                with self._lock:
+                    pending = [self._stage[position][0].name for position in self._pending]
+                logger.warning(f"batched puts did not complete: {pending} ({status.exception()!r})")
+
+        status.add_callback(report)
+
+        def run_stage(index):
+            if status.done:
+                return
+            if index == len(stages):
+                status.set_finished()
+                return
+            stage = stages[index]
+            if self.cache is not None:
+                stage = [(signal, value) for signal, value in stage if self._needs_put(signal, value)]
+                if not stage:
+                    run_stage(index + 1)
+                    return
+            with self._lock:
+                self._stage = stage
+                self._pending = list(range(len(stage)))
+
+            def stage_callback(put_status, position):
+                if not put_status.success:
+                    if not status.done:
+                        status.set_exception(put_status.exception())
+                    return
+                if self.cache is not None:
+                    self.cache.record(*stage[position])
+                with self._lock:
+                    self._pending.remove(position)
+                    stage_done = not self._pending
+                if stage_done:
+                    run_stage(index + 1)
+
+            for position, (signal, value) in enumerate(stage):
+                put_status = _start_put(signal, value)
+                put_status.add_callback(lambda put_status, position=position: stage_callback(put_status, position))
+
+        run_stage(0)
+        return status
+
+    def _needs_put(self, signal, value):
+        needed = not self.cache.is_current(signal, value)
+        self.cache.count(needed)
+        if not needed:
+            logger.debug(f"skipping put of {value!r} to {signal.name}, already set")
+        return needed
+
+    def wait(self):
+        """Start the writes and block until all of them have completed."""
+        status = self.execute()
+        status.wait()
+        return status
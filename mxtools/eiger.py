@@ -25,6 +25,65 @@ INTERNAL_ENABLE = 1
 EXTERNAL_SERIES = 2
 EXTERNAL_ENABLE = 3
 
+# Value of ``frames_per_datum`` that emits one datum per data file.
+PER_FILE = "per_file"
+
+
+def frame_ranges(num_images, frames_per_datum):
+    """Split ``num_images`` frames into (start, stop) ranges of ``frames_per_datum`` frames."""
+    frames_per_datum = max(int(frames_per_datum), 1)
+    return [(start, min(start + frames_per_datum, num_images)) for start in range(0, num_images, frames_per_datum)]
+
+
+def datum_frame_ranges(detector, frames_per_datum):
+    """Return the (start, stop) frame ranges of the datums of ``detector``, None for a single datum.
+
+    ``frames_per_datum`` is None for a single datum covering all frames, PER_FILE
+    for one datum per data file, or an int N for one datum per N frames.
+    """
+    if frames_per_datum is None:
+        return None
+    if frames_per_datum == PER_FILE:
+        frames_per_datum = int(detector.file.file_write_images_per_file.get())
+    return frame_ranges(int(detector.cam.num_images.get()), frames_per_datum)
+
+
+def images_per_event(detector, frames_per_datum):
+    """Return the length of the images dimension of the events of ``detector``.
+
+    None (a variable length) if the last frame range is shorter than the others.
+    """
+    ranges = datum_frame_ranges(detector, frames_per_datum)
+    if ranges is None:
+        return int(detector.cam.num_images.get())
+    lengths = {stop - start for start, stop in ranges}
+    return None if len(lengths) > 1 else max(lengths, default=0)
+
+
+def generate_frame_datum_pages(resource_uid, data_keys, ranges):
+    """Compose one datum page per data key, holding a datum per frame range.
+
+    Returns the datum pages and, for each frame range, a dict mapping the
+    data keys to their datum ids. The handler reads the range through the
+    ``frame_start``/``frame_stop`` datum kwargs.
+    """
+    datum_ids = [
+        {data_key: f"{resource_uid}/{data_key}/{i}" for data_key in data_keys} for i in range(len(ranges))
+    ]
+    pages = [
+        {
+            "resource": resource_uid,
+            "datum_id": [ids[data_key] for ids in datum_ids],
+            "datum_kwargs": {
+                "data_key": [data_key] * len(ranges),
+                "frame_start": [start for start, _ in ranges],
+                "frame_stop": [stop for _, stop in ranges],
+            },
+        }
+        for data_key in data_keys
+    ]
+    return pages, datum_ids
+
 
 class EigerSimulatedFilePlugin(Device, FileStoreBase):
     sequence_id = ADComponent(EpicsSignal, "SequenceId")
@@ -52,12 +111,12 @@ class EigerSimulatedFilePlugin(Device, FileStoreBase):
         self.file_write_name_pattern.set("{}_$id".format(res_uid))
         super().stage()
         fn = PurePath(self.file_path.get()) / res_uid
-        ipf = int(self.file_write_images_per_file.get())  # noqa
+        ipf = int(self.file_write_images_per_file.get())
         # logger.debug("Inserting resource with filename %s", fn)
         self._fn = fn
-        # res_kwargs = {"images_per_file": ipf}
         seq_id = int(self.sequence_id.get())  # det writes to the NEXT one
-        res_kwargs = {"seq_id": seq_id}
+        # images_per_file lets the handler locate a frame without opening every data file
+        res_kwargs = {"seq_id": seq_id, "images_per_file": ipf}
         self._generate_resource(res_kwargs)
         print(f"{print_now()} done staging detector {self.name}")
 
@@ -100,8 +159,11 @@ class EigerBaseV26(EigerDetector):
 
 
 class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, frames_per_datum=None, **kwargs):
         super().__init__(*args, **kwargs)
+        # None: a single datum for all frames, PER_FILE: one datum per data file,
+        # an int N: one datum (and event) per N frames
+        self.frames_per_datum = frames_per_datum
         # self.stage_sigs["cam.trigger_mode"] = 0 #original: single manual trigger
         self.stage_sigs.pop("cam.acquire")  # remove acquire=0
         # self.stage_sigs['shutter_mode'] = 1  # 'EPICS PV'
@@ -110,6 +172,7 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
         self._resource_uids = []
         self._datum_counter = None
         self._datum_ids = DEFAULT_DATUM_DICT
+        self._datum_ranges = None
         self._master_file = None
         self._master_metadata = []
 
@@ -128,7 +191,7 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
                 "source": f"{self.detector.name}_data",
                 "dtype": "array",
                 "shape": [
-                    self.cam.num_images.get(),
+                    images_per_event(self, self.frames_per_datum),
                     self.cam.array_size.array_size_y.get(),
                     self.cam.array_size.array_size_x.get(),
                 ],
@@ -138,7 +201,7 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
             "omega": {
                 "source": f"{self.detector.name}_omega",
                 "dtype": "array",
-                "shape": [self.cam.num_images.get()],
+                "shape": [images_per_event(self, self.frames_per_datum)],
                 "dims": ["images"],
                 "external": "FILESTORE:",
             },
@@ -150,13 +213,15 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
 
         now = ttime.time()
         self._master_metadata = self._extract_metadata()
-        data = {f"{self.detector.name}_image": self._datum_ids["data"], "omega": self._datum_ids["omega"]}
-        yield {
-            "data": data,
-            "timestamps": {key: now for key in data},
-            "time": now,
-            "filled": {key: False for key in data},
-        }
+        datum_ranges = [self._datum_ids] if self._datum_ranges is None else self._datum_ranges
+        for datum_ids in datum_ranges:
+            data = {f"{self.detector.name}_image": datum_ids["data"], "omega": datum_ids["omega"]}
+            yield {
+                "data": data,
+                "timestamps": {key: now for key in data},
+                "time": now,
+                "filled": {key: False for key in data},
+            }
 
     # def collect_asset_docs(self):
     #     # items = list(self._asset_docs_cache)
@@ -177,14 +242,8 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
         # Generate Datum documents from scratch here, because the detector was
         # triggered externally by the DeltaTau, never by ophyd.
         resource_uid = resource["uid"]
-        # num_points = int(math.ceil(self.detector.cam.num_images.get() /
-        #                 self.detector.cam.fw_num_images_per_file.get()))
-
-        # We are currently generating only one datum document for all frames, that's why
-        #   we use the 0th index below.
-        #
-        # Uncomment & update the line below if more datum documents are needed:
-        # for i in range(num_points):
+        # By default a single datum document covers all frames. Set frames_per_datum
+        #   to generate a datum page per data key, holding a datum per frame range, instead.
 
         seq_id = self.cam.sequence_id.get()
 
@@ -215,6 +274,13 @@ class EigerSingleTriggerV26(SingleTrigger, EigerBaseV26):
 
         # event = {...: ..., "data": {"detector_img": "a", "omega": "b"}}
 
+        ranges = datum_frame_ranges(self, self.frames_per_datum)
+        if ranges is not None:
+            pages, self._datum_ranges = generate_frame_datum_pages(resource_uid, list(self._datum_ids), ranges)
+            asset_docs_cache.extend(("datum_page", page) for page in pages)
+            return tuple(asset_docs_cache)
+
+        self._datum_ranges = None
         for data_key in self._datum_ids.keys():
             datum_id = f"{resource_uid}/{data_key}"
             self._datum_ids[data_key] = datum_id
@@ -0,0 +1,179 @@
+import io
+import logging
+import pathlib
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MASTER_FILE_TEMPLATE = "{prefix}_{seq_id}_master.h5"
+DATA_FILE_TEMPLATE = "{prefix}_{seq_id}_data_{index:06d}.h5"
+DATA_DATASET = "entry/data/data"
+
+# (rows, columns) of the frames of the Eiger X detectors
+FRAME_SHAPES = {"1M": (1065, 1030), "4M": (2167, 2070), "9M": (3269, 3110), "16M": (4371, 4150)}
+
+
+def _compression_kwargs(compression):
+    """Dataset keyword arguments for ``compression`` (None, "bslz4" or an h5py filter name)."""
+    if compression is None:
+        return {}
+    if compression == "bslz4":
+        try:
+            import hdf5plugin
+        except ImportError as exc:
+            raise RuntimeError("bslz4 compression needs the hdf5plugin package") from exc
+        return dict(hdf5plugin.Bitshuffle(cname="lz4"))
+    return {"compression": compression}
+
+
+def data_file_path(fpath, seq_id, index):
+    """Path of the data file ``index`` (counted from 1) of the acquisition ``seq_id``."""
+    fpath = pathlib.Path(fpath)
+    return fpath.parent / DATA_FILE_TEMPLATE.format(prefix=fpath.name, seq_id=seq_id, index=index)
+
+
+def master_file_path(fpath, seq_id):
+    """Path of the master file of the acquisition ``seq_id``."""
+    fpath = pathlib.Path(fpath)
+    return fpath.parent / MASTER_FILE_TEMPLATE.format(prefix=fpath.name, seq_id=seq_id)
+
+
+def write_data_file(path, frames, compression=None, image_nr_low=1):
+    """Write ``frames`` (a (frames, rows, columns) array) to an Eiger data file.
+
+    The frames are chunked one per chunk, like the Eiger file writer does.
+    """
+    frames = np.asarray(frames)
+    with h5py.File(path, "w") as f:
+        dataset = f.create_dataset(
+            DATA_DATASET, data=frames, chunks=(1, *frames.shape[1:]), **_compression_kwargs(compression)
+        )
+        dataset.attrs["image_nr_low"] = image_nr_low
+        dataset.attrs["image_nr_high"] = image_nr_low + len(frames) - 1
+    return path
+
+
+def write_master_file(
+    path,
+    data_files,
+    num_images,
+    omega_start=0.0,
+    omega_incr=0.0,
+    count_time=0.0,
+    ntrigger=1,
+    beam_center=(0.0, 0.0),
+    wavelength=1.0,
+    detector_distance=0.1,
+):
+    """Write an Eiger master file with external links to ``data_files``.
+
+    ``data_files`` are paths, linked as ``entry/data/data_{index:06d}`` in
+    their order. ``detector_distance`` is in meters, like the cam PV.
+    """
+    path = pathlib.Path(path)
+    with h5py.File(path, "w") as f:
+        data_group = f.create_group("entry/data")
+        for index, data_file in enumerate(data_files, start=1):
+            relative = pathlib.Path(data_file).name
+            data_group[f"data_{index:06d}"] = h5py.ExternalLink(relative, "/" + DATA_DATASET)
+        omega = omega_start + np.arange(num_images) * omega_incr
+        f["entry/sample/goniometer/omega"] = omega.astype("float32")
+        f["entry/sample/goniometer/omega_range_average"] = float(omega_incr)
+        detector = f.create_group("entry/instrument/detector")
+        detector["count_time"] = float(count_time)
+        detector["beam_center_x"] = float(beam_center[0])
+        detector["beam_center_y"] = float(beam_center[1])
+        detector["detector_distance"] = float(detector_distance)
+        detector["detectorSpecific/nimages"] = int(num_images)
+        detector["detectorSpecific/ntrigger"] = int(ntrigger)
+        f["entry/instrument/beam/incident_wavelength"] = float(wavelength)
+    return path
+
+
+def synthetic_frame(shape, dtype="uint32", background=0.1, num_spots=200, rng=None):
+    """A diffraction-like frame: Poisson background counts and ``num_spots`` bright pixels.
+
+    Mostly empty frames like these compress about as well as real ones.
+    """
+    rng = np.random.default_rng(rng)
+    frame = rng.poisson(background, size=shape).astype(dtype)
+    rows = rng.integers(0, shape[0], num_spots)
+    columns = rng.integers(0, shape[1], num_spots)
+    frame[rows, columns] = rng.integers(100, 10000, num_spots)
+    return frame
+
+
+def _encoded_chunks(frames, compression):
+    """Encode each of ``frames`` as a one-frame chunk, returned as (filter mask, bytes)."""
+    frames = list(frames)
+    with h5py.File(io.BytesIO(), "w") as f:
+        dataset = f.create_dataset(
+            "frames",
+            shape=(len(frames), *frames[0].shape),
+            dtype=frames[0].dtype,
+            chunks=(1, *frames[0].shape),
+            **_compression_kwargs(compression),
+        )
+        chunks = []
+        for i, frame in enumerate(frames):
+            dataset[i] = frame
+            chunks.append(dataset.id.read_direct_chunk((i, 0, 0)))
+    return chunks
+
+
+def write_synthetic_collection(
+    fpath,
+    seq_id=1,
+    num_images=100,
+    images_per_file=100,
+    frame_shape=FRAME_SHAPES["9M"],
+    dtype="uint32",
+    compression="bslz4",
+    distinct_frames=8,
+    background=0.1,
+    num_spots=200,
+    seed=0,
+    **metadata,
+):
+    """Write a synthetic Eiger collection: a master file and its data files.
+
+    The data files hold ``images_per_file`` frames each, cycling through
+    ``distinct_frames`` frames made by :func:`synthetic_frame`. These are
+    compressed once and their chunks copied, so that large collections are
+    written at disk speed. ``metadata`` are passed to :func:`write_master_file`.
+    Returns the path of the master file.
+    """
+    rng = np.random.default_rng(seed)
+    frames = (
+        synthetic_frame(frame_shape, dtype, background, num_spots, rng)
+        for _ in range(max(min(distinct_frames, num_images), 1))
+    )
+    chunks = _encoded_chunks(frames, compression)
+    data_files = []
+    for index, start in enumerate(range(0, num_images, images_per_file), start=1):
+        stop = min(start + images_per_file, num_images)
+        path = data_file_path(fpath, seq_id, index)
+        with h5py.File(path, "w") as f:
+            dataset = f.create_dataset(
+                DATA_DATASET,
+                shape=(stop - start, *frame_shape),
+                dtype=dtype,
+                chunks=(1, *frame_shape),
+                **_compression_kwargs(compression),
+            )
+            for i in range(start, stop):
+                filter_mask, chunk = chunks[i % len(chunks)]
+                dataset.id.write_direct_chunk((i - start, 0, 0), chunk, filter_mask)
+            dataset.attrs["image_nr_low"] = start + 1
+            dataset.attrs["image_nr_high"] = stop
+        data_files.append(path)
+    logger.debug(f"wrote {num_images} synthetic frames to {len(data_files)} data files")
+    metadata = {
+        "omega_incr": 0.1,
+        "count_time": 0.01,
+        "beam_center": (frame_shape[1] / 2, frame_shape[0] / 2),
+        **metadata,
+    }
+    return write_master_file(master_file_path(fpath, seq_id), data_files, num_images, **metadata)
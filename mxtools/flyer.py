@@ -2,32 +2,65 @@ import getpass
 import grp
 import logging
 import os
+import threading
 import time as ttime
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import h5py
+import numpy as np
 from ophyd.sim import NullStatus
 from ophyd.status import SubscriptionStatus
 
 from . import eiger
+from .batch import DEFAULT_PUT_TIMEOUT, PutBatch, SetpointCache
+from .settle import DEFAULT_SETTLE_TIMEOUT, wait_for_readback, wait_for_status
+from .timing import PhaseRecorder, timed
+from .zebra import frame_positions
 
 logger = logging.getLogger(__name__)
 DEFAULT_DATUM_DICT = {"data": None, "omega": None}
 
 
 class MXFlyer:
-    def __init__(self, vector, zebra, detector=None) -> None:
+    def __init__(self, vector, zebra, detector=None, frames_per_datum=None) -> None:
         self.name = "MXFlyer"
         self.vector = vector
         self.zebra = zebra
         self.detector = detector
+        # None: a single datum for all frames, eiger.PER_FILE: one datum per data file,
+        # an int N: one datum (and event) per N frames
+        self.frames_per_datum = frames_per_datum
+        # time allowed for each batch of concurrent parameter puts to complete
+        self.put_timeout = DEFAULT_PUT_TIMEOUT
+        # skips puts of parameters that did not change since the last collection,
+        # set to None to always write every parameter
+        self.setpoint_cache = SetpointCache()
+        # time allowed for the readbacks to settle, and the fixed delays to use instead
+        # (settle.FIXED_DELAYS restores the delays used before), keyed by step
+        self.settle_timeout = DEFAULT_SETTLE_TIMEOUT
+        self.fixed_delays = {}
+        # the master file metadata is read in the background as soon as the file appears,
+        # collect() waits at most metadata_timeout seconds for it, and raises if it is not read by then
+        self.metadata_timeout = DEFAULT_SETTLE_TIMEOUT
+        self.metadata_poll_period = 0.1
+        # records the duration of each phase of the collection, set to None to disable
+        self.timing = PhaseRecorder()
+        # store the omega of each frame measured by the Zebra, and its residual versus nominal;
+        # collect() raises if the Zebra has not downloaded its capture arrays within settle_timeout
+        self.measure_omega = False
 
         self._asset_docs_cache = deque()
         self._resource_uids = []
         self._datum_counter = None
         self._datum_ids = DEFAULT_DATUM_DICT
+        self._datum_ranges = None
         self._master_file = None
         self._master_metadata = []
+        self._metadata_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mxflyer-metadata")
+        self._metadata_future = None
+        self._metadata_stop = threading.Event()
 
         self._collection_dictionary = None
 
@@ -37,12 +70,15 @@ class MXFlyer:
     def describe_configuration(self):
         return {}
 
+    @timed()
     def kickoff(self):
         self.detector.stage()
+        self._start_metadata_watch()
         self.vector.go.put(1)
 
         return NullStatus()
 
+    @timed()
     def complete(self):
         def callback_motion(value, old_value, **kwargs):
             print(f"old: {old_value} -> new: {value}")
@@ -63,7 +99,7 @@ class MXFlyer:
                 "source": f"{self.detector.name}_data",
                 "dtype": "array",
                 "shape": [
-                    self.detector.cam.num_images.get(),
+                    eiger.images_per_event(self.detector, self.frames_per_datum),
                     self.detector.cam.array_size.array_size_y.get(),
                     self.detector.cam.array_size.array_size_x.get(),
                 ],
@@ -73,25 +109,45 @@ class MXFlyer:
             "omega": {
                 "source": f"{self.detector.name}_omega",
                 "dtype": "array",
-                "shape": [self.detector.cam.num_images.get()],
+                "shape": [eiger.images_per_event(self.detector, self.frames_per_datum)],
                 "dims": ["images"],
                 "external": "FILESTORE:",
             },
         }
+        if self.measure_omega:
+            for key in ("omega_measured", "omega_residual"):
+                return_dict["primary"][key] = {
+                    "source": f"{self.zebra.name}_enc4",
+                    "dtype": "array",
+                    "shape": [eiger.images_per_event(self.detector, self.frames_per_datum)],
+                    "dims": ["images"],
+                }
         return return_dict
 
+    @timed()
     def collect(self):
         self.unstage()
 
         now = ttime.time()
-        self._master_metadata = self._extract_metadata()
-        data = {f"{self.detector.name}_image": self._datum_ids["data"], "omega": self._datum_ids["omega"]}
-        yield {
-            "data": data,
-            "timestamps": {key: now for key in data},
-            "time": now,
-            "filled": {key: False for key in data},
-        }
+        self._master_metadata = self._join_metadata()
+        num_images = int(self.detector.cam.num_images.get())
+        if self._datum_ranges is None:
+            datum_ranges, frame_ranges = [self._datum_ids], [(0, num_images)]
+        else:
+            datum_ranges = self._datum_ranges
+            frame_ranges = eiger.datum_frame_ranges(self.detector, self.frames_per_datum)
+        measured = self._measured_omega(num_images) if self.measure_omega else None
+        for datum_ids, (start, stop) in zip(datum_ranges, frame_ranges):
+            data = {f"{self.detector.name}_image": datum_ids["data"], "omega": datum_ids["omega"]}
+            if measured is not None:
+                data["omega_measured"] = measured[0][start:stop].tolist()
+                data["omega_residual"] = measured[1][start:stop].tolist()
+            yield {
+                "data": data,
+                "timestamps": {key: now for key in data},
+                "time": now,
+                "filled": {key: False for key in data},
+            }
 
     # def collect_asset_docs(self):
     #     # items = list(self._asset_docs_cache)
@@ -101,6 +157,7 @@ class MXFlyer:
     #     for item in items:
     #         yield item
 
+    @timed()
     def collect_asset_docs(self):
         asset_docs_cache = []
 
@@ -112,20 +169,15 @@ class MXFlyer:
         # Generate Datum documents from scratch here, because the detector was
         # triggered externally by the DeltaTau, never by ophyd.
         resource_uid = resource["uid"]
-        # num_points = int(math.ceil(self.detector.cam.num_images.get() /
-        #                 self.detector.cam.fw_num_images_per_file.get()))
-
-        # We are currently generating only one datum document for all frames, that's why
-        #   we use the 0th index below.
-        #
-        # Uncomment & update the line below if more datum documents are needed:
-        # for i in range(num_points):
+        # By default a single datum document covers all frames. Set frames_per_datum
+        #   to generate a datum page per data key, holding a datum per frame range, instead.
 
         seq_id = self.detector.cam.sequence_id.get()
 
         self._master_file = f"{resource['root']}/{resource['resource_path']}_{seq_id}_master.h5"
         if not os.path.isfile(self._master_file):
-            raise RuntimeError(f"File {self._master_file} does not exist")
+            # The datum documents do not need the file, its metadata is read once it is written.
+            logger.info(f"File {self._master_file} does not exist yet")
 
         # The pseudocode below is from Tom Caswell explaining the relationship between resource, datum, and events.
         #
@@ -150,6 +202,15 @@ class MXFlyer:
 
         # event = {...: ..., "data": {"detector_img": "a", "omega": "b"}}
 
+        ranges = eiger.datum_frame_ranges(self.detector, self.frames_per_datum)
+        if ranges is not None:
+            pages, self._datum_ranges = eiger.generate_frame_datum_pages(
+                resource_uid, list(self._datum_ids), ranges
+            )
+            asset_docs_cache.extend(("datum_page", page) for page in pages)
+            return tuple(asset_docs_cache)
+
+        self._datum_ranges = None
         for data_key in self._datum_ids.keys():
             datum_id = f"{resource_uid}/{data_key}"
             self._datum_ids[data_key] = datum_id
@@ -161,26 +222,117 @@ class MXFlyer:
             asset_docs_cache.append(("datum", datum))
         return tuple(asset_docs_cache)
 
-    def _extract_metadata(self, field="omega"):
-        with h5py.File(self._master_file, "r") as hf:
+    @timed()
+    def _measured_omega(self, num_images):
+        """Return the omega of each frame as captured by the Zebra, and its residual versus nominal.
+
+        The nominal omega is taken at the middle of each frame, where the Zebra
+        captures the positions (the pulses are delayed by half an exposure period).
+        """
+        # the capture arrays are downloaded once the Zebra is disarmed
+        if not wait_for_readback(self.zebra.download_status, 0, timeout=self.settle_timeout):
+            raise RuntimeError(
+                f"{self.zebra.name} did not download its capture arrays within {self.settle_timeout} s, "
+                "the measured omega would be stale or partial"
+            )
+        times, positions = self.zebra.capture_arrays(encoders=[4])
+        measured = frame_positions(times, positions["enc4"], num_images)
+        omega_start = float(self.detector.cam.omega_start.get())
+        omega_incr = float(self.detector.cam.omega_incr.get())
+        nominal = omega_start + (np.arange(num_images) + 0.5) * omega_incr
+        residual = measured - nominal
+        if np.isfinite(residual).any():
+            logger.debug(f"omega residual: max {np.nanmax(np.abs(residual)):.4f} deg over {num_images} frames")
+        return measured, residual
+
+    def _extract_metadata(self, field="omega", master_file=None):
+        with h5py.File(master_file or self._master_file, "r") as hf:
             return hf.get(f"entry/sample/goniometer/{field}")[()]
 
+    def _master_file_path(self):
+        if self._master_file is not None:
+            return self._master_file
+        return f"{self.detector.file._fn}_{self.detector.cam.sequence_id.get()}_master.h5"
+
+    def _start_metadata_watch(self):
+        self._master_file = None
+        self._metadata_stop.set()  # stop the watch of a previous collection, if still running
+        self._metadata_stop = stop = threading.Event()
+        self._metadata_future = self._metadata_executor.submit(self._watch_metadata, stop)
+
+    def _watch_metadata(self, stop, field="omega"):
+        """Wait for the master file to be written and read its metadata (runs in the background)."""
+        while not stop.is_set():
+            master_file = self._master_file_path()
+            if os.path.isfile(master_file):
+                try:
+                    metadata = self._extract_metadata(field, master_file=master_file)
+                except (OSError, TypeError):
+                    # the file exists but is still being written
+                    logger.debug(f"{master_file} is not readable yet", exc_info=True)
+                else:
+                    logger.debug(f"read {field} from {master_file}")
+                    return metadata
+            stop.wait(self.metadata_poll_period)
+        return None
+
+    def _join_metadata(self):
+        if self._metadata_future is None:
+            return self._extract_metadata()
+        future, self._metadata_future = self._metadata_future, None
+        try:
+            # raises the errors of the watch, other than the file being still written
+            return future.result(timeout=self.metadata_timeout)
+        except FutureTimeoutError:
+            raise RuntimeError(
+                f"could not read the metadata of {self._master_file_path()} within {self.metadata_timeout} s"
+            ) from None
+        finally:
+            self._metadata_stop.set()
+
+    @timed()
     def unstage(self):
-        ttime.sleep(1.0)
+        # wait for the detector to finish the acquisition before restoring its settings,
+        # restoring them during the acquisition would corrupt it
+        wait_for_readback(
+            self.detector.cam.acquire,
+            0,
+            timeout=self.settle_timeout,
+            fixed_delay=self.fixed_delays.get("unstage"),
+            raise_on_timeout=True,
+        )
         self.detector.unstage()
 
+    @timed()
     def update_parameters(self, *args, **kwargs):
         self.configure_detector(**kwargs)
         self.configure_vector(**kwargs)
         self.configure_zebra(**kwargs)
 
+    @timed()
     def configure_detector(self, **kwargs):
         file_prefix = kwargs["file_prefix"]
         data_directory_name = kwargs["data_directory_name"]
         self.detector.file.external_name.put(file_prefix)
         self.detector.file.write_path_template = data_directory_name
 
+    @timed()
     def configure_vector(self, *args, **kwargs):
+        # scan encoder 0=x, 1=y,2=z,3=omega
+
+        self.vector_sync()
+        self.configure_vector_parameters(**kwargs)
+
+    def vector_sync(self):
+        self.vector.sync.put(1)
+        self.vector.expose.put(1)
+
+    def vector_release_hold(self):
+        # always written, not a cached parameter: the write itself matters to the controller
+        self.vector.hold.put(0)
+
+    @timed()
+    def configure_vector_parameters(self, release_hold=True, **kwargs):
         angle_start = kwargs["angle_start"]
         scanWidth = kwargs["scan_width"]
         imgWidth = kwargs["img_width"]
@@ -190,17 +342,16 @@ class MXFlyer:
         y_um = (kwargs["y_start_um"], kwargs["y_end_um"])
         z_um = (kwargs["z_start_um"], kwargs["z_end_um"])
 
-        # scan encoder 0=x, 1=y,2=z,3=omega
-
-        self.vector.sync.put(1)
-        self.vector.expose.put(1)
-
         if imgWidth == 0:
             angle_end = angle_start
             numImages = scanWidth
         else:
             angle_end = angle_start + scanWidth
             numImages = int(round(scanWidth / imgWidth))
+        if kwargs.get("reverse", False):
+            # move from the end to the start (used by serpentine rasters)
+            angle_start, angle_end = angle_end, angle_start
+            x_um, y_um, z_um = x_um[::-1], y_um[::-1], z_um[::-1]
         total_exposure_time = exposurePeriodPerImage * numImages
         if total_exposure_time < 1.0 and protocol != "raster":
             self.vector.buffer_time.put(1000)
@@ -214,8 +365,10 @@ class MXFlyer:
             y_um=y_um,
             z_um=z_um,
             exposure_period_per_image=exposurePeriodPerImage,
+            release_hold=release_hold,
         )
 
+    @timed()
     def configure_zebra(self, *args, **kwargs):
         angle_start = kwargs["angle_start"]
         exposurePeriodPerImage = kwargs["exposure_period_per_image"]
@@ -224,7 +377,14 @@ class MXFlyer:
         imgWidth = kwargs["img_width"]
         numImages = kwargs["num_images"]
         self.zebra_daq_prep()
-        ttime.sleep(0.5)
+        # a fixed 0.5 s sleep was used here since LSDC 1. The puts of zebra_daq_prep complete when the IOC
+        # has processed them, the arm source readback (PC_ARM_SEL:RBV) is only updated by the Zebra afterwards
+        wait_for_readback(
+            self.zebra.pc.arm.trig_source,
+            1,
+            timeout=self.settle_timeout,
+            fixed_delay=self.fixed_delays.get("zebra_prep"),
+        )
 
         PW = (exposurePeriodPerImage - detector_dead_time) * 1000
         PS = (exposurePeriodPerImage) * 1000
@@ -240,6 +400,7 @@ class MXFlyer:
             is_still=imgWidth == 0,
         )
 
+    @timed()
     def detector_arm(self, **kwargs):
         start = kwargs["angle_start"]
         width = kwargs["img_width"]
@@ -253,33 +414,41 @@ class MXFlyer:
         wavelength = kwargs["wavelength"]
         det_distance_m = kwargs["det_distance_m"]
 
-        self.detector.cam.save_files.put(1)
-        self.detector.cam.file_owner.put(getpass.getuser())
-        self.detector.cam.file_owner_grp.put(grp.getgrgid(os.getgid())[0])
-        self.detector.cam.file_perms.put(420)
         file_prefix_minus_directory = str(file_prefix)
         file_prefix_minus_directory = file_prefix_minus_directory.split("/")[-1]
 
-        self.detector.cam.acquire_time.put(exposure_per_image)
-        self.detector.cam.acquire_period.put(exposure_per_image)
-        # Trigger mode set before num_images due to updates in Eiger REST API
-        self.detector.cam.trigger_mode.put(eiger.EXTERNAL_SERIES)
-        self.detector.cam.num_images.put(num_images)
-        self.detector.cam.num_triggers.put(1)
-        self.detector.cam.file_path.put(data_directory_name)
-        self.detector.cam.fw_name_pattern.put(f"{file_prefix_minus_directory}_$id")
+        cam = self.detector.cam
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(cam.save_files, 1)
+        batch.put(cam.file_owner, getpass.getuser())
+        batch.put(cam.file_owner_grp, grp.getgrgid(os.getgid())[0])
+        batch.put(cam.file_perms, 420)
+
+        batch.put(cam.acquire_time, exposure_per_image)
+        # the Eiger checks the acquire period against the acquire time, write it once the time is set
+        batch.barrier()
+        batch.put(cam.acquire_period, exposure_per_image)
+        batch.put(cam.file_path, data_directory_name)
+        batch.put(cam.fw_name_pattern, f"{file_prefix_minus_directory}_$id")
 
-        self.detector.cam.sequence_id.put(file_number_start)
+        batch.put(cam.sequence_id, file_number_start)
 
         # originally from detector_set_fileheader
-        self.detector.cam.beam_center_x.put(x_beam)
-        self.detector.cam.beam_center_y.put(y_beam)
-        self.detector.cam.omega_incr.put(width)
-        self.detector.cam.omega_start.put(start)
-        self.detector.cam.wavelength.put(wavelength)
-        self.detector.cam.det_distance.put(det_distance_m)
+        batch.put(cam.beam_center_x, x_beam)
+        batch.put(cam.beam_center_y, y_beam)
+        batch.put(cam.omega_incr, width)
+        batch.put(cam.omega_start, start)
+        batch.put(cam.wavelength, wavelength)
+        batch.put(cam.det_distance, det_distance_m)
 
-        self.detector.file.file_write_images_per_file.put(500)
+        batch.put(self.detector.file.file_write_images_per_file, 500)
+
+        # Trigger mode set before num_images due to updates in Eiger REST API
+        batch.put(cam.trigger_mode, eiger.EXTERNAL_SERIES)
+        batch.barrier()
+        batch.put(cam.num_images, num_images)
+        batch.put(cam.num_triggers, 1)
+        batch.wait()
 
         def armed_callback(value, old_value, **kwargs):
             if old_value == 0 and value == 1:
@@ -292,35 +461,52 @@ class MXFlyer:
 
         return status
 
+    @timed()
     def setup_vector_program(
-        self, num_images, angle_start, angle_end, x_um, y_um, z_um, exposure_period_per_image
+        self, num_images, angle_start, angle_end, x_um, y_um, z_um, exposure_period_per_image, release_hold=True
     ):
-        self.vector.num_frames.put(num_images)
-        self.vector.start.omega.put(angle_start)
-        self.vector.end.omega.put(angle_end)
-        self.vector.start.x.put(x_um[0])
-        self.vector.end.x.put(x_um[1])
-        self.vector.start.y.put(y_um[0])
-        self.vector.end.y.put(y_um[1])
-        self.vector.start.z.put(z_um[0])
-        self.vector.end.z.put(z_um[1])
-        self.vector.frame_exptime.put(exposure_period_per_image * 1000.0)
-        self.vector.hold.put(0)
-
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(self.vector.num_frames, num_images)
+        batch.put(self.vector.start.omega, angle_start)
+        batch.put(self.vector.end.omega, angle_end)
+        batch.put(self.vector.start.x, x_um[0])
+        batch.put(self.vector.end.x, x_um[1])
+        batch.put(self.vector.start.y, y_um[0])
+        batch.put(self.vector.end.y, y_um[1])
+        batch.put(self.vector.start.z, z_um[0])
+        batch.put(self.vector.end.z, z_um[1])
+        batch.put(self.vector.frame_exptime, exposure_period_per_image * 1000.0)
+        batch.wait()
+        if release_hold:
+            self.vector_release_hold()
+
+    @timed()
     def zebra_daq_prep(self):
-        self.zebra.reset.put(1)
-        ttime.sleep(0.5)  # not known why this sleep is so long (done since LSDC 1)
-        self.zebra.out1.put(31)
+        # a fixed 0.5 s sleep was used here since LSDC 1, now wait for the reset record to be processed
+        # (put completion: set() would only compare the .PROC field with itself)
+        wait_for_status(
+            PutBatch(timeout=self.settle_timeout).put(self.zebra.reset, 1).execute(),
+            timeout=self.settle_timeout,
+            fixed_delay=self.fixed_delays.get("zebra_reset"),
+            what="zebra reset",
+        )
+        if self.setpoint_cache is not None:
+            # the reset changed the Zebra settings, and the monitors may not have reported it yet
+            self.setpoint_cache.invalidate(self.zebra)
         self.zebra.m1_set_pos.put(1)
         self.zebra.m2_set_pos.put(1)
         self.zebra.m3_set_pos.put(1)
-        self.zebra.pc.arm.trig_source.put(1)
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(self.zebra.out1, 31)
+        batch.put(self.zebra.pc.arm.trig_source, 1)
+        batch.wait()
 
     # expected zebra setup:
     #     time in ms
     #     Posn direction: positive
     #     gate trig source - Position
     #     pulse trig source - Time
+    @timed()
     def setup_zebra_vector_scan(
         self,
         angle_start,
@@ -332,13 +518,15 @@ class MXFlyer:
         num_images,
         is_still=False,
     ):
-        self.zebra.pc.gate.start.put(angle_start, wait=True)
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(self.zebra.pc.gate.start, angle_start)
         if is_still is False:
-            self.zebra.pc.gate.width.put(gate_width, wait=True)
-            self.zebra.pc.gate.step.put(scan_width, wait=True)
-        self.zebra.pc.gate.num_gates.put(1, wait=True)
-        self.zebra.pc.pulse.start.put(0, wait=True)
-        self.zebra.pc.pulse.width.put(pulse_width, wait=True)
-        self.zebra.pc.pulse.step.put(pulse_step, wait=True)
-        self.zebra.pc.pulse.delay.put(exposure_period_per_image / 2 * 1000, wait=True)
-        self.zebra.pc.pulse.max.put(num_images, wait=True)
+            batch.put(self.zebra.pc.gate.width, gate_width)
+            batch.put(self.zebra.pc.gate.step, scan_width)
+        batch.put(self.zebra.pc.gate.num_gates, 1)
+        batch.put(self.zebra.pc.pulse.start, 0)
+        batch.put(self.zebra.pc.pulse.width, pulse_width)
+        batch.put(self.zebra.pc.pulse.step, pulse_step)
+        batch.put(self.zebra.pc.pulse.delay, exposure_period_per_image / 2 * 1000)
+        batch.put(self.zebra.pc.pulse.max, num_images)
+        batch.wait()
@@ -24,7 +24,11 @@
     outweight the drawbacks.
 
     NOTE: given that the Governor ophyd object is created dynamically,
-    the Governor IOC *must be running* when this file runs.
+    the Governor IOC *must be running* when this file runs, unless the
+    schema (configurations, devices, states and targets) discovered by a
+    previous session is cached on disk. The classes are then built from
+    the cache and the schema is revalidated against the IOC in the
+    background (see _make_governors).
 
     The overall available auto-generated API will be as follows
     (all leafs are EpicsSignals):
@@ -83,15 +87,191 @@
     # Attempt to move the Governor to the SE state
     # (behaves as a positioner)
     RE(bps.abs_set(gov_rbt, 'SE', wait=True))
+
+    # Move to the SA state through the intermediate states, if SA
+    # is not reachable from the current state (the transitions
+    # are learned as the Governor moves, or given beforehand)
+    planner = GovernorTransitionPlanner(gov_rbt, transitions={'M': ['SE'], 'SE': ['M', 'SA'], 'SA': ['SE']})
+    RE(bps.abs_set(planner, 'SA', wait=True))
 """
 
 
+import json
+import logging
+import os
+import re
+import threading
+import time as ttime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, List
 
 from ophyd import Component as Cpt
 from ophyd import Device
 from ophyd import DynamicDeviceComponent as DDCpt
 from ophyd import EpicsSignal, EpicsSignalRO, PVPositionerPC, get_cl
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+# Overall time allowed for each level of the schema discovery (all its cagets run concurrently)
+DEFAULT_CAGET_TIMEOUT = 5.0
+# cagets slower than this are reported
+DEFAULT_SLOW_CAGET = 1.0
+MAX_CAGET_WORKERS = 32
+# Bump when the layout of the cached schema changes, older caches are then ignored
+SCHEMA_CACHE_VERSION = 1
+
+
+def _caget_many(pvnames: List[str], timeout: float = DEFAULT_CAGET_TIMEOUT, slow: float = DEFAULT_SLOW_CAGET):
+    """Fetch the values of ``pvnames`` concurrently, with one overall timeout.
+
+    Returns a dict mapping each PV name to its value, or to None if the PV
+    did not answer in time. Missing and slow PVs are logged.
+    """
+    pvnames = list(dict.fromkeys(pvnames))
+    if not pvnames:
+        return {}
+    cl = get_cl()
+    start = ttime.monotonic()
+
+    def caget(pvname):
+        value = cl.caget(pvname, timeout=timeout)
+        return value, ttime.monotonic() - start
+
+    executor = ThreadPoolExecutor(max_workers=min(len(pvnames), MAX_CAGET_WORKERS), thread_name_prefix="governor")
+    futures = {pvname: executor.submit(caget, pvname) for pvname in pvnames}
+    wait(futures.values(), timeout=timeout)
+    for future in futures.values():
+        future.cancel()  # the cagets that did not start yet (shutdown's cancel_futures needs Python 3.9)
+    executor.shutdown(wait=False)
+
+    values, missing, slow_pvs = {}, [], []
+    for pvname, future in futures.items():
+        value = elapsed = None
+        if future.done() and future.exception() is None:
+            value, elapsed = future.result()
+        values[pvname] = value
+        if value is None:
+            missing.append(pvname)
+        elif elapsed > slow:
+            slow_pvs.append(f"{pvname} ({elapsed:.2f} s)")
+    if slow_pvs:
+        logger.warning(f"slow Governor PVs: {', '.join(slow_pvs)}")
+    if missing:
+        logger.warning(f"missing Governor PVs (no answer within {timeout} s): {', '.join(missing)}")
+    logger.debug(f"fetched {len(pvnames)} Governor PVs in {ttime.monotonic() - start:.3f} s")
+    return values
+
+
+def _as_list(value) -> List[str]:
+    """cagets of string arrays return a str instead of a list when there is a single element."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def _discover_governors(prefix: str, gov_names: List[str]) -> Dict[str, dict]:
+    """Fetch the devices, states and targets of each Governor configuration.
+
+    The cagets of each level (devices and states of every configuration,
+    then targets of every device) are issued concurrently.
+    """
+    gov_prefixes = {gov_name: f"{prefix}{{Gov:{gov_name}" for gov_name in gov_names}
+    values = _caget_many(
+        [f"{gov_prefix}}}Sts:{pv}-I" for gov_prefix in gov_prefixes.values() for pv in ("Devs", "States")]
+    )
+    schema = {
+        gov_name: {
+            "devices": _as_list(values[f"{gov_prefix}}}Sts:Devs-I"]),
+            "states": _as_list(values[f"{gov_prefix}}}Sts:States-I"]),
+        }
+        for gov_name, gov_prefix in gov_prefixes.items()
+    }
+    targets_pvs = {
+        (gov_name, device): f"{gov_prefixes[gov_name]}-Dev:{device}}}Sts:Tgts-I"
+        for gov_name, gov_schema in schema.items()
+        for device in gov_schema["devices"]
+    }
+    values = _caget_many(list(targets_pvs.values()))
+    for gov_name, gov_schema in schema.items():
+        gov_schema["targets"] = {
+            device: _as_list(values[targets_pvs[(gov_name, device)]]) for device in gov_schema["devices"]
+        }
+    return schema
+
+
+def _discover_schema(prefix: str) -> Dict[str, dict]:
+    """Fetch the schema of all the Governor configurations, or return None if the IOC does not answer."""
+    configs_pv = f"{prefix}{{Gov}}Sts:Configs-I"
+    gov_names = _caget_many([configs_pv])[configs_pv]
+    if gov_names is None:
+        return None
+    # If there is only one Governor, cl.caget will return str
+    # instead of a list with a single str
+    return _discover_governors(prefix, _as_list(gov_names))
+
+
+def _schema_cache_path(prefix: str) -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "mxtools", f"governor-{re.sub(r'[^A-Za-z0-9_.-]', '_', prefix)}.json")
+
+
+def _load_schema(path: str, prefix: str) -> Dict[str, dict]:
+    """Return the schema cached at ``path``, or None if there is no valid cache for ``prefix``."""
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning(f"ignoring unreadable Governor schema cache {path}", exc_info=True)
+        return None
+    if cached.get("version") != SCHEMA_CACHE_VERSION or cached.get("prefix") != prefix:
+        logger.info(f"ignoring Governor schema cache {path} (version or prefix mismatch)")
+        return None
+    return cached["schema"]
+
+
+def _save_schema(path: str, prefix: str, schema: Dict[str, dict]) -> bool:
+    """Cache ``schema`` at ``path``. Return False, and carry on without the cache, if it cannot be written."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"version": SCHEMA_CACHE_VERSION, "prefix": prefix, "time": ttime.time(), "schema": schema}, f
+            )
+        os.replace(tmp_path, path)  # atomic, concurrent sessions never read a partial cache
+    except OSError:
+        logger.warning(f"cannot write the Governor schema cache {path}, continuing without it", exc_info=True)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _revalidate_schema(prefix: str, path: str, cached: Dict[str, dict], on_schema_change=None):
+    """Compare the cached schema with the IOC, update the cache and call the hook if it changed."""
+    try:
+        schema = _discover_schema(prefix)
+    except Exception:
+        logger.exception("failed to revalidate the Governor schema")
+        return
+    if schema is None:
+        logger.warning("the Governor IOC did not answer, keeping the cached schema")
+        return
+    if schema == cached:
+        logger.debug("the cached Governor schema is up to date")
+        return
+    logger.warning(f"the Governor schema changed, updating {path}")
+    _save_schema(path, prefix, schema)
+    if on_schema_change is not None:
+        on_schema_change(cached, schema)
 
 
 class GovernorPositioner(PVPositionerPC):
@@ -136,89 +316,248 @@ class GovernorDriver(Device):
     config = Cpt(EpicsSignal, "Config-Sel", string=True)
 
 
-class GovernorDeviceLimits(Device):
-    low = Cpt(EpicsSignal, "LLim-Pos")
-    high = Cpt(EpicsSignal, "HLim-Pos")
+class LazyGovernorDevice(Device):
+    """Base of the generated Governor devices, whose components are lazy.
+
+    A lazy component is only created, and its PVs only searched for, when it
+    is first accessed. Accessing it does not wait for the connection, which
+    is waited for when the signal is first read or written.
+    """
+
+    lazy_wait_for_connection = False
+
+    def prefetch(self, wait: bool = True, timeout: float = DEFAULT_CAGET_TIMEOUT):
+        """Create every lazy component at once, so that all their PVs are searched for concurrently.
+
+        If ``wait``, block until all of them are connected.
+        """
+        signals = [walk.item for walk in self.walk_signals(include_lazy=True)]
+        logger.debug(f"{self.name}: prefetched {len(signals)} signals")
+        if wait:
+            self.wait_for_connection(all_signals=True, timeout=timeout)
+        return signals
+
+
+class GovernorDeviceLimits(LazyGovernorDevice):
+    low = Cpt(EpicsSignal, "LLim-Pos", lazy=True)
+    high = Cpt(EpicsSignal, "HLim-Pos", lazy=True)
 
 
 def _make_governor_device(targets: List[str], states: List[str]) -> type:
     """Returns a dynamically created class that represents a
-    Governor device, with its existing targets and limits."""
-    targets_attr = [("targets", Cpt(EpicsSignal, "Sts:Tgts-I"))]
+    Governor device, with its existing targets and limits.
+    All of them are lazy, see LazyGovernorDevice."""
+    targets_attr = [("targets", Cpt(EpicsSignal, "Sts:Tgts-I", lazy=True))]
 
     # Targets of a device. A target is a named position.
     # Example PV: XF:19IDC-ES{Gov:Robot-Dev:cxy}Pos:Near-Pos
     # Target named "Near" for the cxy device.
-    target_attrs = [(f"target_{target}", Cpt(EpicsSignal, f"Pos:{target}-Pos")) for target in targets]
+    target_attrs = [(f"target_{target}", Cpt(EpicsSignal, f"Pos:{target}-Pos", lazy=True)) for target in targets]
 
     # Limits of a device for each state.
     # Example PVs: XF:19IDC-ES{Gov:Robot-Dev:cxy}SA:LLim-Pos
     #              XF:19IDC-ES{Gov:Robot-Dev:cxy}SA:HLim-Pos
     # Low and High limits for the cxy device at state SA
-    limit_attrs = [(f"at_{state}", Cpt(GovernorDeviceLimits, f"{state}:")) for state in states]
+    limit_attrs = [(f"at_{state}", Cpt(GovernorDeviceLimits, f"{state}:", lazy=True)) for state in states]
 
-    return type("GovernorDevice", (Device,), dict(targets_attr + target_attrs + limit_attrs))
+    return type("GovernorDevice", (LazyGovernorDevice,), dict(targets_attr + target_attrs + limit_attrs))
 
 
-def _make_governor(prefix: str) -> type:
+def _make_governor(prefix: str, schema: dict = None) -> type:
     """Returns a dynamically created class that represents a
     single Governor configuration (example: "Robot")
-    """
-    cl = get_cl()
 
-    # Fetch all Governor device names
-    devices: List[str] = cl.caget(f"{prefix}}}Sts:Devs-I")
+    ``schema`` holds the "devices", "states" and per-device "targets" of the
+    configuration; they are fetched from the IOC if it is not given.
+    """
+    if schema is None:
+        # Fetch all Governor device and state names, then all target names for each device
+        base, gov_name = prefix.rsplit("{Gov:", 1)
+        schema = _discover_governors(base, [gov_name])[gov_name]
 
-    # Fetch all Governor state names
-    states: List[str] = cl.caget(f"{prefix}}}Sts:States-I")
+    states: List[str] = schema["states"]
+    device_targets: Dict[str, List[str]] = schema["targets"]
 
-    # Fetch all existing target names for each device
-    device_targets: Dict[str, List[str]] = {
-        device: cl.caget(f"{prefix}-Dev:{device}}}Sts:Tgts-I") for device in devices
-    }
-
-    class Governor(GovernorPositioner, GovernorMeta):
+    class Governor(GovernorPositioner, GovernorMeta, LazyGovernorDevice):
+        # the devices are only created (and connected) when first accessed, see LazyGovernorDevice
         dev = DDCpt(
             {
                 device: (
                     _make_governor_device(targets, states),
                     f"-Dev:{device}}}",
-                    dict(),
+                    dict(lazy=True),
                 )
                 for device, targets in device_targets.items()
-            }
+            },
+            base_class=LazyGovernorDevice,
         )
 
     return Governor
 
 
-def _make_governors(prefix: str, name: str) -> "Governors":  # noqa: F821
+def _make_governors(
+    prefix: str, name: str, use_cache: bool = True, cache_path: str = None, on_schema_change=None
+) -> "Governors":  # noqa: F821
     """Returns a dynamically created object that represents
     all available Governors, and allows switching between
     them, as well as deactivating them.
-    """
-    cl = get_cl()
-
-    gov_names: List[str] = cl.caget(f"{prefix}{{Gov}}Sts:Configs-I")
-    # If there is only one Governor, cl.caget will return str
-    # instead of a list with a single str
-    if isinstance(gov_names, str):
-        gov_names = [gov_names]
 
-    try:
-        gov_prefixes: List[str] = [f"{prefix}{{Gov:{name}" for name in gov_names]
-    except:  # noqa: E722
-        # Iteration failed, likely there is no Governor available
-        gov_names = []
-        gov_prefixes = []
+    With ``use_cache``, the schema is read from the on-disk cache at
+    ``cache_path`` (by default in ``~/.cache/mxtools``) when there is one, and
+    revalidated against the IOC in a background thread. If it changed, the
+    cache is updated and ``on_schema_change(old_schema, new_schema)`` is
+    called; the object already built keeps the old schema until it is rebuilt.
+    Without a cache, the schema is fetched from the IOC and then cached.
 
-    class Governors(Device):
+    The Governor configurations and their devices are only created when
+    first accessed; ``prefetch()`` creates and connects all of them at once.
+    """
+    cache_path = cache_path or _schema_cache_path(prefix)
+    schema = _load_schema(cache_path, prefix) if use_cache else None
+    revalidate = schema is not None
+    if schema is None:
+        schema = _discover_schema(prefix)
+        if schema is None:
+            logger.warning("the Governor IOC did not answer and no schema is cached, no Governor is available")
+            schema = {}
+        elif use_cache:
+            _save_schema(cache_path, prefix, schema)
+
+    class Governors(LazyGovernorDevice):
         sel = Cpt(GovernorDriver, f"{prefix}{{Gov}}")
         gov = DDCpt(
             {
-                gov_name: (_make_governor(gov_prefix), gov_prefix, dict())
-                for gov_name, gov_prefix in zip(gov_names, gov_prefixes)
-            }
+                gov_name: (
+                    _make_governor(f"{prefix}{{Gov:{gov_name}", gov_schema),
+                    f"{prefix}{{Gov:{gov_name}",
+                    dict(lazy=True),
+                )
+                for gov_name, gov_schema in schema.items()
+            },
+            base_class=LazyGovernorDevice,
         )
 
-    return Governors("", name=name)
+    governors = Governors("", name=name)
+    governors.schema = schema
+    governors.schema_revalidation = None
+    if revalidate:
+        governors.schema_revalidation = threading.Thread(
+            target=_revalidate_schema,
+            args=(prefix, cache_path, schema, on_schema_change),
+            name="governor-schema",
+            daemon=True,
+        )
+        governors.schema_revalidation.start()
+    return governors
+
+
+class GovernorTransitionPlanner:
+    """Move a Governor to any state, through the intermediate states if needed.
+
+    The Governor only publishes the states reachable from its current state.
+    The planner remembers them for every state it has seen the Governor in,
+    which builds the graph of the transitions, and moves along the shortest
+    known path to the requested state. The graph can be seeded with the
+    transitions of the configuration, otherwise a state with no known path
+    is requested directly, and the Governor rejects it if it is not reachable.
+    The graph is dropped when the list of states changes (the Governor
+    configuration was reloaded), and the transitions from the current state
+    are read again when they change.
+
+    ``set(state)`` returns one status for the whole sequence of transitions,
+    so the planner can be used like a positioner in plans.
+
+    Parameters
+    ----------
+    governor : Governor
+        a Governor configuration, for example ``govs.gov.Robot``
+    timeout : float, optional
+        time allowed for each transition
+    transitions : dict, optional
+        the states reachable from each state, as far as known beforehand
+    """
+
+    def __init__(self, governor, timeout=None, transitions=None):
+        self.governor = governor
+        self.name = f"{governor.name}_planner"
+        self.parent = None
+        self.timeout = timeout
+        # state -> states reachable from it, the transitions read from the Governor replace the seeded ones
+        self._graph = {state: set(reachable) for state, reachable in (transitions or {}).items()}
+        self._stale = True  # the transitions from the current state must be read again
+        self._lock = threading.Lock()
+        governor.states.subscribe(self._states_changed, run=False)
+        governor.reachable.subscribe(self._reachable_changed, run=False)
+
+    def _states_changed(self, **kwargs):
+        with self._lock:
+            self._graph.clear()
+            self._stale = True
+
+    def _reachable_changed(self, **kwargs):
+        with self._lock:
+            self._stale = True
+
+    def _learn(self):
+        """Record the transitions from the current state, return the current state."""
+        state = self.governor.state.get()
+        with self._lock:
+            if self._stale or state not in self._graph:
+                self._graph[state] = set(_as_list(self.governor.reachable.get()))
+                self._stale = False
+        return state
+
+    @property
+    def graph(self) -> Dict[str, set]:
+        """The transitions known so far, by state."""
+        with self._lock:
+            return {state: set(reachable) for state, reachable in self._graph.items()}
+
+    def plan(self, target: str) -> List[str]:
+        """Return the shortest known sequence of states leading to ``target`` (empty if already there).
+
+        Without a known path, ``[target]``: the target is requested directly.
+        """
+        current = self._learn()
+        graph = self.graph
+        previous = {current: None}
+        queue = deque([current])
+        while queue:
+            state = queue.popleft()
+            if state == target:
+                path = []
+                while state != current:
+                    path.append(state)
+                    state = previous[state]
+                return path[::-1]
+            for next_state in sorted(graph.get(state, ())):
+                if next_state not in previous:
+                    previous[next_state] = state
+                    queue.append(next_state)
+        if target not in _as_list(self.governor.states.get()):
+            raise ValueError(f"{self.governor.name}: unknown state {target!r}")
+        logger.info(
+            f"{self.governor.name}: no known transitions from {current!r} to {target!r}, requesting it directly "
+            f"(known transitions: {graph})"
+        )
+        return [target]
+
+    def set(self, target: str) -> Status:
+        """Move to ``target`` along the shortest known path, return the status of the whole move."""
+        path = self.plan(target)
+        status = Status(obj=self)
+        logger.info(f"{self.governor.name}: {' -> '.join([self.governor.state.get(), *path])}")
+
+        def run():
+            try:
+                for state in path:
+                    self.governor.set(state).wait(self.timeout)
+                    self._learn()
+            except Exception as exc:
+                logger.warning(f"{self.governor.name}: transition to {target!r} failed: {exc!r}")
+                status.set_exception(exc)
+            else:
+                status.set_finished()
+
+        threading.Thread(target=run, name="governor-transitions", daemon=True).start()
+        return status
@@ -1,18 +1,357 @@
 import logging
+import os
 import pathlib
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import dask.array as da
 import h5py
+import numpy as np
 from area_detector_handlers import HandlerBase
+from dask.base import tokenize
+
+try:
+    import bitshuffle
+except ImportError:  # only needed by the "direct" reader
+    bitshuffle = None
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 128
+
+# HDF5 filter id registered for bitshuffle, and its LZ4 compression option,
+# as written by the Eiger file writer with compression_algo = "BS LZ4".
+BSHUF_FILTER_ID = 32008
+BSHUF_LZ4 = 2
+
+
+class H5FilePool:
+    """Process-wide, size-bounded LRU pool of read-only HDF5 files.
+
+    Files are keyed by their absolute path. When the pool is full, the least
+    recently used file is dropped. Read through :meth:`file`, which pins the
+    file for the duration of the ``with`` block: a pinned file that is
+    evicted meanwhile (by another thread) is only closed once its last user
+    releases it. Objects obtained from the file must not be kept beyond the
+    block: hold on to the path instead and re-open it through the pool,
+    which is cheap on a hit.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        maximum number of files kept open at the same time, not counting
+        evicted files that are still in use
+    """
+
+    def __init__(self, maxsize=DEFAULT_POOL_SIZE):
+        self._maxsize = int(maxsize)
+        self._files = OrderedDict()
+        self._users = {}  # id(file) -> number of with blocks using it
+        self._evicted = {}  # id(file) -> file evicted while in use, closed on its last release
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(path):
+        return str(pathlib.Path(path).absolute())
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        with self._lock:
+            self._maxsize = int(value)
+            self._trim()
+
+    def open(self, path):
+        """Return an open ``h5py.File`` for ``path``, opening it if needed.
+
+        The file is not pinned, so it may be closed by any later call to the
+        pool: use :meth:`file` to read from it.
+        """
+        key = self._key(path)
+        with self._lock:
+            file = self._files.get(key)
+            if file is not None and file.id.valid:
+                self._files.move_to_end(key)
+                self.hits += 1
+                return file
+            self.misses += 1
+            file = h5py.File(key, "r")
+            self._files[key] = file
+            self._trim()
+            return file
+
+    @contextmanager
+    def file(self, path):
+        """Open ``path`` through the pool and keep it open until the end of the ``with`` block."""
+        with self._lock:
+            file = self.open(path)
+            self._users[id(file)] = self._users.get(id(file), 0) + 1
+        try:
+            yield file
+        finally:
+            self._release(file)
+
+    def _release(self, file):
+        with self._lock:
+            users = self._users[id(file)] - 1
+            if users:
+                self._users[id(file)] = users
+                return
+            del self._users[id(file)]
+            if self._evicted.pop(id(file), None) is not None:
+                self._close(file)
+
+    def evict(self, path):
+        """Drop ``path`` from the pool and close it (once no longer in use). Return True if it was open."""
+        with self._lock:
+            file = self._files.pop(self._key(path), None)
+            if file is None:
+                return False
+            self._retire(file)
+            return True
+
+    def clear(self):
+        """Close every file in the pool (those in use once released)."""
+        with self._lock:
+            while self._files:
+                _, file = self._files.popitem(last=False)
+                self._retire(file)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._files),
+                "maxsize": self._maxsize,
+                "in_use": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._key(path) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def _trim(self):
+        while len(self._files) > max(self._maxsize, 0):
+            key, file = self._files.popitem(last=False)
+            logger.debug(f"evicting {key} from the HDF5 file pool")
+            self.evictions += 1
+            self._retire(file)
+
+    def _retire(self, file):
+        """Close a file dropped from the pool, or defer it to its last release if it is in use."""
+        if id(file) in self._users:
+            self._evicted[id(file)] = file
+        else:
+            self._close(file)
+
+    @staticmethod
+    def _close(file):
+        try:
+            file.close()
+        except Exception:  # the file may already be gone, nothing to release then
+            logger.debug("failed to close an HDF5 file", exc_info=True)
+
+
+FILE_POOL = H5FilePool()
+
+
+class PooledDataset:
+    """Array-like view of an HDF5 dataset that re-opens its file through a pool.
+
+    It exposes ``shape``, ``dtype``, ``ndim`` and ``__getitem__``, which is
+    everything ``dask.array.from_array`` needs, and never holds a reference
+    to the ``h5py.File`` between reads, so the pool is free to evict it.
+    """
+
+    def __init__(self, path, name, pool=None):
+        self.path = str(path)
+        self.name = name
+        self.pool = FILE_POOL if pool is None else pool
+        with self.pool.file(self.path) as file:
+            dataset = file[self.name]
+            self.shape = dataset.shape
+            self.dtype = dataset.dtype
+            self.chunks = dataset.chunks
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, item):
+        with self.pool.file(self.path) as file:
+            return file[self.name][item]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r}, {self.name!r}, shape={self.shape}, dtype={self.dtype})"
+
+
+def _chunk_codec(dataset):
+    """Return "raw" or "bslz4" if the chunks of ``dataset`` can be decoded
+    without the HDF5 filter pipeline, None otherwise."""
+    plist = dataset.id.get_create_plist()
+    filters = [plist.get_filter(i) for i in range(plist.get_nfilters())]
+    if not filters:
+        return "raw"
+    if len(filters) == 1:
+        code, _, values, _ = filters[0]
+        if code == BSHUF_FILTER_ID and len(values) > 4 and values[4] == BSHUF_LZ4:
+            return "bslz4"
+    return None
+
+
+def _decode_chunk(raw, filter_mask, codec, shape, dtype):
+    if codec == "bslz4" and not filter_mask & 1:
+        # Chunk header: uncompressed size (uint64) and block size in bytes (uint32), big endian.
+        _, block_size = struct.unpack(">QI", raw[:12])
+        buffer = np.frombuffer(raw, dtype=np.uint8, offset=12)
+        return bitshuffle.decompress_lz4(buffer, shape, dtype, block_size // dtype.itemsize)
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+class DirectChunkReader:
+    """Read frames from Eiger data files chunk by chunk.
+
+    Raw chunks are read with HDF5 direct chunk read, which skips the
+    single-threaded filter pipeline, and decompressed in a thread pool.
+    bitshuffle releases the GIL while decompressing, so the decompression of
+    consecutive chunks runs in parallel while the next ones are being read.
+
+    Parameters
+    ----------
+    workers : int, optional
+        number of decompression threads, defaults to the number of CPUs
+    pool : H5FilePool, optional
+        pool used to open the data files, defaults to the process-wide one
+    """
+
+    def __init__(self, workers=None, pool=None):
+        if bitshuffle is None:
+            raise ImportError("The direct chunk reader requires the 'bitshuffle' package")
+        self.workers = workers or os.cpu_count()
+        self.pool = FILE_POOL if pool is None else pool
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="eiger-decompress"
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def read_frames(self, path, name, frames):
+        """Return the frames with the given indices of a 3D dataset as a NumPy array."""
+        frames = np.asarray(frames, dtype=np.intp).reshape(-1)
+        with self.pool.file(path) as file:
+            return self._read_frames(file[name], frames)
+
+    def _read_frames(self, dataset, frames):
+        out = np.empty((len(frames), *dataset.shape[1:]), dtype=dataset.dtype)
+        if not len(frames):
+            return out
+        chunk_shape = dataset.chunks
+        codec = _chunk_codec(dataset)
+        if codec is None or chunk_shape is None or tuple(chunk_shape[1:]) != tuple(dataset.shape[1:]):
+            # Compressed with another filter, or not chunked frame by frame: let HDF5 handle it.
+            logger.debug(f"{dataset.file.filename}:{dataset.name} cannot be read chunk by chunk, using h5py")
+            unique, inverse = np.unique(frames, return_inverse=True)
+            out[:] = dataset[unique][inverse]
+            return out
+
+        chunk_index = frames // chunk_shape[0]
+        futures = []
+        for index in np.unique(chunk_index):
+            offset = (int(index) * chunk_shape[0],) + (0,) * (dataset.ndim - 1)
+            filter_mask, raw = dataset.id.read_direct_chunk(offset)
+            future = self.executor.submit(_decode_chunk, raw, filter_mask, codec, chunk_shape, dataset.dtype)
+            futures.append((index, future))
+        for index, future in futures:
+            selected = chunk_index == index
+            out[selected] = future.result()[frames[selected] - index * chunk_shape[0]]
+        return out
+
+
+class DirectChunkDataset(PooledDataset):
+    """Same as :class:`PooledDataset`, but frames are read by a :class:`DirectChunkReader`."""
+
+    def __init__(self, path, name, reader, pool=None):
+        super().__init__(path, name, pool=pool)
+        self.reader = reader
+
+    def __getitem__(self, item):
+        item = item if isinstance(item, tuple) else (item,)
+        frames = np.arange(self.shape[0])[item[0]]
+        data = self.reader.read_frames(self.path, self.name, frames)
+        if np.ndim(frames) == 0:
+            return data[0][item[1:]]
+        return data[(slice(None),) + item[1:]]
+
 
 class EigerHandlerMX(HandlerBase):
+    """Handler for the Eiger files written during MX collections.
+
+    Parameters
+    ----------
+    fpath : str
+        file prefix, the master file is ``{fpath}_{seq_id}_master.h5``
+    seq_id : int
+        sequence id of the acquisition
+    pool : H5FilePool, optional
+        pool used to open the files, defaults to the process-wide one
+    chunks_per_block : int, optional
+        number of native HDF5 chunks read by each dask task
+    reader : {"h5py", "direct"}, optional
+        "direct" reads the data files with a :class:`DirectChunkReader`
+    workers : int, optional
+        number of decompression threads of the "direct" reader
+    images_per_file : int, optional
+        number of frames per data file, as set with ``file_write_images_per_file``.
+        Used to build the frame index without opening any data file.
+    """
+
     spec = "AD_EIGER_MX"
 
-    def __init__(self, fpath, seq_id):
+    def __init__(
+        self, fpath, seq_id, pool=None, chunks_per_block=1, reader="h5py", workers=None, images_per_file=None
+    ):
         self._seq_id = seq_id
+        self._images_per_file = images_per_file
+        self._sources = None
+        self._frame_offsets = None
+        self._chunks_per_block = max(int(chunks_per_block), 1)
+        self._pool = FILE_POOL if pool is None else pool
+        if reader == "direct":
+            self._reader = DirectChunkReader(workers=workers, pool=self._pool)
+        elif reader == "h5py":
+            self._reader = None
+        else:
+            raise ValueError(f"Unknown reader: {reader}")
         # From https://github.com/bluesky/area-detector-handlers/blob/0f47155b31a6b4bf92c1c2b6fe98b5f141194c78/area_detector_handlers/eiger.py#L84  # noqa
         #
         #         master_path = Path(f'{self._file_prefix}_{seq_id}_master.h5').absolute()
@@ -21,34 +360,147 @@ class EigerHandlerMX(HandlerBase):
         if not self._fpath.is_file():
             raise RuntimeError(f"File {self._fpath} does not exist")
 
-        # print(f"Eiger master file: {self._fpath}")  # TODO make this a logging debug message
+        logger.debug(f"Eiger master file: {self._fpath}")
+
+    def _file(self):
+        """The master file, pinned in the pool for the duration of the ``with`` block."""
+        return self._pool.file(self._fpath)
+
+    def _is_instrument_key(self, data_key):
+        with self._file() as file:
+            return data_key in file["entry"]["instrument"]
+
+    def _data_sources(self):
+        """Return (path, dataset name) of each data file, resolving external links
+        so that the data files are opened through the pool too."""
+        if self._sources is not None:
+            return self._sources
+        sources = []
+        with self._file() as file:
+            group = file["entry"]["data"]
+            for k in group:
+                link = group.get(k, getlink=True)
+                if isinstance(link, h5py.ExternalLink):
+                    path = self._fpath.parent / link.filename
+                    sources.append((path, link.path))
+                else:
+                    sources.append((self._fpath, group[k].name))
+        self._sources = sources
+        return sources
+
+    def _frame_index(self):
+        """Return the cumulative frame offsets of the data files.
+
+        ``offsets[i]`` is the first frame of data file ``i`` and ``offsets[-1]``
+        the total number of frames. It is computed once per resource, from the
+        master file metadata when possible, so that no data file is opened.
+        """
+        if self._frame_offsets is not None:
+            return self._frame_offsets
+        sources = self._data_sources()
+        with self._file() as file:
+            specific = file["entry"]["instrument"].get("detector/detectorSpecific", {})
+            counts = [int(specific[key][()]) for key in ("nimages", "ntrigger") if key in specific]
+        if len(counts) == 2 and sources:
+            total = counts[0] * counts[1]
+            per_file = self._images_per_file or PooledDataset(*sources[0], pool=self._pool).shape[0]
+            offsets = np.minimum(np.arange(len(sources) + 1) * int(per_file), total)
+        else:
+            sizes = [PooledDataset(path, name, pool=self._pool).shape[0] for path, name in sources]
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self._frame_offsets = offsets.astype(np.int64)
+        return self._frame_offsets
+
+    def _select_frames(self, frames):
+        """Return a dask array with the selected frames, opening only the data files that hold them."""
+        offsets = self._frame_index()
+        indices = np.arange(offsets[-1])[frames]
+        if np.ndim(indices) == 0:
+            file_index = np.searchsorted(offsets, indices, side="right") - 1
+            return self._data_array(*self._data_sources()[file_index])[int(indices - offsets[file_index])]
+
+        file_index = np.searchsorted(offsets, indices, side="right") - 1
+        temp = []
+        # Consecutive runs of frames from the same file, so that the requested order is kept.
+        boundaries = np.flatnonzero(np.diff(file_index)) + 1
+        for run in np.split(np.arange(len(indices)), boundaries):
+            if not len(run):
+                continue
+            index = file_index[run[0]]
+            local = indices[run] - offsets[index]
+            steps = np.unique(np.diff(local))
+            if len(steps) == 1 and steps[0] > 0:
+                local = slice(int(local[0]), int(local[-1]) + 1, int(steps[0]))
+            elif len(local) == 1:
+                local = slice(int(local[0]), int(local[0]) + 1)
+            temp.append(self._data_array(*self._data_sources()[index])[local])
+        if not temp:
+            return self._data_array(*self._data_sources()[0])[:0]
+        return da.concatenate(temp, axis=0)
+
+    def _block_chunks(self, dataset):
+        """Dask chunks matching the native HDF5 chunk layout of ``dataset``.
+
+        Along the frame axis, ``chunks_per_block`` native chunks are grouped in
+        one task. Contiguous datasets are split one frame per task.
+        """
+        native = dataset.chunks or (1, *dataset.shape[1:])
+        return (native[0] * self._chunks_per_block, *native[1:])
+
+    def _data_array(self, path, name):
+        if self._reader is None:
+            dataset = PooledDataset(path, name, pool=self._pool)
+        else:
+            dataset = DirectChunkDataset(path, name, self._reader, pool=self._pool)
+        return da.from_array(
+            dataset,
+            chunks=self._block_chunks(dataset),
+            name=f"eiger-mx-{tokenize(type(dataset), dataset.path, name, dataset.shape, self._chunks_per_block)}",
+        )
+
+    def __call__(
+        self, data_key="data", frame_num=None, frame_start=None, frame_stop=None, reverse=False, **kwargs
+    ):
+        """Return the data for ``data_key`` as a dask array.
+
+        ``frame_num`` (an index or a slice) or ``frame_start``/``frame_stop``
+        select frames of ``data`` and ``omega``. ``reverse`` returns them last
+        frame first, as for the rows of a serpentine raster scanned backwards.
+        """
+        if reverse and data_key in ("data", "omega"):
+            return self(data_key, frame_num, frame_start, frame_stop, **kwargs)[::-1]
+        if frame_num is None and (frame_start is not None or frame_stop is not None):
+            frame_num = slice(frame_start, frame_stop)
 
-    def __call__(self, data_key="data", **kwargs):
-        self._file = h5py.File(self._fpath, "r")  # but make it cached
+        if data_key == "data" and frame_num is not None:
+            return self._select_frames(frame_num)
 
-        if data_key == "data":
+        elif data_key == "data":
             temp = []
-            group = self._file["entry"]["data"]
-            for i, k in enumerate(group):
-                reta = da.from_array(group[k])
-                logger.debug(f"{i} {reta.shape}")
+            for i, (path, name) in enumerate(self._data_sources()):
+                reta = self._data_array(path, name)
+                logger.debug(f"{i} {reta.shape} {reta.chunksize}")
                 temp.append(reta)
 
-            ret = da.stack(temp)
-            newret = ret.reshape(-1, *ret.shape[-2:])
-            logger.debug(f"{newret.shape}")
-            return newret
+            # The data files may hold different numbers of frames (the last one usually
+            # does), and concatenating along the frame axis keeps the native chunk layout.
+            ret = da.concatenate(temp, axis=0)
+            logger.debug(f"{ret.shape}")
+            return ret
 
         elif data_key == "omega":
-            return da.from_array(self._file["entry"]["sample"]["goniometer"][data_key])
+            omega = da.from_array(
+                PooledDataset(self._fpath, f"entry/sample/goniometer/{data_key}", pool=self._pool)
+            )
+            return omega if frame_num is None else omega[frame_num]
 
         elif data_key == "bit_mask":
             ...
             # code to pull out bit mask
             raise NotImplementedError()
 
-        elif data_key in self._file["entry"]["instrument"]:
-            return da.from_array(self._file["entry"]["instrument"][data_key])
+        elif self._is_instrument_key(data_key):
+            return da.from_array(PooledDataset(self._fpath, f"entry/instrument/{data_key}", pool=self._pool))
 
         else:
             raise RuntimeError(f"Unknown key: {data_key}")
@@ -0,0 +1,261 @@
+import logging
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .eiger_files import DATA_DATASET, data_file_path
+from .handlers import FILE_POOL, DirectChunkReader, PooledDataset
+from .raster_flyer import grid_order
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 10
+DEFAULT_FRAMES_PER_TASK = 50
+
+
+def _valid_pixels(frames):
+    """The Eiger marks dead and hot pixels with the largest value of the data type."""
+    if np.issubdtype(frames.dtype, np.integer):
+        return frames < np.iinfo(frames.dtype).max
+    return np.isfinite(frames)
+
+
+def pixels_over_threshold(frames, threshold=DEFAULT_THRESHOLD):
+    """Score each frame by its number of (valid) pixels with more than ``threshold`` counts."""
+    frames = np.asarray(frames)
+    return np.count_nonzero((frames > threshold) & _valid_pixels(frames), axis=(1, 2))
+
+
+def ring_counts(frames, mask, threshold=0):
+    """Score each frame by the counts above ``threshold`` integrated over the pixels of ``mask``."""
+    pixels = np.asarray(frames)[:, mask]
+    selected = (pixels > threshold) & _valid_pixels(pixels)
+    return np.where(selected, pixels, 0).sum(axis=1, dtype=np.int64)
+
+
+def resolution_ring_mask(shape, beam_center, pixel_size, distance, wavelength, d_min, d_max):
+    """Return the mask of the pixels between the resolutions ``d_max`` and ``d_min``.
+
+    ``beam_center`` is (x, y) in pixels, ``pixel_size`` and ``distance`` are in
+    the same unit (usually mm) and ``wavelength``, ``d_min`` and ``d_max`` in Å.
+    """
+    y, x = np.indices(shape, dtype=float)
+    radius = np.hypot((x - beam_center[0]) * pixel_size, (y - beam_center[1]) * pixel_size)
+    theta = np.arctan2(radius, distance) / 2
+    with np.errstate(divide="ignore"):
+        d_spacing = wavelength / (2 * np.sin(theta))
+    return (d_spacing >= d_min) & (d_spacing <= d_max)
+
+
+class RasterHitScorer:
+    """Score the frames of a raster scan while the Eiger writes them.
+
+    A background thread follows the data files of the acquisition, in the
+    order they are written, and submits each complete file to a worker pool,
+    ``frames_per_task`` frames per task. Each task reads its frames and scores
+    them at once with ``score``. The scores are placed in a heat map of shape
+    (``num_rows``, ``num_columns``), in grid order, and every subscriber is
+    called with the heat map each time more frames are scored. Cells not
+    scored yet are NaN.
+
+    The master file is not needed, as it may only be written at the end of the
+    acquisition. Use :meth:`from_flyer` to create a scorer for the grid of an
+    :class:`MXRasterFlyer`. :meth:`close` (or leaving a ``with`` block) stops
+    the scorer and its worker threads.
+
+    Parameters
+    ----------
+    fpath : str
+        file prefix, the data files are ``{fpath}_{seq_id}_data_{index:06d}.h5``
+    seq_id : int
+        sequence id of the acquisition
+    num_rows, num_columns : int
+        grid shape, frames are acquired row by row
+    images_per_file : int
+        number of frames per data file
+    serpentine : bool, optional
+        True if odd rows were scanned backwards
+    score : callable, optional
+        takes a (frames, rows, columns) array and returns one score per frame,
+        defaults to :func:`pixels_over_threshold`
+    workers : int, optional
+        number of scoring threads
+    reader : {"h5py", "direct"}, optional
+        "direct" reads the frames with a :class:`DirectChunkReader`
+    pool : H5FilePool, optional
+        pool used to open the data files, defaults to the process-wide one
+    """
+
+    def __init__(
+        self,
+        fpath,
+        seq_id,
+        num_rows,
+        num_columns,
+        images_per_file,
+        serpentine=False,
+        score=None,
+        workers=None,
+        reader="h5py",
+        pool=None,
+        frames_per_task=DEFAULT_FRAMES_PER_TASK,
+        poll_period=0.1,
+    ):
+        self.fpath = pathlib.Path(fpath)
+        self.seq_id = int(seq_id)
+        self.shape = (int(num_rows), int(num_columns))
+        self.num_images = self.shape[0] * self.shape[1]
+        self.images_per_file = int(images_per_file)
+        self.score = pixels_over_threshold if score is None else score
+        self.frames_per_task = max(int(frames_per_task), 1)
+        self.poll_period = poll_period
+        self.pool = FILE_POOL if pool is None else pool
+        self._reader = DirectChunkReader(pool=self.pool) if reader == "direct" else None
+        # grid_order maps grid cells to frames, scores are placed with its inverse
+        self._cells = np.argsort(grid_order(*self.shape, serpentine=serpentine))
+        self._scores = np.full(self.num_images, np.nan)
+        self._scored = 0
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="raster-score")
+        self._futures = []
+        self._stop = threading.Event()
+        self._follower = None
+
+    @classmethod
+    def from_flyer(cls, flyer, **kwargs):
+        """Create a scorer for the raster of ``flyer`` and the files of its current arm."""
+        layout = flyer.grid_layout()
+        return cls(
+            layout["fpath"],
+            layout["seq_id"],
+            num_rows=layout["num_rows"],
+            num_columns=layout["num_columns"],
+            images_per_file=layout["images_per_file"],
+            serpentine=layout["serpentine"],
+            **kwargs,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def subscribe(self, callback):
+        """Call ``callback(heat_map)`` each time more frames are scored."""
+        self._subscribers.append(callback)
+        return callback
+
+    def start(self):
+        """Start following the data files in the background."""
+        self._stop.clear()
+        self._follower = threading.Thread(target=self._follow, name="raster-score-follow", daemon=True)
+        self._follower.start()
+        return self
+
+    def stop(self):
+        """Stop following the data files, the frames already submitted are still scored."""
+        self._stop.set()
+
+    def close(self):
+        """Stop following the data files, drop the frames not scored yet and stop the worker threads."""
+        self.stop()
+        if self._follower is not None:
+            self._follower.join()
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def wait(self, timeout=None):
+        """Wait until all the frames are scored. Return True if they all are."""
+        if self._follower is not None:
+            self._follower.join(timeout)
+        for future in list(self._futures):
+            future.result(timeout)
+        return self.done
+
+    @property
+    def done(self):
+        with self._lock:
+            return self._scored == self.num_images
+
+    @property
+    def scores(self):
+        """Scores of the frames, in acquisition order."""
+        with self._lock:
+            return self._scores.copy()
+
+    @property
+    def heat_map(self):
+        """Scores of the grid cells, indexed by row and column."""
+        with self._lock:
+            return self._heat_map()
+
+    def best(self):
+        """Return (row, column, score) of the best cell scored so far, or None."""
+        heat_map = self.heat_map
+        if np.all(np.isnan(heat_map)):
+            return None
+        row, column = np.unravel_index(np.nanargmax(heat_map), heat_map.shape)
+        return int(row), int(column), heat_map[row, column]
+
+    def data_file(self, index):
+        """Path of the data file ``index`` (counted from 1, like the Eiger does)."""
+        return data_file_path(self.fpath, self.seq_id, index)
+
+    def _heat_map(self):
+        return self._scores[self._cells].reshape(self.shape)
+
+    def _follow(self):
+        num_files = -(-self.num_images // self.images_per_file)
+        index = 1
+        while index <= num_files and not self._stop.is_set():
+            start = (index - 1) * self.images_per_file
+            stop = min(start + self.images_per_file, self.num_images)
+            if not self._file_complete(self.data_file(index), stop - start):
+                self._stop.wait(self.poll_period)
+                continue
+            for task_start in range(start, stop, self.frames_per_task):
+                task_stop = min(task_start + self.frames_per_task, stop)
+                future = self._executor.submit(
+                    self._score_frames, self.data_file(index), start, task_start, task_stop
+                )
+                self._futures.append(future)
+            index += 1
+
+    def _file_complete(self, path, num_frames):
+        if not path.is_file():
+            return False
+        try:
+            written = PooledDataset(path, DATA_DATASET, pool=self.pool).shape[0]
+        except (OSError, KeyError):
+            # the file exists but is still being written
+            self.pool.evict(path)
+            return False
+        if written < num_frames:
+            self.pool.evict(path)
+            return False
+        return True
+
+    def _score_frames(self, path, file_start, start, stop):
+        local = np.arange(start - file_start, stop - file_start)
+        if self._reader is not None:
+            frames = self._reader.read_frames(path, DATA_DATASET, local)
+        else:
+            first, last = local[0], local[-1]
+            with self.pool.file(path) as file:
+                frames = file[DATA_DATASET][slice(first, last + 1)]
+        scores = np.asarray(self.score(frames), dtype=float)
+        with self._lock:
+            self._scores[start:stop] = scores
+            self._scored += stop - start
+            heat_map = self._heat_map()
+        logger.debug(f"scored frames {start}-{stop} of {path}")
+        for callback in self._subscribers:
+            try:
+                callback(heat_map)
+            except Exception:
+                logger.exception(f"heat map subscriber {callback!r} failed")
@@ -2,46 +2,328 @@ import getpass
 import grp
 import logging
 import os
+import pathlib
+import threading
 import time as ttime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from ophyd.sim import NullStatus
-from ophyd.status import SubscriptionStatus
+from ophyd.status import Status, SubscriptionStatus
 
 from . import eiger
+from .batch import PutBatch
 from .flyer import MXFlyer
+from .settle import wait_for_readback
+from .timing import timed
 
 logger = logging.getLogger(__name__)
 
+# Zebra position capture arrays stored with each row, by data key.
+ROW_ENCODERS = {"zebra_x": "enc1", "zebra_y": "enc2", "zebra_z": "enc3", "zebra_omega": "enc4"}
+
+
+def grid_order(num_rows, num_columns, serpentine=False):
+    """Return the indices that put frames acquired row by row in grid order.
+
+    ``frames[grid_order(num_rows, num_columns, serpentine)]`` is in grid order
+    (every row from its first to its last column) whether or not the odd
+    rows were scanned backwards.
+    """
+    order = np.arange(num_rows * num_columns).reshape(num_rows, num_columns)
+    if serpentine:
+        order[1::2] = order[1::2, ::-1]
+    return order.reshape(-1)
+
 
 class MXRasterFlyer(MXFlyer):
-    def __init__(self, vector, zebra, detector) -> None:
-        self.name = "MXRasterFlyer"
+    """Flyer for raster scans, one row per kickoff/complete cycle.
+
+    With ``pipelined=True``, ``update_parameters`` for the next row can be called
+    right after ``kickoff`` of the current one: the vector program setpoints
+    of the next row (positions, number of frames, exposure and buffer time)
+    are then written in the background as soon as the controller has started
+    (and so latched) the current row. The Zebra pulse count, the vector
+    sync/expose commands and the release of the vector hold, which would
+    disturb the current row, are deferred to the next ``kickoff``.
+
+    With ``serpentine=True``, odd rows are scanned backwards (from the end to
+    the start of the row, with the Zebra position compare in the negative
+    direction), which saves the move back to the start of each row. The
+    documents are still in grid order: the datum of a row scanned backwards
+    has ``reverse=True``, for the handler to return its frames last first,
+    and its Zebra positions are reversed in the event. Use :func:`grid_order`
+    to put the frames of the data files, in acquisition order, in grid order.
+
+    After :meth:`configure_grid`, a single ``kickoff``/``complete`` cycle covers
+    the whole grid, with the detector armed once and the rows started one
+    after the other by a host-side scheduler.
+
+    Each ``detector_arm`` produces one resource for the Eiger files it writes,
+    and each row that ran one datum (its frame range in these files) and one
+    event, with the Zebra encoder positions captured during the row. The
+    events of all the rows done since the last ``collect`` are emitted as one
+    event page by :meth:`collect_pages`, in the ``raster`` stream.
+    """
+
+    def __init__(self, vector, zebra, detector, pipelined=False, serpentine=False) -> None:
         super().__init__(vector, zebra, detector)
+        self.name = "MXRasterFlyer"  # set after MXFlyer.__init__, which sets its own name
+        self.pipelined = pipelined
+        self.serpentine = serpentine
+        self._row_directions = {}  # row_index -> True if the row was scanned backwards
+        self._row_started = threading.Event()
+        self._row_done = threading.Event()
+        self._row_done.set()
+        self._row_status = None
+        self._current_row = None
+        self._staged_row = None
+        self._grid_rows = None
+        self._grid_status = None
+        self._grid_stop = threading.Event()
+        self._next_row = None
+        self._resource = None  # (resource document, emitted) of the current arm
+        self._total_num_images = None
+        self._frame_offset = 0
+        self._rows_started = 0
+        self._rows = []  # the rows run since the last collect
+        self._row_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raster-row")
 
+    @timed()
     def kickoff(self):
+        if self._grid_rows is not None:
+            return self._start_grid()
         # ttime.sleep(0.2)  # TODO see if vector starts ok without this sleep
+        if self._staged_row is not None:
+            self._apply_staged_row()
+        self._watch_row()
+        self._current_row = self._start_row(self._next_row or {})
         self.vector.go.put(1)
         return NullStatus()
 
+    def complete(self):
+        """Finish once the row has moved and its Zebra positions are stored."""
+        if self._grid_status is not None:
+            return self._grid_status
+        record = self._current_row
+        status = Status(obj=self)
+
+        def finish_row(motion_status):
+            try:
+                if not motion_status.success:
+                    raise motion_status.exception() or RuntimeError("the row did not complete")
+                self._finish_row(record)
+            except Exception as exc:
+                status.set_exception(exc)
+            else:
+                status.set_finished()
+
+        def motion_done(motion_status):
+            self._row_done.set()
+            # not in the callback thread, which delivers the download status updates waited for
+            threading.Thread(target=finish_row, args=(motion_status,), name="raster-row-data", daemon=True).start()
+
+        super().complete().add_callback(motion_done)
+        return status
+
+    def _watch_row(self):
+        """Track when the row that is about to start is running, and when it is done."""
+        if self._row_status is not None and not self._row_status.done:
+            self._row_status.set_finished()  # stop watching the previous row
+        self._row_started = started = threading.Event()
+        self._row_done.clear()
+        done = self._row_done
+
+        def row_state(value, **kwargs):
+            if value == 1:
+                started.set()
+            elif value == 0 and started.is_set():
+                done.set()
+                return True
+            return False
+
+        self._row_status = SubscriptionStatus(self.vector.active, row_state, run=False)
+
+    @timed()
+    def configure_grid(self, rows, **kwargs):
+        """Describe the whole grid up front, for a single kickoff/complete cycle.
+
+        ``rows`` is a list of dicts with the parameters that change from row
+        to row (typically the ``*_start_um``/``*_end_um`` positions), ``kwargs``
+        the parameters shared by all rows. The first row is configured now,
+        including the Zebra. On ``kickoff``, a host-side scheduler then starts
+        the rows one after the other and writes the vector parameters of the
+        next row as soon as the current one is running, so that between rows
+        only the vector sync and go commands remain (plus the Zebra pulse count
+        and direction, when they change). ``complete`` finishes after the last row.
+
+        The detector is armed once for the whole grid by ``detector_arm``.
+        """
+        self._grid_rows = [{**kwargs, **row, "row_index": i} for i, row in enumerate(rows)]
+        self._grid_status = None
+        self.update_parameters(**self._grid_rows[0])
+
+    def clear_grid(self):
+        """Go back to one kickoff/complete cycle per row."""
+        self._grid_rows = None
+        self._grid_status = None
+
+    def stop(self, *, success=False):
+        """Do not start any further row of the grid."""
+        self._grid_stop.set()
+
+    def _start_grid(self):
+        self._grid_stop = threading.Event()
+        self._grid_status = status = Status(obj=self)
+        started = Status(obj=self)
+        if self.timing is not None:
+            self.timing.track_status(f"{self.name}.grid", status)
+
+        def run():
+            try:
+                self._run_grid(started)
+            except Exception as exc:
+                logger.exception("raster grid failed")
+                for st in (started, status):
+                    if not st.done:
+                        st.set_exception(exc)
+            else:
+                status.set_finished()
+
+        threading.Thread(target=run, name="raster-grid", daemon=True).start()
+        return started
+
+    def _run_grid(self, started):
+        rows = [self._row_kwargs(row) for row in self._grid_rows]
+        for i, row in enumerate(rows):
+            if self._grid_stop.is_set():
+                raise RuntimeError(f"raster grid stopped before row {i}")
+            if i > 0:
+                self.vector_sync()
+                self.vector_release_hold()
+                self._configure_zebra_row(**row)
+            self._watch_row()
+            record = self._start_row(row)
+            self.vector.go.put(1)
+            if not started.done:
+                started.set_finished()
+            if i + 1 < len(rows):
+                self._stage_row(**rows[i + 1])
+            while not self._row_done.wait(0.1):
+                if self._grid_stop.is_set():
+                    raise RuntimeError(f"raster grid stopped during row {i}")
+            self._finish_row(record)
+            logger.debug(f"raster grid: row {i} done")
+
+    def _start_row(self, kwargs):
+        """Record the frame range of the row that is about to start."""
+        num_images = int(kwargs.get("num_images", self.zebra.pc.pulse.max.get()))
+        record = {
+            "row_index": kwargs.get("row_index", self._rows_started),
+            "reverse": kwargs.get("reverse", False),
+            "frame_start": self._frame_offset,
+            "frame_stop": self._frame_offset + num_images,
+            "resource": self._resource[0]["uid"] if self._resource is not None else None,
+            "datum_id": None,
+            "index": self._rows_started,
+            "encoders": None,
+            "time": None,
+        }
+        self._frame_offset += num_images
+        self._rows_started += 1
+        self._rows.append(record)
+        return record
+
+    @timed()
+    def _finish_row(self, record):
+        """Store the Zebra positions captured during the row, once they are downloaded.
+
+        The start of each row arms the Zebra again, which clears its capture
+        arrays: they must be read before the next row starts.
+        """
+        wait_for_readback(self.zebra.download_status, 0, timeout=self.settle_timeout)
+        num_images = record["frame_stop"] - record["frame_start"]
+        encoders = {}
+        for data_key, attr in ROW_ENCODERS.items():
+            positions = np.atleast_1d(np.asarray(getattr(self.zebra.pc.data, attr).get(), dtype=float))
+            if positions.size < num_images:
+                logger.warning(
+                    f"row {record['row_index']}: {positions.size} {attr} positions for {num_images} frames"
+                )
+            positions = positions[:num_images]
+            # in grid order, like the frames returned for the datum of the row
+            encoders[data_key] = (positions[::-1] if record["reverse"] else positions).tolist()
+        record["encoders"] = encoders
+        record["time"] = ttime.time()
+
+    @timed()
+    def _stage_row(self, **kwargs):
+        """Write the vector setpoints of the next row once the current one has started.
+
+        The hold is not written here, it acts on the current row: it is
+        released with the other commands when the next row is started.
+        """
+        if not self._row_started.wait(self.settle_timeout):
+            logger.warning("the current row did not start, staging the next row anyway")
+        self.configure_vector_parameters(release_hold=False, **kwargs)
+        return kwargs
+
+    @timed()
+    def _apply_staged_row(self):
+        future, self._staged_row = self._staged_row, None
+        kwargs = future.result(timeout=self.put_timeout + self.settle_timeout)
+        self.vector_sync()
+        self.vector_release_hold()
+        self._configure_zebra_row(**kwargs)
+
+    def _row_kwargs(self, kwargs):
+        row_index = kwargs.get("row_index", 0)
+        reverse = bool(self.serpentine and row_index % 2)
+        self._row_directions[row_index] = reverse
+        return {**kwargs, "reverse": reverse}
+
+    @timed()
+    def _configure_zebra_row(self, **kwargs):
+        """Update the Zebra for rows after the first one, which configures it fully."""
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        if self.serpentine:
+            reverse = kwargs.get("reverse", False)
+            gate_start = kwargs["angle_start"]
+            if reverse and kwargs["img_width"] != 0:
+                gate_start += kwargs["scan_width"]
+            batch.put(self.zebra.pc.direction, 1 if reverse else 0)  # direction 0 = positive, 1 = negative
+            batch.put(self.zebra.pc.gate.start, gate_start)
+        batch.put(self.zebra.pc.pulse.max, kwargs["num_images"])
+        batch.wait()
+
+    @timed()
     def update_parameters(self, *args, **kwargs):
         logger.debug("starting updating parameters")
-        self.configure_vector(**kwargs)
+        kwargs = self._row_kwargs(kwargs)
         row_index = kwargs.get("row_index", 0)
+        self._next_row = kwargs
+        if self.pipelined and row_index > 0 and not self._row_done.is_set():
+            logger.debug(f"row {row_index}: staging while the previous row is moving")
+            self._staged_row = self._row_executor.submit(self._stage_row, **kwargs)
+            return
+        self.configure_vector(**kwargs)
         if row_index == 0:
             logger.debug("row 0: fully configuring zebra")
             self.configure_zebra(**kwargs)
         else:
-            numImages = kwargs["num_images"]
-            logger.debug(f"row {row_index}: only setting pulse max")
-            self.zebra.pc.pulse.max.put(numImages)
+            logger.debug(f"row {row_index}: only setting pulse max (and direction if serpentine)")
+            self._configure_zebra_row(**kwargs)
         logger.debug("finished updating parameters")
 
+    @timed()
     def configure_detector(self, **kwargs):
         file_prefix = kwargs["file_prefix"]
         data_directory_name = kwargs["data_directory_name"]
         self.detector.file.external_name.put(file_prefix)
         self.detector.file.write_path_template = data_directory_name
 
+    @timed()
     def configure_zebra(self, **kwargs):
         angle_start = kwargs["angle_start"]
         exposurePeriodPerImage = kwargs["exposure_period_per_image"]
@@ -51,11 +333,19 @@ class MXRasterFlyer(MXFlyer):
         numImages = kwargs["num_images"]
         self.zebra_daq_prep()
         self.zebra.pc.encoder.put(3)  # encoder 0=x, 1=y,2=z,3=omega
-        ttime.sleep(0.5)  # used since LSDC 1 - reason unknown
-        self.zebra.pc.direction.put(0)  # direction 0 = positive
-        self.zebra.pc.gate.sel.put(0)
-        self.zebra.pc.pulse.sel.put(1)
-        self.zebra.pc.pulse.start.put(0)
+        # a fixed 0.5 s sleep was used here since LSDC 1, now wait for the encoder readback
+        wait_for_readback(
+            self.zebra.pc.encoder,
+            3,
+            timeout=self.settle_timeout,
+            fixed_delay=self.fixed_delays.get("zebra_encoder"),
+        )
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(self.zebra.pc.direction, 0)  # direction 0 = positive
+        batch.put(self.zebra.pc.gate.sel, 0)
+        batch.put(self.zebra.pc.pulse.sel, 1)
+        batch.put(self.zebra.pc.pulse.start, 0)
+        batch.wait()
 
         PW = (exposurePeriodPerImage - 2 * detector_dead_time) * 1000
         PS = (exposurePeriodPerImage) * 1000
@@ -76,6 +366,7 @@ class MXRasterFlyer(MXFlyer):
     #     Posn direction: positive
     #     gate trig source - Position
     #     pulse trig source - Time
+    @timed()
     def setup_zebra_vector_scan(
         self,
         angle_start,
@@ -87,26 +378,29 @@ class MXRasterFlyer(MXFlyer):
         num_images,
         is_still=False,
     ):
-        self.zebra.pc.gate.start.put(angle_start, wait=True)
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(self.zebra.pc.gate.start, angle_start)
         if is_still is False:
             logger.debug(f"before: gate width: {gate_width} gate step: {scan_width}")
-            self.zebra.pc.gate.width.put(gate_width, wait=True)
-            self.zebra.pc.gate.step.put(scan_width, wait=True)
-        self.zebra.pc.gate.num_gates.put(1, wait=True)
-        self.zebra.pc.pulse.start.put(0, wait=True)
+            batch.put(self.zebra.pc.gate.width, gate_width)
+            batch.put(self.zebra.pc.gate.step, scan_width)
+        batch.put(self.zebra.pc.gate.num_gates, 1)
+        batch.put(self.zebra.pc.pulse.start, 0)
         logger.debug(f"before: pulse width: {pulse_width}")
-        self.zebra.pc.pulse.width.put(pulse_width, wait=True)
-        self.zebra.pc.pulse.step.put(pulse_step, wait=True)
+        batch.put(self.zebra.pc.pulse.width, pulse_width)
+        batch.put(self.zebra.pc.pulse.step, pulse_step)
         logger.debug(f"before: pulse delay: {exposure_period_per_image / 2 * 1000}")
-        self.zebra.pc.pulse.delay.put(exposure_period_per_image / 2 * 1000, wait=True)
+        batch.put(self.zebra.pc.pulse.delay, exposure_period_per_image / 2 * 1000)
+        batch.put(self.zebra.pc.pulse.max, num_images)
+        batch.wait()
         logger.debug(
             f"after: gate width: {self.zebra.pc.gate.width.get()} gate step: {self.zebra.pc.gate.step.get()}"
             f"after: pulse width: {self.zebra.pc.pulse.width.get()} pulse delay: {self.zebra.pc.pulse.delay.get()}"
         )
-        self.zebra.pc.pulse.max.put(num_images, wait=True)
-        self.vector.hold.put(0)  # necessary to prevent problems upon
+        self.vector_release_hold()  # necessary to prevent problems upon
         # exposure time change
 
+    @timed()
     def detector_arm(self, **kwargs):
         start = kwargs["angle_start"]
         width = kwargs["img_width"]
@@ -121,32 +415,44 @@ class MXRasterFlyer(MXFlyer):
         det_distance_m = kwargs["det_distance_m"]
         num_images_per_file = kwargs["num_images_per_file"]
 
-        self.detector.cam.save_files.put(1)
-        self.detector.cam.file_owner.put(getpass.getuser())
-        self.detector.cam.file_owner_grp.put(grp.getgrgid(os.getgid())[0])
-        self.detector.cam.file_perms.put(420)
         file_prefix_minus_directory = str(file_prefix)
         file_prefix_minus_directory = file_prefix_minus_directory.split("/")[-1]
 
-        self.detector.cam.acquire_time.put(exposure_per_image)
-        self.detector.cam.acquire_period.put(exposure_per_image)
-        # Setting trigger mode before num_triggers due to change in Eiger REST API change
-        self.detector.cam.trigger_mode.put(eiger.EXTERNAL_ENABLE)
-        self.detector.cam.num_triggers.put(total_num_images)
-        self.detector.cam.file_path.put(data_directory_name)
-        self.detector.cam.fw_name_pattern.put(f"{file_prefix_minus_directory}_$id")
+        cam = self.detector.cam
+        batch = PutBatch(timeout=self.put_timeout, cache=self.setpoint_cache)
+        batch.put(cam.save_files, 1)
+        batch.put(cam.file_owner, getpass.getuser())
+        batch.put(cam.file_owner_grp, grp.getgrgid(os.getgid())[0])
+        batch.put(cam.file_perms, 420)
 
-        self.detector.cam.sequence_id.put(file_number_start)
+        batch.put(cam.acquire_time, exposure_per_image)
+        # the Eiger checks the acquire period against the acquire time, write it once the time is set
+        batch.barrier()
+        batch.put(cam.acquire_period, exposure_per_image)
+        batch.put(cam.file_path, data_directory_name)
+        batch.put(cam.fw_name_pattern, f"{file_prefix_minus_directory}_$id")
+
+        batch.put(cam.sequence_id, file_number_start)
 
         # originally from detector_set_fileheader
-        self.detector.cam.beam_center_x.put(x_beam)
-        self.detector.cam.beam_center_y.put(y_beam)
-        self.detector.cam.omega_incr.put(width)
-        self.detector.cam.omega_start.put(start)
-        self.detector.cam.wavelength.put(wavelength)
-        self.detector.cam.det_distance.put(det_distance_m)
+        batch.put(cam.beam_center_x, x_beam)
+        batch.put(cam.beam_center_y, y_beam)
+        batch.put(cam.omega_incr, width)
+        batch.put(cam.omega_start, start)
+        batch.put(cam.wavelength, wavelength)
+        batch.put(cam.det_distance, det_distance_m)
 
-        self.detector.file.file_write_images_per_file.put(num_images_per_file)
+        batch.put(self.detector.file.file_write_images_per_file, num_images_per_file)
+
+        # Setting trigger mode before num_triggers due to change in Eiger REST API change
+        batch.put(cam.trigger_mode, eiger.EXTERNAL_ENABLE)
+        batch.barrier()
+        batch.put(cam.num_triggers, total_num_images)
+        batch.wait()
+        self._start_resource(
+            data_directory_name, file_prefix_minus_directory, file_number_start, num_images_per_file
+        )
+        self._total_num_images = int(total_num_images)
 
         def armed_callback(value, old_value, **kwargs):
             if old_value == 0 and value == 1:
@@ -159,16 +465,127 @@ class MXRasterFlyer(MXFlyer):
 
         return status
 
+    def _start_resource(self, directory, file_prefix, seq_id, images_per_file):
+        """Compose the resource of the files written by the detector for this arm."""
+        resource = {
+            "spec": self.detector.file.filestore_spec,
+            "root": str(directory),
+            "resource_path": file_prefix,
+            "resource_kwargs": {"seq_id": int(seq_id), "images_per_file": int(images_per_file)},
+            "path_semantics": "posix",
+            "uid": str(uuid.uuid4()),
+        }
+        self._resource = (resource, False)
+        self._frame_offset = 0
+        self._rows_started = 0
+
+    def grid_layout(self):
+        """Describe the raster written to the files of the current arm, in both modes.
+
+        Return a dict with the file prefix ``fpath`` (a path), ``seq_id`` and
+        ``images_per_file`` of the files, the grid shape ``num_rows`` and
+        ``num_columns``, and ``serpentine``. Without :meth:`configure_grid`,
+        the number of rows is the number of frames of the arm divided by the
+        frames per row.
+        """
+        if self._resource is None:
+            raise RuntimeError("the detector must be armed before the grid layout is known")
+        resource = self._resource[0]
+        if self._grid_rows is not None:
+            num_columns = int(self._grid_rows[0]["num_images"])
+            num_rows = len(self._grid_rows)
+        else:
+            num_columns = int((self._next_row or {}).get("num_images", self.zebra.pc.pulse.max.get()))
+            num_rows = self._total_num_images // num_columns
+        return {
+            "fpath": pathlib.Path(resource["root"]) / resource["resource_path"],
+            "seq_id": resource["resource_kwargs"]["seq_id"],
+            "images_per_file": resource["resource_kwargs"]["images_per_file"],
+            "num_rows": num_rows,
+            "num_columns": num_columns,
+            "serpentine": self.serpentine,
+        }
+
     def describe_collect(self):
-        return {"stream_name": {}}
+        num_images = self._rows[0]["frame_stop"] - self._rows[0]["frame_start"] if self._rows else None
+        if num_images is None:
+            num_images = int(self.zebra.pc.pulse.max.get())
+        row_data = {
+            f"{self.detector.name}_image": {
+                "source": f"{self.detector.name}_data",
+                "dtype": "array",
+                "shape": [
+                    num_images,
+                    self.detector.cam.array_size.array_size_y.get(),
+                    self.detector.cam.array_size.array_size_x.get(),
+                ],
+                "dims": ["images", "row", "column"],
+                "external": "FILESTORE:",
+            },
+            "row_index": {"source": f"{self.name}_row_index", "dtype": "integer", "shape": []},
+            "reverse": {"source": f"{self.name}_reverse", "dtype": "boolean", "shape": []},
+        }
+        for data_key, attr in ROW_ENCODERS.items():
+            row_data[data_key] = {
+                "source": getattr(self.zebra.pc.data, attr).name,
+                "dtype": "array",
+                "shape": [num_images],
+                "dims": ["images"],
+            }
+        return {"raster": row_data}
 
     def collect(self):
-        logger.debug("raster_flyer.collect(): going to unstage now")
-        yield {"data": {}, "timestamps": {}, "time": 0, "seq_num": 0}
+        """Not supported, the rows are collected as event pages by :meth:`collect_pages`."""
+        raise NotImplementedError(f"{self.name} collects its rows as event pages, use collect_pages()")
 
+    @timed()
+    def collect_pages(self):
+        """Yield one event page with an event for each row done since the last collect."""
+        rows = [record for record in self._rows if record["datum_id"] is not None]
+        if not rows:
+            return
+        self._rows = [record for record in self._rows if record["datum_id"] is None]
+        image_key = f"{self.detector.name}_image"
+        data = {
+            image_key: [record["datum_id"] for record in rows],
+            "row_index": [record["row_index"] for record in rows],
+            "reverse": [record["reverse"] for record in rows],
+        }
+        for data_key in ROW_ENCODERS:
+            data[data_key] = [record["encoders"][data_key] for record in rows]
+        times = [record["time"] for record in rows]
+        yield {
+            "data": data,
+            "timestamps": {key: times for key in data},
+            "time": times,
+            "filled": {image_key: [False] * len(rows)},
+        }
+
+    @timed()
+    def collect_asset_docs(self):
+        """Yield the resource of the current arm (once) and a datum for each row done."""
+        if self._resource is None:
+            return
+        resource, emitted = self._resource
+        if not emitted:
+            self._resource = (resource, True)
+            yield "resource", resource
+        for record in self._rows:
+            # the rows still moving, or not read back from the Zebra yet, are collected later
+            if record["datum_id"] is not None or record["resource"] is None or record["encoders"] is None:
+                continue
+            record["datum_id"] = f"{record['resource']}/data/{record['index']}"
+            yield "datum", {
+                "resource": record["resource"],
+                "datum_id": record["datum_id"],
+                "datum_kwargs": {
+                    "data_key": "data",
+                    "frame_start": record["frame_start"],
+                    "frame_stop": record["frame_stop"],
+                    "reverse": record["reverse"],
+                },
+            }
+
+    @timed()
     def unstage(self):
         pass
-
-    def collect_asset_docs(self):  # not to be done here
-        for _ in ():
-            yield _
@@ -14,9 +14,13 @@ def setup_zebra_vector_scan_for_raster(
     detector_dead_time,
     num_images,
     scan_encoder=3,
+    fixed_delay=None,
 ):
+    # mv completes when the encoder readback matches, which replaces the 1 s sleep used before
+    # (pass fixed_delay=1.0 to sleep as well)
     yield from bps.mv(zebra.pc.encoder, scan_encoder)
-    yield from bps.sleep(1.0)
+    if fixed_delay is not None:
+        yield from bps.sleep(fixed_delay)
     yield from bps.mv(zebra.pc.direction, 0, zebra.pc.gate.sel, 0)  # direction, 0 = positive
     yield from bps.mv(zebra.pc.gate.start, angle_start)
     if image_width != 0:
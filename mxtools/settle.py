@@ -0,0 +1,63 @@
+import logging
+import time as ttime
+
+from ophyd.status import SubscriptionStatus
+
+from .batch import _same_value
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTLE_TIMEOUT = 5.0
+
+# The fixed delays used before the settle conditions were introduced, in seconds.
+# Assign this dict (or a modified copy) to a flyer's ``fixed_delays`` to go back to them.
+FIXED_DELAYS = {
+    "unstage": 1.0,
+    "zebra_reset": 0.5,
+    "zebra_prep": 0.5,
+    "zebra_encoder": 0.5,
+}
+
+
+def wait_for_status(
+    status, timeout=DEFAULT_SETTLE_TIMEOUT, fixed_delay=None, what="condition", raise_on_timeout=False
+):
+    """Block until ``status`` completes, at most ``timeout`` seconds.
+
+    If ``fixed_delay`` is not None, sleep that long instead, ignoring the status.
+    A timeout is logged and the caller carries on, like it did after a fixed sleep,
+    unless ``raise_on_timeout`` is set: then a RuntimeError is raised.
+    """
+    if fixed_delay is not None:
+        ttime.sleep(fixed_delay)
+        return True
+    start = ttime.monotonic()
+    try:
+        status.wait(timeout)
+    except Exception as exc:
+        message = f"{what} not reached after {ttime.monotonic() - start:.3f} s: {exc!r}"
+        if raise_on_timeout:
+            raise RuntimeError(message) from exc
+        logger.warning(message)
+        return False
+    logger.debug(f"{what} reached after {ttime.monotonic() - start:.3f} s")
+    return True
+
+
+def wait_for_readback(signal, expected, timeout=DEFAULT_SETTLE_TIMEOUT, fixed_delay=None, raise_on_timeout=False):
+    """Block until the monitored readback of ``signal`` equals ``expected``."""
+    if fixed_delay is not None:
+        return wait_for_status(None, fixed_delay=fixed_delay)
+
+    def matches(value, **kwargs):
+        return _same_value(value, expected)
+
+    status = SubscriptionStatus(signal, matches, run=True)
+    try:
+        return wait_for_status(
+            status, timeout, what=f"{signal.name} == {expected!r}", raise_on_timeout=raise_on_timeout
+        )
+    finally:
+        if not status.done:
+            # a timed out wait leaves the status pending, stop it from watching the signal
+            signal.clear_sub(status.check_value)
@@ -0,0 +1,803 @@
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time as ttime
+from contextlib import contextmanager
+
+import numpy as np
+from caproto import ChannelDouble, ChannelEnum, ChannelInteger, ChannelString, ChannelType
+from caproto.server import PVGroup, pvproperty, run
+
+from .eiger_files import write_data_file, write_master_file
+
+logger = logging.getLogger(__name__)
+
+VECTOR_PREFIX = "SIM{Gon:1-Vec}"
+ZEBRA_PREFIX = "SIM{Zeb:1}:"
+EIGER_PREFIX = "SIM{Det:Eig}"
+GOVERNOR_PREFIX = "SIM-ES"
+
+# Serve and search the PVs on localhost only. The clients need these variables
+# too, set before their first channel access.
+LOCALHOST_CA_ENV = {
+    "EPICS_CAS_INTF_ADDR_LIST": "127.0.0.1",
+    "EPICS_CA_ADDR_LIST": "127.0.0.1",
+    "EPICS_CA_AUTO_ADDR_LIST": "NO",
+}
+
+# Maximum number of points of the Zebra capture arrays.
+MAX_CAPTURE = 100000
+DEFAULT_FRAME_SHAPE = (256, 256)
+
+TRIG_SOURCES = ["Soft", "External"]
+TRIGGER_MODES = ["Internal Series", "Internal Enable", "External Series", "External Enable"]
+IMAGE_MODES = ["Single", "Multiple", "Continuous"]
+COMPRESSION_ALGOS = ["LZ4", "BS LZ4"]
+
+# A small Governor: the transitions are the states reachable from each state.
+DEFAULT_GOVERNORS = {
+    "Robot": {
+        "state": "M",
+        "transitions": {
+            "M": ["SE"],
+            "SE": ["M", "SA", "DA", "XF"],
+            "SA": ["SE", "DA"],
+            "DA": ["SE", "SA", "XF"],
+            "XF": ["SE", "DA"],
+        },
+        "devices": {"bsy": ["In", "Out"], "cxy": ["Near", "Far"], "fy": ["Open", "Closed"]},
+    },
+    "Human": {
+        "state": "M",
+        "transitions": {"M": ["SE"], "SE": ["M", "SA"], "SA": ["SE"]},
+        "devices": {"bsy": ["In", "Out"]},
+    },
+}
+
+
+def _string_pv(value="", max_length=256, **kwargs):
+    """A string served as a char waveform, for strings longer than the 40 characters of DBR_STRING."""
+    return pvproperty(
+        value=value, dtype=ChannelType.CHAR, max_length=max_length, string_encoding="utf-8", **kwargs
+    )
+
+
+def _capture_pv(name):
+    """A Zebra capture array, with a short subscription backlog as each update can be large."""
+    return pvproperty(value=[0.0], name=name, max_length=MAX_CAPTURE, read_only=True, max_subscription_backlog=10)
+
+
+async def _write_readback(group, instance, value):
+    """Putter of an areaDetector setpoint, copying the value to its ``_RBV`` PV."""
+    await group.pvdb[f"{instance.pvname}_RBV"].write(value)
+    return value
+
+
+class _SimGroup(PVGroup):
+    """PVs under a prefix that may have braces (not caproto macros), with durations scaled by ``time_scale``."""
+
+    def __init__(self, prefix, *, time_scale=1.0, **kwargs):
+        super().__init__(prefix.replace("{", "{{").replace("}", "}}"), **kwargs)
+        self.time_scale = time_scale
+
+
+class Trajectory:
+    """Linear motion of the vector program from ``start`` to ``end``, (x, y, z, omega), in ``duration`` s."""
+
+    def __init__(self, start, end, duration):
+        self.start = np.asarray(start, dtype=float)
+        self.end = np.asarray(end, dtype=float)
+        self.duration = float(duration)
+
+    def position(self, elapsed):
+        """Return the (x, y, z, omega) position ``elapsed`` seconds after the start of the motion."""
+        if self.duration <= 0:
+            return self.end.copy()
+        fraction = min(max(elapsed / self.duration, 0.0), 1.0)
+        return self.start + fraction * (self.end - self.start)
+
+
+class VectorProgramIOC(_SimGroup):
+    """Simulation of the PVs of :class:`~mxtools.vector_program.VectorProgram`.
+
+    Writing 1 to ``Cmd:Go-Cmd`` sets ``Sts:Running-Sts`` to 1, waits for the
+    buffer time, moves from the start to the end positions in ``NumSamples``
+    exposures and sets ``Sts:Running-Sts`` back to 0. Every callable of
+    ``motion_listeners`` is called with the :class:`Trajectory` when the motion
+    starts. All the durations are multiplied by ``time_scale``.
+    """
+
+    omega_start = pvproperty(value=0.0, name="Pos:OStart-SP")
+    x_start = pvproperty(value=0.0, name="Pos:XStart-SP")
+    y_start = pvproperty(value=0.0, name="Pos:YStart-SP")
+    z_start = pvproperty(value=0.0, name="Pos:ZStart-SP")
+    omega_end = pvproperty(value=0.0, name="Pos:OEnd-SP")
+    x_end = pvproperty(value=0.0, name="Pos:XEnd-SP")
+    y_end = pvproperty(value=0.0, name="Pos:YEnd-SP")
+    z_end = pvproperty(value=0.0, name="Pos:ZEnd-SP")
+
+    abort = pvproperty(value=0, name="Cmd:Abort-Cmd")
+    go = pvproperty(value=0, name="Cmd:Go-Cmd")
+    proceed = pvproperty(value=0, name="Cmd:Proceed-Cmd")
+    sync = pvproperty(value=0, name="Cmd:Sync-Cmd")
+
+    expose = pvproperty(value=0, name="Expose-Sel")
+    hold = pvproperty(value=0, name="Hold-Sel")
+
+    buffer_time = pvproperty(value=0.0, name="Val:BufferTime-SP")
+    frame_exptime = pvproperty(value=0.0, name="Val:Exposure-SP")
+    num_frames = pvproperty(value=0, name="Val:NumSamples-SP")
+
+    active = pvproperty(value=0, name="Sts:Running-Sts", read_only=True)
+    state = pvproperty(value=0, name="Sts:State-Sts", read_only=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.motion_listeners = []
+        self._motion = None
+
+    @go.putter
+    async def go(self, instance, value):
+        if value and (self._motion is None or self._motion.done()):
+            self._motion = asyncio.ensure_future(self._move())
+        return value
+
+    @abort.putter
+    async def abort(self, instance, value):
+        if value and self._motion is not None:
+            self._motion.cancel()
+        return value
+
+    def trajectory(self):
+        start = [self.x_start.value, self.y_start.value, self.z_start.value, self.omega_start.value]
+        end = [self.x_end.value, self.y_end.value, self.z_end.value, self.omega_end.value]
+        return Trajectory(start, end, self.num_frames.value * self.frame_exptime.value / 1000)
+
+    async def _move(self):
+        trajectory = self.trajectory()
+        await self.active.write(1)
+        await self.state.write(1)
+        try:
+            await asyncio.sleep(self.buffer_time.value / 1000 * self.time_scale)
+            for listener in self.motion_listeners:
+                listener(trajectory)
+            await asyncio.sleep(trajectory.duration * self.time_scale)
+        finally:
+            await self.state.write(0)
+            await self.active.write(0)
+
+
+class ZebraIOC(_SimGroup):
+    """Simulation of the PVs of :class:`~mxtools.zebra.Zebra` used for position capture.
+
+    The position compare is armed by ``PC_ARM``, or by the start of the
+    vector motion when ``PC_ARM_SEL`` is "External". Once armed and the
+    motion started, ``PC_PULSE_MAX`` pulses are sent ``PC_PULSE_STEP`` ms
+    apart, from ``PC_PULSE_START`` + ``PC_PULSE_DLY`` ms after the start of
+    the motion (the gate is not simulated). On each pulse the time (in s
+    from the arm) and the positions of the trajectory are captured, and
+    every callable of ``trigger_listeners`` is called. The captured arrays
+    are downloaded every ``download_period`` seconds and at the end, when
+    ``ARRAY_ACQ`` goes back to 0.
+    """
+
+    download_status = pvproperty(value=0, name="ARRAY_ACQ", read_only=True)
+    reset = pvproperty(value=0, name="SYS_RESET.PROC")
+    m1_set_pos = pvproperty(value=0, name="M1:SETPOS.PROC")
+    m2_set_pos = pvproperty(value=0, name="M2:SETPOS.PROC")
+    m3_set_pos = pvproperty(value=0, name="M3:SETPOS.PROC")
+    m4_set_pos = pvproperty(value=0, name="M4:SETPOS.PROC")
+    out1 = pvproperty(value=0, name="OUT1_TTL")
+    and1_inp1 = pvproperty(value=0, name="AND1_INP1:STA")
+    and1_inp2 = pvproperty(value=0, name="AND1_INP2:STA")
+
+    trig_source = pvproperty(value="Soft", name="PC_ARM_SEL", dtype=ChannelType.ENUM, enum_strings=TRIG_SOURCES)
+    trig_source_rbv = pvproperty(
+        value="Soft", name="PC_ARM_SEL:RBV", dtype=ChannelType.ENUM, enum_strings=TRIG_SOURCES, read_only=True
+    )
+    arm_status = pvproperty(value=0, name="PC_ARM_INP:STA", read_only=True)
+    arm_output = pvproperty(value=0, name="PC_ARM_OUT", read_only=True)
+    arm = pvproperty(value=0, name="PC_ARM")
+    disarm = pvproperty(value=0, name="PC_DISARM")
+
+    encoder = pvproperty(value=0, name="PC_ENC")
+    direction = pvproperty(value=0, name="PC_DIR")
+    gate_sel = pvproperty(value=0, name="PC_GATE_SEL")
+    gate_start = pvproperty(value=0.0, name="PC_GATE_START")
+    gate_width = pvproperty(value=0.0, name="PC_GATE_WID")
+    gate_step = pvproperty(value=0.0, name="PC_GATE_STEP")
+    gate_num = pvproperty(value=0, name="PC_GATE_NGATE")
+    pulse_sel = pvproperty(value=0, name="PC_PULSE_SEL")
+    pulse_start = pvproperty(value=0.0, name="PC_PULSE_START")
+    pulse_width = pvproperty(value=0.0, name="PC_PULSE_WID")
+    pulse_step = pvproperty(value=0.0, name="PC_PULSE_STEP")
+    pulse_max = pvproperty(value=0, name="PC_PULSE_MAX")
+    pulse_delay = pvproperty(value=0.0, name="PC_PULSE_DLY")
+
+    num_captured = pvproperty(value=0, name="PC_NUM_CAP", read_only=True)
+    num_downloaded = pvproperty(value=0, name="PC_NUM_DOWN", read_only=True)
+    time = _capture_pv("PC_TIME")
+    enc1 = _capture_pv("PC_ENC1")
+    enc2 = _capture_pv("PC_ENC2")
+    enc3 = _capture_pv("PC_ENC3")
+    enc4 = _capture_pv("PC_ENC4")
+    sys1 = _capture_pv("PC_SYS1")
+    sys2 = _capture_pv("PC_SYS2")
+    div1 = _capture_pv("PC_DIV1")
+    div2 = _capture_pv("PC_DIV2")
+    div3 = _capture_pv("PC_DIV3")
+    div4 = _capture_pv("PC_DIV4")
+
+    def __init__(self, *args, download_period=0.1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.download_period = download_period
+        self.trigger_listeners = []
+        self._armed_at = None
+        self._capture = None
+        self._captured = {}
+
+    @trig_source.putter
+    async def trig_source(self, instance, value):
+        await self.trig_source_rbv.write(value)
+        return value
+
+    @reset.putter
+    async def reset(self, instance, value):
+        await self._stop_capture()
+        await self.arm_status.write(0)
+        await self.arm_output.write(0)
+        await self.download_status.write(0)
+        return value
+
+    @arm.putter
+    async def arm(self, instance, value):
+        if value:
+            await self._arm()
+        return value
+
+    @disarm.putter
+    async def disarm(self, instance, value):
+        if value:
+            await self._stop_capture()
+            await self._download()
+            await self._disarmed()
+        return value
+
+    def motion_started(self, trajectory):
+        """Start the pulses for ``trajectory`` (a motion listener of the vector program)."""
+        asyncio.ensure_future(self._start_pulses(trajectory))
+
+    async def _arm(self):
+        self._armed_at = asyncio.get_event_loop().time()
+        self._captured = {key: [] for key in ("time", "enc1", "enc2", "enc3", "enc4")}
+        await self.num_captured.write(0)
+        await self.num_downloaded.write(0)
+        await self.download_status.write(1)
+        await self.arm_output.write(1)
+        if self.trig_source.value == "External":
+            await self.arm_status.write(1)
+
+    async def _disarmed(self):
+        self._armed_at = None
+        await self.arm_status.write(0)
+        await self.arm_output.write(0)
+        await self.download_status.write(0)
+
+    async def _start_pulses(self, trajectory):
+        if self._armed_at is None:
+            if self.trig_source.value != "External":
+                return
+            await self._arm()
+        await self._stop_capture()
+        self._capture = asyncio.ensure_future(self._pulses(trajectory))
+
+    async def _stop_capture(self):
+        if self._capture is not None and not self._capture.done():
+            self._capture.cancel()
+            try:
+                await self._capture
+            except asyncio.CancelledError:
+                pass
+        self._capture = None
+
+    async def _pulses(self, trajectory):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        first = (self.pulse_start.value + self.pulse_delay.value) / 1000
+        step = self.pulse_step.value / 1000
+        last_download = started
+        for i in range(int(self.pulse_max.value)):
+            elapsed = first + i * step
+            await asyncio.sleep(max(started + elapsed * self.time_scale - loop.time(), 0))
+            position = trajectory.position(elapsed)
+            self._captured["time"].append((loop.time() - self._armed_at) / self.time_scale)
+            for j, value in enumerate(position, start=1):
+                self._captured[f"enc{j}"].append(value)
+            await self.num_captured.write(i + 1)
+            for listener in self.trigger_listeners:
+                listener()
+            if loop.time() - last_download >= self.download_period:
+                await self._download()
+                last_download = loop.time()
+        await self._download()
+        await self._disarmed()
+
+    async def _download(self):
+        captured = self._captured
+        if not captured.get("time"):
+            return
+        for key, values in captured.items():
+            await getattr(self, key).write(np.asarray(values[:MAX_CAPTURE]))
+        await self.num_downloaded.write(min(len(captured["time"]), MAX_CAPTURE))
+
+
+class EigerIOC(_SimGroup):
+    """Simulation of the Eiger cam PVs used by :class:`~mxtools.eiger.EigerSingleTriggerV26` and the flyers.
+
+    Writing 1 to ``cam1:Acquire`` arms the detector (``cam1:Armed`` goes to
+    1). In the internal trigger modes the frames are acquired right away,
+    in "External Series" each trigger (see :meth:`trigger`) starts a series
+    of ``NumImages`` frames, ``AcquirePeriod`` seconds apart, and in
+    "External Enable" each trigger acquires one frame. When ``SaveFiles``
+    is 1, the frames (frame ``k`` is filled with ``k``) are written to data
+    files of ``FWNImagesPerFile`` frames, named after ``FWNamePattern``, in
+    ``FilePath``, and the master file is written after the last frame.
+    The detector is then disarmed and ``cam1:Acquire`` goes back to 0.
+    """
+
+    acquire = pvproperty(value=0, name="cam1:Acquire")
+    acquire_rbv = pvproperty(value=0, name="cam1:Acquire_RBV", read_only=True)
+    armed = pvproperty(value=0, name="cam1:Armed", read_only=True)
+    num_images = pvproperty(value=1, name="cam1:NumImages", put=_write_readback)
+    num_images_rbv = pvproperty(value=1, name="cam1:NumImages_RBV", read_only=True)
+    num_images_counter = pvproperty(value=0, name="cam1:NumImagesCounter_RBV", read_only=True)
+    num_triggers = pvproperty(value=1, name="cam1:NumTriggers", put=_write_readback)
+    num_triggers_rbv = pvproperty(value=1, name="cam1:NumTriggers_RBV", read_only=True)
+    trigger_mode = pvproperty(
+        value=TRIGGER_MODES[0],
+        name="cam1:TriggerMode",
+        dtype=ChannelType.ENUM,
+        enum_strings=TRIGGER_MODES,
+        put=_write_readback,
+    )
+    trigger_mode_rbv = pvproperty(
+        value=TRIGGER_MODES[0],
+        name="cam1:TriggerMode_RBV",
+        dtype=ChannelType.ENUM,
+        enum_strings=TRIGGER_MODES,
+        read_only=True,
+    )
+    image_mode = pvproperty(
+        value=IMAGE_MODES[0],
+        name="cam1:ImageMode",
+        dtype=ChannelType.ENUM,
+        enum_strings=IMAGE_MODES,
+        put=_write_readback,
+    )
+    image_mode_rbv = pvproperty(
+        value=IMAGE_MODES[0],
+        name="cam1:ImageMode_RBV",
+        dtype=ChannelType.ENUM,
+        enum_strings=IMAGE_MODES,
+        read_only=True,
+    )
+    compression_algo = pvproperty(
+        value=COMPRESSION_ALGOS[1],
+        name="cam1:CompressionAlgo",
+        dtype=ChannelType.ENUM,
+        enum_strings=COMPRESSION_ALGOS,
+        put=_write_readback,
+    )
+    compression_algo_rbv = pvproperty(
+        value=COMPRESSION_ALGOS[1],
+        name="cam1:CompressionAlgo_RBV",
+        dtype=ChannelType.ENUM,
+        enum_strings=COMPRESSION_ALGOS,
+        read_only=True,
+    )
+    acquire_time = pvproperty(value=0.01, name="cam1:AcquireTime", put=_write_readback)
+    acquire_time_rbv = pvproperty(value=0.01, name="cam1:AcquireTime_RBV", read_only=True)
+    acquire_period = pvproperty(value=0.01, name="cam1:AcquirePeriod", put=_write_readback)
+    acquire_period_rbv = pvproperty(value=0.01, name="cam1:AcquirePeriod_RBV", read_only=True)
+
+    save_files = pvproperty(value=1, name="cam1:SaveFiles", put=_write_readback)
+    save_files_rbv = pvproperty(value=1, name="cam1:SaveFiles_RBV", read_only=True)
+    file_owner = pvproperty(value="", name="cam1:FileOwner", dtype=ChannelType.STRING, put=_write_readback)
+    file_owner_rbv = pvproperty(value="", name="cam1:FileOwner_RBV", dtype=ChannelType.STRING, read_only=True)
+    file_owner_grp = pvproperty(value="", name="cam1:FileOwnerGrp", dtype=ChannelType.STRING, put=_write_readback)
+    file_owner_grp_rbv = pvproperty(
+        value="", name="cam1:FileOwnerGrp_RBV", dtype=ChannelType.STRING, read_only=True
+    )
+    file_perms = pvproperty(value=420, name="cam1:FilePerms")
+    file_path = _string_pv(value="/tmp/", name="cam1:FilePath", put=_write_readback)
+    file_path_rbv = _string_pv(value="/tmp/", name="cam1:FilePath_RBV", read_only=True)
+    file_path_exists = pvproperty(value=1, name="cam1:FilePathExists_RBV", read_only=True)
+    fw_name_pattern = _string_pv(value="series_$id", name="cam1:FWNamePattern", put=_write_readback)
+    fw_name_pattern_rbv = _string_pv(value="series_$id", name="cam1:FWNamePattern_RBV", read_only=True)
+    fw_num_images_per_file = pvproperty(value=1000, name="cam1:FWNImagesPerFile", put=_write_readback)
+    fw_num_images_per_file_rbv = pvproperty(value=1000, name="cam1:FWNImagesPerFile_RBV", read_only=True)
+    sequence_id = pvproperty(value=1, name="cam1:SequenceId")
+
+    beam_center_x = pvproperty(value=0.0, name="cam1:BeamX", put=_write_readback)
+    beam_center_x_rbv = pvproperty(value=0.0, name="cam1:BeamX_RBV", read_only=True)
+    beam_center_y = pvproperty(value=0.0, name="cam1:BeamY", put=_write_readback)
+    beam_center_y_rbv = pvproperty(value=0.0, name="cam1:BeamY_RBV", read_only=True)
+    omega_incr = pvproperty(value=0.0, name="cam1:OmegaIncr", put=_write_readback)
+    omega_incr_rbv = pvproperty(value=0.0, name="cam1:OmegaIncr_RBV", read_only=True)
+    omega_start = pvproperty(value=0.0, name="cam1:OmegaStart", put=_write_readback)
+    omega_start_rbv = pvproperty(value=0.0, name="cam1:OmegaStart_RBV", read_only=True)
+    wavelength = pvproperty(value=1.0, name="cam1:Wavelength", put=_write_readback)
+    wavelength_rbv = pvproperty(value=1.0, name="cam1:Wavelength_RBV", read_only=True)
+    det_distance = pvproperty(value=0.1, name="cam1:DetDist", put=_write_readback)
+    det_distance_rbv = pvproperty(value=0.1, name="cam1:DetDist_RBV", read_only=True)
+
+    array_size_x = pvproperty(value=DEFAULT_FRAME_SHAPE[1], name="cam1:ArraySizeX_RBV", read_only=True)
+    array_size_y = pvproperty(value=DEFAULT_FRAME_SHAPE[0], name="cam1:ArraySizeY_RBV", read_only=True)
+    array_size_z = pvproperty(value=0, name="cam1:ArraySizeZ_RBV", read_only=True)
+    array_counter = pvproperty(value=0, name="cam1:ArrayCounter", put=_write_readback)
+    array_counter_rbv = pvproperty(value=0, name="cam1:ArrayCounter_RBV", read_only=True)
+
+    array_callbacks = pvproperty(value=1, name="cam1:ArrayCallbacks", put=_write_readback)
+    array_callbacks_rbv = pvproperty(value=1, name="cam1:ArrayCallbacks_RBV", read_only=True)
+    port_name = pvproperty(value="EIG", name="cam1:PortName_RBV", dtype=ChannelType.STRING, read_only=True)
+    image_port_name = pvproperty(
+        value="IMAGE1", name="image1:PortName_RBV", dtype=ChannelType.STRING, read_only=True
+    )
+    image_plugin_type = pvproperty(
+        value="NDPluginStdArrays", name="image1:PluginType_RBV", dtype=ChannelType.STRING, read_only=True
+    )
+    image_array_port = pvproperty(
+        value="EIG", name="image1:NDArrayPort", dtype=ChannelType.STRING, put=_write_readback
+    )
+    image_array_port_rbv = pvproperty(
+        value="EIG", name="image1:NDArrayPort_RBV", dtype=ChannelType.STRING, read_only=True
+    )
+    image_enable = pvproperty(
+        value="Enable",
+        name="image1:EnableCallbacks",
+        dtype=ChannelType.ENUM,
+        enum_strings=["Disable", "Enable"],
+        put=_write_readback,
+    )
+    image_enable_rbv = pvproperty(
+        value="Enable",
+        name="image1:EnableCallbacks_RBV",
+        dtype=ChannelType.ENUM,
+        enum_strings=["Disable", "Enable"],
+        read_only=True,
+    )
+    image_blocking = pvproperty(
+        value="No",
+        name="image1:BlockingCallbacks",
+        dtype=ChannelType.ENUM,
+        enum_strings=["No", "Yes"],
+        put=_write_readback,
+    )
+    image_blocking_rbv = pvproperty(
+        value="No",
+        name="image1:BlockingCallbacks_RBV",
+        dtype=ChannelType.ENUM,
+        enum_strings=["No", "Yes"],
+        read_only=True,
+    )
+
+    def __init__(self, *args, frame_shape=DEFAULT_FRAME_SHAPE, arm_time=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_shape = tuple(frame_shape)
+        self.arm_time = arm_time
+        self._acquisition = None
+        self._series = None
+        self._frames = []
+        self._data_files = []
+        self._num_frames = 0
+        self._triggers = 0
+
+    @array_size_x.startup
+    async def array_size_x(self, instance, async_lib):
+        await self.array_size_x.write(self.frame_shape[1])
+        await self.array_size_y.write(self.frame_shape[0])
+
+    @acquire.putter
+    async def acquire(self, instance, value):
+        if value and not self.armed.value:
+            await self.acquire_rbv.write(1)
+            self._acquisition = asyncio.ensure_future(self._arm())
+        elif not value and self._acquisition is not None:
+            self._acquisition.cancel()
+            if self._series is not None:
+                self._series.cancel()
+            await self._disarm()
+        return value
+
+    def trigger(self):
+        """Receive a trigger pulse (a trigger listener of the Zebra)."""
+        if not self.armed.value:
+            return
+        mode = self.trigger_mode.value
+        if mode == "External Series":
+            if self._triggers < self.num_triggers.value and (self._series is None or self._series.done()):
+                self._triggers += 1
+                self._series = asyncio.ensure_future(self._acquire_series(self.num_images.value))
+        elif mode == "External Enable":
+            asyncio.ensure_future(self._acquire_series(1))
+
+    @property
+    def total_frames(self):
+        return int(self.num_images.value) * int(self.num_triggers.value)
+
+    async def _arm(self):
+        await asyncio.sleep(self.arm_time * self.time_scale)
+        self._frames = []
+        self._data_files = []
+        self._num_frames = 0
+        self._triggers = 0
+        await self.num_images_counter.write(0)
+        await self.armed.write(1)
+        if self.trigger_mode.value.startswith("Internal"):
+            self._series = asyncio.ensure_future(self._acquire_series(self.total_frames))
+
+    async def _disarm(self):
+        self._acquisition = None
+        await self.armed.write(0)
+        await self.acquire.write(0)
+        await self.acquire_rbv.write(0)
+
+    async def _acquire_series(self, num_frames):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        period = max(self.acquire_period.value, self.acquire_time.value)
+        for i in range(num_frames):
+            await asyncio.sleep(max(started + (i + 1) * period * self.time_scale - loop.time(), 0))
+            if self._num_frames >= self.total_frames:
+                return
+            await self._add_frame()
+
+    async def _add_frame(self):
+        index = self._num_frames
+        self._num_frames += 1
+        self._frames.append(index)
+        await self.num_images_counter.write(self._num_frames)
+        await self.array_counter_rbv.write(self.array_counter_rbv.value + 1)
+        done = self._num_frames >= self.total_frames
+        if len(self._frames) >= self.fw_num_images_per_file.value or done:
+            frames, self._frames = self._frames, []
+            await self._write_data_file(frames)
+        if done:
+            await self._write_master_file()
+            await self._disarm()
+
+    def _file_base(self):
+        name = self.fw_name_pattern.value.replace("$id", str(self.sequence_id.value))
+        return pathlib.Path(self.file_path.value) / name
+
+    def _compression(self):
+        if self.compression_algo.value != "BS LZ4":
+            return None
+        try:
+            import hdf5plugin  # noqa: F401
+        except ImportError:
+            return None
+        return "bslz4"
+
+    async def _write_data_file(self, frames):
+        if not self.save_files.value:
+            return
+        path = pathlib.Path(f"{self._file_base()}_data_{len(self._data_files) + 1:06d}.h5")
+        self._data_files.append(path)
+        data = np.broadcast_to(np.asarray(frames, dtype="uint32")[:, None, None], (len(frames), *self.frame_shape))
+        # written in a thread, not to block the other IOCs
+        await asyncio.get_event_loop().run_in_executor(
+            None, write_data_file, path, data, self._compression(), frames[0] + 1
+        )
+        logger.debug(f"wrote {len(frames)} frames to {path}")
+
+    async def _write_master_file(self):
+        if not self.save_files.value:
+            return
+        path = pathlib.Path(f"{self._file_base()}_master.h5")
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: write_master_file(
+                path,
+                self._data_files,
+                self._num_frames,
+                omega_start=self.omega_start.value,
+                omega_incr=self.omega_incr.value,
+                count_time=self.acquire_time.value,
+                ntrigger=self.num_triggers.value,
+                beam_center=(self.beam_center_x.value, self.beam_center_y.value),
+                wavelength=self.wavelength.value,
+                detector_distance=self.det_distance.value,
+            ),
+        )
+        logger.debug(f"wrote {path}")
+
+
+class _GoCommand(ChannelString):
+    """``Cmd:Go-Cmd`` of a Governor configuration, starting the transition to the state written."""
+
+    def __init__(self, governor, name, **kwargs):
+        super().__init__(value="", **kwargs)
+        self._governor = governor
+        self._name = name
+
+    async def verify_value(self, data):
+        # the put completes with the transition
+        await self._governor.go(self._name, data)
+        return data
+
+
+class GovernorIOC:
+    """Simulation of the Governor PVs discovered by :func:`~mxtools.governor._make_governors`.
+
+    ``governors`` maps each configuration name to its initial ``state``, its
+    ``transitions`` (the states reachable from each state) and its
+    ``devices`` (the targets of each device), see :data:`DEFAULT_GOVERNORS`.
+    Writing a reachable state to ``Cmd:Go-Cmd`` makes the configuration busy
+    for ``transition_time`` seconds before it reaches the state; writing an
+    unreachable state, or any state while inactive, is rejected.
+    """
+
+    def __init__(self, prefix=GOVERNOR_PREFIX, governors=None, time_scale=1.0, transition_time=0.2):
+        self.prefix = prefix
+        self.governors = DEFAULT_GOVERNORS if governors is None else governors
+        self.time_scale = time_scale
+        self.transition_time = transition_time
+        self.pvdb = {}
+        self._channels = {}
+        names = list(self.governors)
+        self.active = ChannelEnum(value="Active", enum_strings=["Inactive", "Active"])
+        self.pvdb[f"{prefix}{{Gov}}Sts:Configs-I"] = ChannelString(value=names, max_length=len(names))
+        self.pvdb[f"{prefix}{{Gov}}Active-Sel"] = self.active
+        self.pvdb[f"{prefix}{{Gov}}Config-Sel"] = ChannelEnum(value=names[0], enum_strings=names)
+        for name, config in self.governors.items():
+            self._add_governor(name, config)
+
+    def _add_governor(self, name, config):
+        gov_prefix = f"{self.prefix}{{Gov:{name}"
+        states = list(config["transitions"])
+        devices = list(config["devices"])
+        state = config["state"]
+        channels = {
+            "state": ChannelString(value=state),
+            "busy": ChannelInteger(value=0),
+            "reachable": ChannelString(value=config["transitions"][state], max_length=len(states)),
+        }
+        self._channels[name] = channels
+        self.pvdb.update(
+            {
+                f"{gov_prefix}}}Cmd:Go-Cmd": _GoCommand(self, name),
+                f"{gov_prefix}}}Sts:State-I": channels["state"],
+                f"{gov_prefix}}}Sts:Busy-Sts": channels["busy"],
+                f"{gov_prefix}}}Sts:States-I": ChannelString(value=states, max_length=len(states)),
+                f"{gov_prefix}}}Sts:Reach-I": channels["reachable"],
+                f"{gov_prefix}}}Sts:Devs-I": ChannelString(value=devices, max_length=max(len(devices), 1)),
+            }
+        )
+        for device, targets in config["devices"].items():
+            dev_prefix = f"{gov_prefix}-Dev:{device}}}"
+            self.pvdb[f"{dev_prefix}Sts:Tgts-I"] = ChannelString(value=targets, max_length=max(len(targets), 1))
+            for i, target in enumerate(targets):
+                self.pvdb[f"{dev_prefix}Pos:{target}-Pos"] = ChannelDouble(value=float(i))
+            for state_name in states:
+                self.pvdb[f"{dev_prefix}{state_name}:LLim-Pos"] = ChannelDouble(value=-1.0)
+                self.pvdb[f"{dev_prefix}{state_name}:HLim-Pos"] = ChannelDouble(value=float(len(targets)))
+
+    async def go(self, name, target):
+        """Move the configuration ``name`` to the state ``target``."""
+        channels = self._channels[name]
+        if self.active.value != "Active":
+            raise ValueError("the Governor is inactive")
+        if channels["busy"].value:
+            raise ValueError(f"the Governor {name} is busy")
+        if target != channels["state"].value and target not in channels["reachable"].value:
+            raise ValueError(f"{target!r} is not reachable from {channels['state'].value!r}")
+        await channels["busy"].write(1)
+        await asyncio.sleep(self.transition_time * self.time_scale)
+        await channels["state"].write(target)
+        await channels["reachable"].write(self.governors[name]["transitions"][target])
+        await channels["busy"].write(0)
+
+
+class MXSimulation:
+    """The simulated vector program, Zebra, Eiger and Governor, served together.
+
+    The vector program starts the Zebra pulses when its motion starts, and
+    the Zebra pulses trigger the Eiger. All the durations are multiplied by
+    ``time_scale``.
+    """
+
+    def __init__(
+        self,
+        vector_prefix=VECTOR_PREFIX,
+        zebra_prefix=ZEBRA_PREFIX,
+        eiger_prefix=EIGER_PREFIX,
+        governor_prefix=GOVERNOR_PREFIX,
+        time_scale=1.0,
+        frame_shape=DEFAULT_FRAME_SHAPE,
+        governors=None,
+    ):
+        self.vector = VectorProgramIOC(vector_prefix, time_scale=time_scale)
+        self.zebra = ZebraIOC(zebra_prefix, time_scale=time_scale)
+        self.eiger = EigerIOC(eiger_prefix, time_scale=time_scale, frame_shape=frame_shape)
+        self.governor = GovernorIOC(prefix=governor_prefix, governors=governors, time_scale=time_scale)
+        self.vector.motion_listeners.append(self.zebra.motion_started)
+        self.zebra.trigger_listeners.append(self.eiger.trigger)
+        self.pvdb = {**self.vector.pvdb, **self.zebra.pvdb, **self.eiger.pvdb, **self.governor.pvdb}
+
+    def run(self, interfaces=None, log_pv_names=False):
+        """Serve the PVs until interrupted."""
+        kwargs = {} if interfaces is None else {"interfaces": interfaces}
+        run(self.pvdb, log_pv_names=log_pv_names, **kwargs)
+
+
+@contextmanager
+def serve_in_subprocess(*args, log_path=None, timeout=10.0):
+    """Serve the simulation in a subprocess on localhost for the duration of the ``with`` block.
+
+    ``args`` are the command line arguments of :func:`main`. The server logs
+    to ``log_path`` (a temporary file by default). Yields the process once
+    the server is up.
+    """
+    env = {**os.environ, **LOCALHOST_CA_ENV}
+    package_parent = str(pathlib.Path(__file__).resolve().parents[1])
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = pathlib.Path(tmp) / "sim_iocs.log" if log_path is None else pathlib.Path(log_path)
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "mxtools.sim_iocs", *map(str, args)],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=env,
+            )
+        try:
+            deadline = ttime.monotonic() + timeout
+            while "Server startup complete" not in log_path.read_text():
+                if process.poll() is not None:
+                    raise RuntimeError(f"the simulation IOCs exited:\n{log_path.read_text()}")
+                if ttime.monotonic() > deadline:
+                    raise RuntimeError(f"the simulation IOCs did not start in {timeout} s")
+                ttime.sleep(0.05)
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the simulated MX beamline IOCs.")
+    parser.add_argument("--vector-prefix", default=VECTOR_PREFIX)
+    parser.add_argument("--zebra-prefix", default=ZEBRA_PREFIX)
+    parser.add_argument("--eiger-prefix", default=EIGER_PREFIX)
+    parser.add_argument("--governor-prefix", default=GOVERNOR_PREFIX)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="factor applied to all the durations")
+    parser.add_argument(
+        "--frame-shape", type=int, nargs=2, default=DEFAULT_FRAME_SHAPE, metavar=("ROWS", "COLUMNS")
+    )
+    parser.add_argument("--interfaces", nargs="*", default=None, help="interfaces to serve on")
+    parser.add_argument("--list-pvs", action="store_true", help="log the names of the PVs served")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    simulation = MXSimulation(
+        vector_prefix=args.vector_prefix,
+        zebra_prefix=args.zebra_prefix,
+        eiger_prefix=args.eiger_prefix,
+        governor_prefix=args.governor_prefix,
+        time_scale=args.time_scale,
+        frame_shape=args.frame_shape,
+    )
+    simulation.run(interfaces=args.interfaces, log_pv_names=args.list_pvs)
+
+
+if __name__ == "__main__":
+    main()
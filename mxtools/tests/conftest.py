@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from mxtools.eiger_files import data_file_path, master_file_path, write_data_file, write_master_file
+from mxtools.handlers import H5FilePool
+
+# Search the PVs on localhost only, where the sim_iocs fixture serves them. Set before
+# any test creates a PV, as the channel access client reads them once.
+os.environ.update({"EPICS_CA_ADDR_LIST": "127.0.0.1", "EPICS_CA_AUTO_ADDR_LIST": "NO"})
+
+
+def write_eiger_files(
+    directory, prefix="test", seq_id=1, num_images=12, images_per_file=4, shape=(8, 6), compression=None
+):
+    """Write a minimal Eiger collection, a master file with external links to its data files.
+
+    Frame ``k`` is filled with the value ``k`` so that reads are easy to check.
+    ``compression="bslz4"`` compresses the data files like the Eiger writer does.
+    """
+    if compression == "bslz4":
+        pytest.importorskip("hdf5plugin")
+    fpath = directory / prefix
+    data_files = []
+    for index, start in enumerate(range(0, num_images, images_per_file), start=1):
+        stop = min(start + images_per_file, num_images)
+        frames = np.broadcast_to(np.arange(start, stop, dtype="uint16")[:, None, None], (stop - start, *shape))
+        path = data_file_path(fpath, seq_id, index)
+        data_files.append(write_data_file(path, frames, compression=compression, image_nr_low=start + 1))
+    write_master_file(master_file_path(fpath, seq_id), data_files, num_images, omega_incr=0.1, count_time=0.01)
+    return fpath
+
+
+@pytest.fixture
+def eiger_files(tmp_path):
+    return write_eiger_files(tmp_path)
+
+
+@pytest.fixture
+def file_pool():
+    pool = H5FilePool(maxsize=8)
+    yield pool
+    pool.clear()
+
+
+@pytest.fixture(scope="session")
+def sim_iocs():
+    """Serve the simulation IOCs of ``mxtools.sim_iocs`` on localhost, yield the module."""
+    pytest.importorskip("caproto")
+    from mxtools import sim_iocs
+
+    with sim_iocs.serve_in_subprocess():
+        yield sim_iocs
@@ -0,0 +1,54 @@
+import pytest
+from ophyd import Signal
+from ophyd.sim import SynAxis
+from ophyd.status import StatusTimeoutError
+
+from mxtools.batch import PutBatch, SetpointCache
+
+
+def test_stages_run_in_order():
+    first, second = Signal(name="first"), Signal(name="second")
+    order = []
+    first.subscribe(lambda value, **kwargs: order.append(("first", value)), run=False)
+    second.subscribe(lambda value, **kwargs: order.append(("second", value)), run=False)
+
+    batch = PutBatch().put(first, 1).barrier().put(second, 2).put(first, 3)
+    assert len(batch) == 3
+    batch.wait()
+    assert order == [("first", 1), ("second", 2), ("first", 3)]
+
+
+def test_timeout_covers_the_batch():
+    slow = SynAxis(name="slow", delay=0.5)
+    with pytest.raises(StatusTimeoutError):
+        PutBatch(timeout=0.1).put(slow, 1).wait()
+
+
+class RoundedSignal(Signal):
+    """A soft signal whose readback is rounded, like an integer PV."""
+
+    def get(self, **kwargs):
+        return round(super().get(**kwargs))
+
+
+def test_coerced_readback_completes():
+    signal = RoundedSignal(name="rounded", value=0)
+    for _ in range(2):
+        PutBatch(timeout=1).put(signal, 2.4).wait()
+        assert signal.get() == 2
+
+
+def test_cache_skips_unchanged_puts():
+    cache = SetpointCache()
+    first, second = Signal(name="first"), Signal(name="second")
+    PutBatch(cache=cache).put(first, 1).put(second, 2).wait()
+    PutBatch(cache=cache).put(first, 1).put(second, 3).wait()
+    assert cache.stats() == {"issued": 3, "skipped": 1, "cached": 2}
+
+    first.put(5)  # changed behind the cache's back
+    PutBatch(cache=cache).put(first, 1).wait()
+    assert first.get() == 1 and cache.issued == 4
+
+    cache.invalidate()
+    PutBatch(cache=cache).put(first, 1).wait()
+    assert cache.issued == 5
@@ -0,0 +1,38 @@
+import numpy as np
+from event_model import unpack_datum_page
+from ophyd.sim import make_fake_device
+
+from mxtools.eiger import (PER_FILE, EigerSingleTriggerV26, frame_ranges, generate_frame_datum_pages,
+                           images_per_event)
+from mxtools.handlers import EigerHandlerMX
+from mxtools.tests.conftest import write_eiger_files
+
+
+def test_frame_ranges():
+    assert frame_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert frame_ranges(4, 4) == [(0, 4)]
+    assert frame_ranges(0, 4) == []
+
+
+def test_images_per_event():
+    eiger = make_fake_device(EigerSingleTriggerV26)("EIGER:", name="eiger")
+    eiger.cam.num_images.sim_put(10)
+    eiger.file.file_write_images_per_file.sim_put(5)
+    assert images_per_event(eiger, None) == 10
+    assert images_per_event(eiger, 5) == images_per_event(eiger, PER_FILE) == 5
+    # the last range is shorter
+    assert images_per_event(eiger, 4) is None
+    assert images_per_event(eiger, 20) == 10
+
+
+def test_frame_datums_are_honored_by_the_handler(tmp_path, file_pool):
+    prefix = write_eiger_files(tmp_path, num_images=10, images_per_file=4)
+    pages, datum_ids = generate_frame_datum_pages("RES", ["data", "omega"], frame_ranges(10, 3))
+    assert len(pages) == 2 and len(datum_ids) == 4
+    assert datum_ids[-1] == {"data": "RES/data/3", "omega": "RES/omega/3"}
+    (data_page,) = [page for page in pages if page["datum_kwargs"]["data_key"][0] == "data"]
+    assert data_page["datum_id"] == [ids["data"] for ids in datum_ids]
+
+    handler = EigerHandlerMX(prefix, 1, pool=file_pool)
+    frames = [handler(**datum["datum_kwargs"]).compute() for datum in unpack_datum_page(data_page)]
+    np.testing.assert_array_equal(np.concatenate(frames)[:, 0, 0], np.arange(10))
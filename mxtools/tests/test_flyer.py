@@ -0,0 +1,145 @@
+import threading
+
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from ophyd.sim import make_fake_device
+
+from mxtools.batch import PutBatch
+from mxtools.eiger import EigerSingleTriggerV26
+from mxtools.eiger_files import master_file_path, write_master_file
+from mxtools.flyer import MXFlyer
+from mxtools.vector_program import VectorProgram
+from mxtools.zebra import Zebra
+
+SEQ_ID = 3
+
+
+@pytest.fixture
+def flyer(tmp_path):
+    vector = make_fake_device(VectorProgram)("VECTOR:", name="vector")
+    zebra = make_fake_device(Zebra)("ZEBRA:", name="zebra")
+    eiger = make_fake_device(EigerSingleTriggerV26)("EIGER:", name="eiger")
+    eiger.file._fn = str(tmp_path / "sweep")
+    eiger.cam.sequence_id.sim_put(SEQ_ID)
+    eiger.cam.acquire.sim_put(0)
+    flyer = MXFlyer(vector, zebra, eiger)
+    flyer.metadata_poll_period = 0.01
+    return flyer
+
+
+def _write_master_file(flyer):
+    write_master_file(master_file_path(flyer.detector.file._fn, SEQ_ID), [], 5, omega_start=10, omega_incr=0.1)
+
+
+def test_metadata_written_late(flyer):
+    flyer.metadata_timeout = 5
+    flyer._start_metadata_watch()
+    threading.Timer(0.2, _write_master_file, args=(flyer,)).start()
+    np.testing.assert_allclose(flyer._join_metadata(), 10 + np.arange(5) * 0.1, atol=1e-5)
+
+
+def test_missing_metadata_raises(flyer):
+    flyer.metadata_timeout = 0.2
+    flyer._start_metadata_watch()
+    future = flyer._metadata_future
+    with pytest.raises(RuntimeError, match="could not read the metadata of .*sweep_3_master.h5"):
+        flyer._join_metadata()
+    # the watch stops with the join
+    assert future.result(timeout=1) is None
+
+
+def test_failing_metadata_read_surfaces_to_the_plan(flyer, monkeypatch):
+    _write_master_file(flyer)
+
+    def extract_metadata(*args, **kwargs):
+        raise KeyError("entry/sample/goniometer/omega")
+
+    monkeypatch.setattr(flyer, "_extract_metadata", extract_metadata)
+    # no resource: the fake detector was not staged
+    monkeypatch.setattr(flyer, "collect_asset_docs", lambda: iter(()))
+
+    @bpp.run_decorator()
+    def plan():
+        flyer._start_metadata_watch()
+        yield from bps.collect(flyer)
+
+    with pytest.raises(KeyError, match="goniometer/omega"):
+        RunEngine()(plan())
+
+
+def test_zebra_reset_forgets_the_cached_zebra_setpoints(flyer):
+    zebra = flyer.zebra
+    puts = []
+    zebra.pc.arm.trig_source.subscribe(lambda value, **kwargs: puts.append(value), run=False)
+    flyer.zebra_daq_prep()
+    # the monitors have not reported the reset yet: the readbacks still hold the values written before it
+    flyer.zebra_daq_prep()
+    assert puts == [1, 1]
+    assert flyer.setpoint_cache.stats()["skipped"] == 0
+
+
+def test_measured_omega_is_opt_in(flyer):
+    assert not flyer.measure_omega
+    assert "omega_measured" not in flyer.describe_collect()["primary"]
+
+
+def test_undownloaded_capture_arrays_raise(flyer):
+    flyer.measure_omega = True
+    flyer.settle_timeout = 0.2
+    # still downloading the capture arrays of the sweep
+    flyer.zebra.download_status.sim_put(1)
+    with pytest.raises(RuntimeError, match="zebra did not download its capture arrays"):
+        flyer._measured_omega(5)
+
+
+def test_frame_ranges_in_datum_pages(flyer, monkeypatch):
+    flyer.frames_per_datum = 4
+    flyer.detector.cam.num_images.sim_put(10)
+    resource = {"uid": "RES", "root": "/", "resource_path": "sweep"}
+    monkeypatch.setattr(flyer.detector.file, "collect_asset_docs", lambda: [("resource", resource)])
+    # the last event holds 2 frames only
+    assert flyer.describe_collect()["primary"]["omega"]["shape"] == [None]
+
+    docs = flyer.collect_asset_docs()
+    assert [name for name, doc in docs] == ["resource", "datum_page", "datum_page"]
+    pages = {doc["datum_kwargs"]["data_key"][0]: doc for name, doc in docs if name == "datum_page"}
+    assert pages["omega"]["datum_id"] == ["RES/omega/0", "RES/omega/1", "RES/omega/2"]
+    assert pages["data"]["datum_kwargs"]["frame_start"] == [0, 4, 8]
+    assert pages["data"]["datum_kwargs"]["frame_stop"] == [4, 8, 10]
+
+
+def test_unstage_raises_while_the_detector_acquires(flyer):
+    flyer.settle_timeout = 0.2
+    flyer.detector.cam.acquire.sim_put(1)
+    with pytest.raises(RuntimeError, match="eiger_cam_acquire == 0 not reached"):
+        flyer.unstage()
+
+
+def test_acquire_time_written_before_acquire_period(flyer, tmp_path, monkeypatch):
+    stages = []
+    execute = PutBatch.execute
+
+    def record_stages(batch):
+        stages.extend([signal.attr_name for signal, value in stage] for stage in batch._stages if stage)
+        return execute(batch)
+
+    monkeypatch.setattr(PutBatch, "execute", record_stages)
+    flyer.detector_arm(
+        angle_start=10,
+        img_width=0.1,
+        num_images=20,
+        exposure_period_per_image=0.02,
+        file_prefix="sweep",
+        data_directory_name=str(tmp_path),
+        file_number_start=SEQ_ID,
+        x_beam=128,
+        y_beam=128,
+        wavelength=1.0,
+        det_distance_m=0.2,
+    )
+    (time_stage,) = [i for i, stage in enumerate(stages) if "acquire_time" in stage]
+    (period_stage,) = [i for i, stage in enumerate(stages) if "acquire_period" in stage]
+    assert time_stage < period_stage
@@ -0,0 +1,151 @@
+import time as ttime
+from types import SimpleNamespace
+
+import pytest
+from ophyd import Signal
+from ophyd.sim import NullStatus
+
+from mxtools import governor
+
+PREFIX = "XF:19IDC-ES"
+GOVERNOR_PVS = {
+    f"{PREFIX}{{Gov}}Sts:Configs-I": ["Human", "Robot"],
+    f"{PREFIX}{{Gov:Human}}Sts:Devs-I": ["bsy"],
+    f"{PREFIX}{{Gov:Human}}Sts:States-I": ["M", "SA"],
+    f"{PREFIX}{{Gov:Human-Dev:bsy}}Sts:Tgts-I": ["Up", "Down"],
+    f"{PREFIX}{{Gov:Robot}}Sts:Devs-I": "bsy",
+    f"{PREFIX}{{Gov:Robot}}Sts:States-I": ["M", "SE"],
+    f"{PREFIX}{{Gov:Robot-Dev:bsy}}Sts:Tgts-I": "Down",
+}
+
+
+@pytest.fixture
+def governor_ioc(monkeypatch):
+    """Answer the Governor cagets from GOVERNOR_PVS, each one taking 0.1 s."""
+    calls = []
+
+    def caget(pvname, timeout=None):
+        calls.append(pvname)
+        ttime.sleep(0.1)
+        return GOVERNOR_PVS.get(pvname)
+
+    monkeypatch.setattr(governor, "get_cl", lambda: SimpleNamespace(caget=caget))
+    return calls
+
+
+def test_discovery_is_concurrent(governor_ioc):
+    start = ttime.monotonic()
+    schema = governor._discover_governors(PREFIX, ["Human", "Robot"])
+    assert ttime.monotonic() - start < 0.3  # two levels, not six sequential cagets
+    assert len(governor_ioc) == 6
+    assert schema["Robot"] == {"devices": ["bsy"], "states": ["M", "SE"], "targets": {"bsy": ["Down"]}}
+
+
+def test_missing_pvs_are_reported(governor_ioc, caplog):
+    values = governor._caget_many([f"{PREFIX}{{Gov}}Sts:Configs-I", "MISSING"], timeout=1)
+    assert values["MISSING"] is None
+    assert "MISSING" in caplog.text
+
+
+def test_make_governors(governor_ioc):
+    govs = governor._make_governors(PREFIX, name="govs", use_cache=False)
+    assert set(govs.gov.component_names) == {"Human", "Robot"}
+    assert govs.gov.Human.dev.bsy.target_Up.pvname == f"{PREFIX}{{Gov:Human-Dev:bsy}}Pos:Up-Pos"
+
+
+def test_schema_cache(governor_ioc, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / "governor.json")
+    govs = governor._make_governors(PREFIX, name="govs", cache_path=cache_path)
+    assert govs.schema_revalidation is None  # fetched from the IOC, then cached
+
+    # the next session is built from the cache, while the IOC is revalidated in the background
+    monkeypatch.setitem(GOVERNOR_PVS, f"{PREFIX}{{Gov:Robot}}Sts:States-I", ["M", "SE", "SA"])
+    changes = []
+    govs = governor._make_governors(
+        PREFIX, name="govs", cache_path=cache_path, on_schema_change=lambda old, new: changes.append(new)
+    )
+    assert hasattr(govs.gov.Robot.dev.bsy, "at_SE") and not hasattr(govs.gov.Robot.dev.bsy, "at_SA")
+    govs.schema_revalidation.join(5)
+    assert changes and changes[0]["Robot"]["states"] == ["M", "SE", "SA"]
+    assert governor._load_schema(cache_path, PREFIX) == changes[0]
+
+    # and without the IOC
+    monkeypatch.setattr(governor, "get_cl", lambda: SimpleNamespace(caget=lambda pvname, timeout=None: None))
+    govs = governor._make_governors(PREFIX, name="govs", cache_path=cache_path)
+    assert hasattr(govs.gov.Robot.dev.bsy, "at_SA")
+    govs.schema_revalidation.join(5)
+
+
+def test_unwritable_schema_cache(governor_ioc, tmp_path, caplog):
+    # a file in place of the cache directory, which cannot be written even as root
+    (tmp_path / "file").write_text("")
+    cache_path = tmp_path / "file" / "mxtools" / "governor.json"
+    govs = governor._make_governors(PREFIX, name="govs", cache_path=str(cache_path))
+    assert set(govs.gov.component_names) == {"Human", "Robot"}
+    assert "continuing without it" in caplog.text
+
+
+def test_devices_are_lazy(governor_ioc):
+    govs = governor._make_governors(PREFIX, name="govs", use_cache=False)
+    created = {walk.item.name for walk in govs.walk_signals()}
+    assert not any("_dev_" in name for name in created)
+
+    govs.gov.Human.dev.bsy.target_Up  # only creates what is accessed
+    created = {walk.item.name for walk in govs.walk_signals()}
+    assert "govs_gov_Human_dev_bsy_target_Up" in created
+    assert "govs_gov_Human_dev_bsy_target_Down" not in created and not any("Robot" in name for name in created)
+
+    signals = govs.prefetch(wait=False)
+    # sel (2), then per configuration: positioner (3) and metadata (4), and for bsy:
+    # the targets PV, the targets and the limits at each state
+    assert len(signals) == 2 + (7 + 1 + 2 + 2 * 2) + (7 + 1 + 1 + 2 * 2)
+
+
+class StubGovernor:
+    """Governor with the transitions M <-> SE <-> SA, moving instantly."""
+
+    TRANSITIONS = {"M": ["SE"], "SE": ["M", "SA"], "SA": ["SE"]}
+
+    def __init__(self):
+        self.name = "gov"
+        self.state = Signal(name="gov_state", value="M")
+        self.states = Signal(name="gov_states", value=list(self.TRANSITIONS))
+        self.reachable = Signal(name="gov_reachable", value=self.TRANSITIONS["M"])
+        self.moves = []
+
+    def set(self, state):
+        if state not in self.reachable.get():
+            raise ValueError(f"{state} is not reachable")
+        self.moves.append(state)
+        self.state.put(state)
+        self.reachable.put(self.TRANSITIONS[state])
+        return NullStatus()
+
+
+def test_transition_planner():
+    gov = StubGovernor()
+    planner = governor.GovernorTransitionPlanner(gov, timeout=1)
+    # the transitions from SE are not known yet, SA is requested directly and rejected by the Governor
+    assert planner.plan("SA") == ["SA"]
+    with pytest.raises(ValueError, match="SA is not reachable"):
+        planner.set("SA").wait(1)
+    with pytest.raises(ValueError, match="unknown state 'SB'"):
+        planner.plan("SB")
+
+    planner.set("SE").wait(1)
+    planner.set("M").wait(1)
+    assert planner.plan("SA") == ["SE", "SA"]
+    planner.set("SA").wait(1)
+    assert gov.moves == ["SE", "M", "SE", "SA"]
+    assert planner.plan("SA") == []
+
+    gov.states.put(["M", "SE", "SA", "SB"])  # a new configuration forgets the transitions
+    assert planner.graph == {}
+
+
+def test_seeded_planner_plans_two_hops():
+    gov = StubGovernor()
+    planner = governor.GovernorTransitionPlanner(gov, timeout=1, transitions=StubGovernor.TRANSITIONS)
+    assert planner.plan("SA") == ["SE", "SA"]
+    planner.set("SA").wait(1)
+    assert gov.moves == ["SE", "SA"]
@@ -0,0 +1,143 @@
+import h5py
+import numpy as np
+import pytest
+
+from mxtools.eiger_files import synthetic_frame, write_synthetic_collection
+from mxtools.handlers import EigerHandlerMX, H5FilePool
+from mxtools.tests.conftest import write_eiger_files
+
+
+def test_handler_reads_all_frames(eiger_files, file_pool):
+    handler = EigerHandlerMX(eiger_files, 1, pool=file_pool)
+    data = handler("data").compute()
+    assert data.shape == (12, 8, 6)
+    np.testing.assert_array_equal(data[:, 0, 0], np.arange(12))
+    np.testing.assert_allclose(handler("omega").compute(), np.arange(12) * 0.1, rtol=1e-6)
+
+
+def test_handler_reuses_pooled_files(eiger_files, file_pool):
+    handler = EigerHandlerMX(eiger_files, 1, pool=file_pool)
+    handler("data").compute()
+    opened = file_pool.misses
+    handler("data").compute()
+    handler("omega").compute()
+    assert file_pool.misses == opened == 4  # master + 3 data files
+    assert file_pool.hits > 0
+
+
+def test_pool_evicts_least_recently_used(tmp_path):
+    pool = H5FilePool(maxsize=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.h5"
+        with h5py.File(path, "w") as f:
+            f["x"] = i
+        paths.append(path)
+    first = pool.open(paths[0])
+    pool.open(paths[1])
+    pool.open(paths[0])
+    pool.open(paths[2])
+    assert paths[1] not in pool and paths[0] in pool
+    assert pool.evictions == 1
+    assert pool.evict(paths[0]) and not first.id.valid
+    pool.clear()
+    assert len(pool) == 0
+
+
+def test_pool_defers_closing_files_in_use(tmp_path):
+    pool = H5FilePool(maxsize=1)
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"{i}.h5"
+        with h5py.File(path, "w") as f:
+            f["x"] = i
+        paths.append(path)
+    with pool.file(paths[0]) as first:
+        pool.open(paths[1])  # evicts the first file, which is still in use
+        assert paths[0] not in pool and first.id.valid
+        assert first["x"][()] == 0
+    assert not first.id.valid
+    assert pool.stats()["in_use"] == 0
+
+
+def test_missing_master_file(tmp_path):
+    with pytest.raises(RuntimeError):
+        EigerHandlerMX(tmp_path / "nothing", 1)
+
+
+def test_data_chunks_follow_hdf5_layout(tmp_path, file_pool):
+    prefix = write_eiger_files(tmp_path, num_images=10, images_per_file=4)
+    data = EigerHandlerMX(prefix, 1, pool=file_pool)("data")
+    assert data.chunks[0] == (1,) * 10
+    np.testing.assert_array_equal(data[[0, 5, 9], 0, 0].compute(), [0, 5, 9])
+
+    data = EigerHandlerMX(prefix, 1, pool=file_pool, chunks_per_block=3)("data")
+    assert data.chunks[0] == (3, 1, 3, 1, 2)
+    np.testing.assert_array_equal(data[:, 0, 0].compute(), np.arange(10))
+
+
+@pytest.mark.parametrize("compression", [None, "bslz4"])
+def test_direct_reader(tmp_path, file_pool, compression):
+    pytest.importorskip("bitshuffle")
+    prefix = write_eiger_files(tmp_path, num_images=10, images_per_file=4, compression=compression)
+    handler = EigerHandlerMX(prefix, 1, pool=file_pool, reader="direct", workers=2, chunks_per_block=2)
+    data = handler("data")
+    assert data.chunks[0] == (2, 2, 2, 2, 2)
+    np.testing.assert_array_equal(data.compute()[:, 3, 2], np.arange(10))
+    np.testing.assert_array_equal(data[7, 1:3, 0].compute(), [7, 7])
+
+
+def test_single_frame_opens_one_data_file(tmp_path, file_pool):
+    prefix = write_eiger_files(tmp_path, num_images=10, images_per_file=4)
+    handler = EigerHandlerMX(prefix, 1, pool=file_pool, images_per_file=4)
+    frame = handler("data", frame_num=9).compute()
+    assert frame.shape == (8, 6) and frame[0, 0] == 9
+    assert file_pool.misses == 2  # master + the last data file
+    np.testing.assert_array_equal(handler._frame_index(), [0, 4, 8, 10])
+
+
+@pytest.mark.parametrize(
+    "kwargs, expected",
+    [
+        ({"frame_num": slice(2, 7)}, np.arange(2, 7)),
+        ({"frame_num": slice(None, None, 3)}, np.arange(0, 10, 3)),
+        ({"frame_num": slice(8, 1, -2)}, np.arange(8, 1, -2)),
+        ({"frame_start": 3, "frame_stop": 5}, np.arange(3, 5)),
+        ({"frame_start": 6}, np.arange(6, 10)),
+        ({"frame_start": 2, "frame_stop": 6, "reverse": True}, np.arange(5, 1, -1)),
+    ],
+)
+def test_frame_ranges(tmp_path, file_pool, kwargs, expected):
+    prefix = write_eiger_files(tmp_path, num_images=10, images_per_file=4)
+    handler = EigerHandlerMX(prefix, 1, pool=file_pool)
+    np.testing.assert_array_equal(handler("data", **kwargs).compute()[:, 0, 0], expected)
+    np.testing.assert_allclose(handler("omega", **kwargs).compute(), expected * 0.1, rtol=1e-6)
+
+
+def test_synthetic_collection(tmp_path, file_pool):
+    pytest.importorskip("hdf5plugin")
+    write_synthetic_collection(
+        tmp_path / "synthetic", num_images=10, images_per_file=4, frame_shape=(16, 12), seed=1
+    )
+    handler = EigerHandlerMX(tmp_path / "synthetic", 1, pool=file_pool)
+    data = handler("data").compute()
+    assert data.shape == (10, 16, 12) and data.dtype == np.uint32
+    rng = np.random.default_rng(1)
+    frames = [synthetic_frame((16, 12), rng=rng) for _ in range(8)]
+    np.testing.assert_array_equal(data, [frames[i % 8] for i in range(10)])
+    np.testing.assert_allclose(handler("omega").compute(), np.arange(10) * 0.1, rtol=1e-6)
+
+
+@pytest.mark.parametrize("reader", ["h5py", "direct"])
+def test_concurrent_reads_with_evictions(tmp_path, reader):
+    if reader == "direct":
+        pytest.importorskip("bitshuffle")
+    prefix = write_eiger_files(tmp_path, num_images=40, images_per_file=1, shape=(64, 64))
+    pool = H5FilePool(maxsize=4)
+    handler = EigerHandlerMX(prefix, 1, pool=pool, reader=reader, workers=2)
+    for _ in range(5):
+        data = handler("data").compute(scheduler="threads", num_workers=16)
+        np.testing.assert_array_equal(data[:, 0, 0], np.arange(40))
+    assert pool.evictions > 0
+    assert pool.stats()["in_use"] == 0 and len(pool) == 4
+    pool.clear()
@@ -0,0 +1,55 @@
+import threading
+
+import numpy as np
+
+from mxtools.hitfinding import RasterHitScorer, pixels_over_threshold, resolution_ring_mask, ring_counts
+from mxtools.tests.conftest import write_eiger_files
+
+
+def test_scores():
+    frames = np.zeros((2, 4, 4), dtype="uint16")
+    frames[1, :2] = 20
+    frames[1, 3, 3] = np.iinfo("uint16").max  # masked pixel
+    np.testing.assert_array_equal(pixels_over_threshold(frames, threshold=10), [0, 8])
+    mask = np.zeros((4, 4), dtype=bool)
+    mask[0] = True
+    np.testing.assert_array_equal(ring_counts(frames, mask), [0, 80])
+
+
+def test_resolution_ring_mask():
+    # 1 Å at 100 mm with 75 µm pixels: 60 Å is 22 pixels from the beam, 30 Å 44 pixels
+    mask = resolution_ring_mask((101, 101), (50, 50), 0.075, 100, 1.0, d_min=30, d_max=60)
+    assert not mask[50, 50]  # the direct beam is at infinite resolution
+    assert mask[50, 80] and mask[20, 50]
+    assert not mask[50, 60] and not mask[50, 98]
+
+
+def test_heat_map_follows_the_data_files(tmp_path, file_pool):
+    scorer = RasterHitScorer(
+        tmp_path / "test",
+        1,
+        num_rows=3,
+        num_columns=4,
+        images_per_file=5,
+        serpentine=True,
+        pool=file_pool,
+        score=lambda frames: frames[:, 0, 0],
+        poll_period=0.01,
+    )
+    maps = []
+    scorer.subscribe(maps.append)
+    scorer.start()
+    write_eiger_files(tmp_path, num_images=12, images_per_file=5)
+    assert scorer.wait(5)
+    np.testing.assert_array_equal(scorer.heat_map, [[0, 1, 2, 3], [7, 6, 5, 4], [8, 9, 10, 11]])
+    assert scorer.best() == (2, 3, 11)
+    assert maps and not np.isnan(maps[-1]).any()
+
+
+def test_close_stops_the_workers(tmp_path, file_pool):
+    scorer = RasterHitScorer(tmp_path / "test", 1, 2, 2, images_per_file=2, pool=file_pool, poll_period=0.01)
+    with scorer:
+        scorer.start()
+        write_eiger_files(tmp_path, num_images=4, images_per_file=2)
+        assert scorer.wait(5)
+    assert not any(thread.name.startswith("raster-score") for thread in threading.enumerate())
@@ -0,0 +1,222 @@
+import threading
+import time as ttime
+
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from ophyd.sim import make_fake_device
+
+from mxtools.eiger import EigerSingleTriggerV26
+from mxtools.handlers import EigerHandlerMX
+from mxtools.raster_flyer import MXRasterFlyer, grid_order
+from mxtools.tests.conftest import write_eiger_files
+from mxtools.vector_program import VectorProgram
+from mxtools.zebra import Zebra
+
+ROW = dict(
+    angle_start=10,
+    scan_width=1,
+    img_width=0.1,
+    exposure_period_per_image=0.01,
+    detector_dead_time=0.001,
+    num_images=10,
+    x_start_um=0,
+    x_end_um=100,
+    y_start_um=0,
+    y_end_um=0,
+    z_start_um=0,
+    z_end_um=0,
+    protocol="raster",
+)
+
+# the detector_arm parameters for 3 rows, except data_directory_name
+ARM = dict(
+    ROW,
+    total_num_images=30,
+    file_prefix="raster",
+    file_number_start=7,
+    x_beam=1,
+    y_beam=2,
+    wavelength=1,
+    det_distance_m=0.2,
+    num_images_per_file=10,
+)
+
+
+@pytest.fixture
+def raster_devices():
+    zebra = make_fake_device(Zebra)("ZEBRA:", name="zebra")
+    vector = make_fake_device(VectorProgram)("VECTOR:", name="vector")
+    eiger = make_fake_device(EigerSingleTriggerV26)("EIGER:", name="eiger")
+    zebra.download_status.sim_put(0)
+    return vector, zebra, eiger
+
+
+def _simulate_rows(vector, zebra, move_time=0.05, download_time=0.05):
+    """Run each row when the vector program is started, with the Zebra capturing its positions.
+
+    The start of a row arms the Zebra, which clears the capture arrays, the
+    motion lasts ``move_time`` s and the arrays are downloaded
+    ``download_time`` s after its end.
+    """
+
+    def move(start, end, num_images):
+        vector.active.sim_put(0)
+        ttime.sleep(download_time)
+        zebra.pc.data.enc1.sim_put(np.linspace(start[0], end[0], num_images))
+        zebra.pc.data.enc2.sim_put(np.linspace(start[1], end[1], num_images))
+        zebra.download_status.sim_put(0)
+
+    def run_row(value, **kwargs):
+        if value == 1:
+            zebra.download_status.sim_put(1)
+            zebra.pc.data.enc1.sim_put([])
+            zebra.pc.data.enc2.sim_put([])
+            start = (vector.start.x.get(), vector.start.y.get())
+            end = (vector.end.x.get(), vector.end.y.get())
+            vector.active.sim_put(1)
+            threading.Timer(move_time, move, args=(start, end, int(zebra.pc.pulse.max.get()))).start()
+
+    vector.go.subscribe(run_row, run=False)
+
+
+def test_grid_order():
+    np.testing.assert_array_equal(grid_order(2, 3), [0, 1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(grid_order(3, 2, serpentine=True), [0, 1, 3, 2, 4, 5])
+
+
+def test_serpentine_rows_alternate_direction(raster_devices):
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger, serpentine=True)
+    for row_index in range(3):
+        flyer.update_parameters(row_index=row_index, **ROW)
+        reverse = row_index % 2 == 1
+        assert (vector.start.x.get(), vector.end.x.get()) == ((100, 0) if reverse else (0, 100))
+        assert (vector.start.omega.get(), vector.end.omega.get()) == ((11, 10) if reverse else (10, 11))
+        assert zebra.pc.direction.get() == int(reverse)
+        assert zebra.pc.gate.start.get() == (11 if reverse else 10)
+
+
+def test_grid_runs_all_rows_in_one_cycle(raster_devices):
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger)
+    rows = [dict(x_start_um=0, x_end_um=100, y_start_um=y, y_end_um=y) for y in (0, 10, 20)]
+    common = {key: value for key, value in ROW.items() if key not in rows[0]}
+    flyer.configure_grid(rows, **common)
+    started_rows = []
+
+    def run_row(value, **kwargs):
+        if value == 1:
+            started_rows.append(vector.start.y.get())
+            vector.active.sim_put(1)
+            vector.active.sim_put(0)
+
+    vector.go.subscribe(run_row, run=False)
+    flyer.kickoff().wait(5)
+    flyer.complete().wait(5)
+    assert started_rows == [0, 10, 20]
+
+
+def _fly_grid(flyer):
+    """Run the configured grid in one kickoff/complete/collect cycle and return the documents."""
+    docs = []
+
+    @bpp.run_decorator()
+    def plan():
+        yield from bps.kickoff(flyer, wait=True)
+        yield from bps.complete(flyer, wait=True)
+        yield from bps.collect(flyer)
+
+    RunEngine()(plan(), lambda name, doc: docs.append((name, doc)))
+    return docs
+
+
+def test_grid_documents(raster_devices, tmp_path):
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger)
+    rows = [dict(y_start_um=y, y_end_um=y) for y in (0, 10, 20)]
+    flyer.configure_grid(rows, **ROW)
+    flyer.detector_arm(**ARM, data_directory_name=str(tmp_path))
+    _simulate_rows(vector, zebra)
+    docs = _fly_grid(flyer)
+    names = [name for name, _ in docs]
+    assert names.count("resource") == 1 and names.count("datum") == 3 and names.count("event_page") == 1
+    resource = next(doc for name, doc in docs if name == "resource")
+    assert resource["resource_kwargs"] == {"seq_id": 7, "images_per_file": 10}
+    datums = [doc["datum_kwargs"] for name, doc in docs if name == "datum"]
+    assert [(d["frame_start"], d["frame_stop"]) for d in datums] == [(0, 10), (10, 20), (20, 30)]
+    page = next(doc for name, doc in docs if name == "event_page")
+    assert page["data"]["row_index"] == [0, 1, 2]
+    assert page["data"]["zebra_y"] == [[y] * 10 for y in (0, 10, 20)]
+    np.testing.assert_allclose(page["data"]["zebra_x"], [np.linspace(0, 100, 10)] * 3)
+
+
+def test_row_documents(raster_devices, tmp_path):
+    """One kickoff/complete/collect per row: each event has the positions of its own row."""
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger)
+    rows = [dict(ROW, y_start_um=y, y_end_um=y, row_index=i) for i, y in enumerate((0, 10, 20))]
+    flyer.update_parameters(**rows[0])
+    flyer.detector_arm(**ARM, data_directory_name=str(tmp_path))
+    _simulate_rows(vector, zebra)
+    docs = []
+
+    @bpp.run_decorator()
+    def plan():
+        for row in rows:
+            if row["row_index"] > 0:
+                flyer.update_parameters(**row)
+            yield from bps.kickoff(flyer, wait=True)
+            yield from bps.complete(flyer, wait=True)
+            yield from bps.collect(flyer)
+
+    RunEngine()(plan(), lambda name, doc: docs.append((name, doc)))
+    pages = [doc for name, doc in docs if name == "event_page"]
+    assert [page["data"]["row_index"] for page in pages] == [[0], [1], [2]]
+    assert [page["data"]["zebra_y"] for page in pages] == [[[y] * 10] for y in (0, 10, 20)]
+    with pytest.raises(NotImplementedError, match="use collect_pages"):
+        flyer.collect()
+
+
+def test_serpentine_documents_are_in_grid_order(raster_devices, tmp_path, file_pool):
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger, serpentine=True)
+    flyer.configure_grid([dict(y_start_um=y, y_end_um=y) for y in (0, 10, 20)], **ROW)
+    flyer.detector_arm(**ARM, data_directory_name=str(tmp_path))
+    _simulate_rows(vector, zebra)
+    docs = _fly_grid(flyer)
+    datums = [doc["datum_kwargs"] for name, doc in docs if name == "datum"]
+    assert [d["reverse"] for d in datums] == [False, True, False]
+    page = next(doc for name, doc in docs if name == "event_page")
+    assert page["data"]["reverse"] == [False, True, False]
+    # the second row moved from x = 100 to 0, its positions are in grid order in the event
+    np.testing.assert_allclose(page["data"]["zebra_x"], [np.linspace(0, 100, 10)] * 3)
+
+    # frame k of the files holds the value k, in acquisition order
+    prefix = write_eiger_files(tmp_path, prefix="raster", seq_id=7, num_images=30, images_per_file=10)
+    handler = EigerHandlerMX(prefix, 7, pool=file_pool)
+    frames = [handler(**datum_kwargs).compute()[:, 0, 0] for datum_kwargs in datums]
+    np.testing.assert_array_equal(frames, [np.arange(10), np.arange(19, 9, -1), np.arange(20, 30)])
+
+
+@pytest.mark.parametrize("grid", [True, False], ids=["grid", "rows"])
+def test_grid_layout(raster_devices, tmp_path, grid):
+    vector, zebra, eiger = raster_devices
+    flyer = MXRasterFlyer(vector, zebra, eiger, serpentine=True)
+    with pytest.raises(RuntimeError, match="armed"):
+        flyer.grid_layout()
+    if grid:
+        flyer.configure_grid([dict(y_start_um=y, y_end_um=y) for y in (0, 10, 20)], **ROW)
+    else:
+        flyer.update_parameters(**ROW, row_index=0)
+    flyer.detector_arm(**ARM, data_directory_name=str(tmp_path))
+    assert flyer.grid_layout() == {
+        "fpath": tmp_path / "raster",
+        "seq_id": 7,
+        "images_per_file": 10,
+        "num_rows": 3,
+        "num_columns": 10,
+        "serpentine": True,
+    }
@@ -0,0 +1,49 @@
+import threading
+import time as ttime
+
+import pytest
+from ophyd import Signal
+from ophyd.status import Status
+
+from mxtools.settle import wait_for_readback, wait_for_status
+
+
+def _value_callbacks(signal):
+    return len(signal._callbacks[signal.SUB_VALUE])
+
+
+def test_readback_reached():
+    signal = Signal(name="signal", value=0)
+    threading.Timer(0.1, signal.put, args=(3,)).start()
+    start = ttime.monotonic()
+    assert wait_for_readback(signal, 3, timeout=2)
+    assert ttime.monotonic() - start < 1
+    assert _value_callbacks(signal) == 0
+
+
+def test_readback_timeout_unsubscribes(caplog):
+    signal = Signal(name="signal", value=0)
+    assert not wait_for_readback(signal, 3, timeout=0.1)
+    assert "signal == 3 not reached" in caplog.text
+    assert _value_callbacks(signal) == 0
+
+
+def test_fixed_delay_ignores_the_readback():
+    signal = Signal(name="signal", value=3)
+    start = ttime.monotonic()
+    assert wait_for_readback(signal, 3, fixed_delay=0.2)
+    assert ttime.monotonic() - start >= 0.2
+
+
+def test_failed_status_is_logged(caplog):
+    status = Status()
+    status.set_exception(RuntimeError("no answer"))
+    assert not wait_for_status(status, timeout=1, what="zebra reset")
+    assert "zebra reset not reached" in caplog.text
+
+
+def test_timeout_raises_on_request():
+    signal = Signal(name="signal", value=0)
+    with pytest.raises(RuntimeError, match="signal == 3 not reached"):
+        wait_for_readback(signal, 3, timeout=0.1, raise_on_timeout=True)
+    assert _value_callbacks(signal) == 0
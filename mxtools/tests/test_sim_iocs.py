@@ -0,0 +1,261 @@
+import time as ttime
+
+import h5py
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from ophyd.status import SubscriptionStatus
+
+from mxtools.batch import PutBatch
+from mxtools.eiger import EigerSingleTriggerV26
+from mxtools.flyer import MXFlyer
+from mxtools.governor import _make_governors
+from mxtools.raster_flyer import MXRasterFlyer
+from mxtools.settle import wait_for_readback
+from mxtools.vector_program import VectorProgram
+from mxtools.zebra import Zebra
+
+SWEEP = dict(
+    angle_start=10,
+    scan_width=2,
+    img_width=0.1,
+    exposure_period_per_image=0.02,
+    detector_dead_time=0.001,
+    num_images=20,
+    x_start_um=0,
+    x_end_um=0,
+    y_start_um=0,
+    y_end_um=0,
+    z_start_um=0,
+    z_end_um=0,
+    file_prefix="sweep",
+    file_number_start=5,
+    x_beam=128,
+    y_beam=128,
+    wavelength=1.0,
+    det_distance_m=0.2,
+)
+
+
+# rows of 10 frames along x, at the y of RASTER_ROWS
+RASTER = dict(
+    SWEEP,
+    angle_start=0,
+    scan_width=1,
+    exposure_period_per_image=0.01,
+    num_images=10,
+    x_end_um=100,
+    protocol="raster",
+    total_num_images=30,
+    file_prefix="raster",
+    file_number_start=1,
+    num_images_per_file=10,
+)
+RASTER_ROWS = [dict(y_start_um=y, y_end_um=y, row_index=i) for i, y in enumerate((0, 10, 20))]
+
+
+def _went_to_zero(value, old_value, **kwargs):
+    return old_value == 1 and value == 0
+
+
+def test_vector_motion_is_captured_by_the_zebra(sim_iocs):
+    vector = VectorProgram(sim_iocs.VECTOR_PREFIX, name="sim_vector")
+    zebra = Zebra(sim_iocs.ZEBRA_PREFIX, name="sim_zebra")
+    vector.wait_for_connection(timeout=5)
+    zebra.wait_for_connection(timeout=5)
+    for signal, value in [
+        (vector.start.omega, 0),
+        (vector.end.omega, 5),
+        (vector.start.x, 100),
+        (vector.end.x, 200),
+        (vector.num_frames, 10),
+        (vector.frame_exptime, 20),
+        (vector.buffer_time, 100),
+        (zebra.pc.arm.trig_source, 1),
+        (zebra.pc.pulse.start, 0),
+        (zebra.pc.pulse.step, 20),
+        (zebra.pc.pulse.delay, 10),
+        (zebra.pc.pulse.max, 10),
+    ]:
+        signal.set(value).wait(2)
+
+    motion = SubscriptionStatus(vector.active, _went_to_zero, run=False)
+    download = SubscriptionStatus(zebra.download_status, _went_to_zero, run=False)
+    start = ttime.monotonic()
+    vector.go.put(1)
+    motion.wait(5)
+    # buffer time and 10 frames of 20 ms
+    assert ttime.monotonic() - start >= 0.3
+    download.wait(5)
+
+    times, positions = zebra.capture_arrays(encoders=[1, 4])
+    assert times.size == 10
+    # captured in the middle of each frame
+    np.testing.assert_allclose(positions["enc4"], (np.arange(10) + 0.5) * 0.5, atol=1e-6)
+    np.testing.assert_allclose(positions["enc1"], 100 + (np.arange(10) + 0.5) * 10, atol=1e-6)
+
+
+def test_mxflyer_collection(sim_iocs, tmp_path):
+    vector = VectorProgram(sim_iocs.VECTOR_PREFIX, name="vector")
+    zebra = Zebra(sim_iocs.ZEBRA_PREFIX, name="zebra")
+    eiger = EigerSingleTriggerV26(sim_iocs.EIGER_PREFIX, name="eiger")
+    vector.wait_for_connection(timeout=5)
+    zebra.wait_for_connection(timeout=5)
+    flyer = MXFlyer(vector, zebra, eiger)
+    flyer.measure_omega = True
+    params = dict(SWEEP, data_directory_name=str(tmp_path))
+
+    flyer.update_parameters(**params)
+    flyer.detector_arm(**params).wait(5)
+    docs = []
+
+    @bpp.run_decorator()
+    def plan():
+        yield from bps.kickoff(flyer, wait=True)
+        yield from bps.complete(flyer, wait=True)
+        yield from bps.collect(flyer)
+
+    RunEngine()(plan(), lambda name, doc: docs.append((name, doc)))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["sweep_5_data_000001.h5", "sweep_5_master.h5"]
+    with h5py.File(tmp_path / "sweep_5_master.h5", "r") as f:
+        assert f["entry/data/data_000001"].shape == (20, *sim_iocs.DEFAULT_FRAME_SHAPE)
+        np.testing.assert_allclose(f["entry/sample/goniometer/omega"][()], 10 + np.arange(20) * 0.1, atol=1e-5)
+    (page,) = [doc for name, doc in docs if name == "event_page"]
+    np.testing.assert_allclose(page["data"]["omega_residual"][0], 0, atol=1e-6)
+
+
+def test_governor_transitions(sim_iocs):
+    governors = _make_governors(sim_iocs.GOVERNOR_PREFIX, name="sim_gov", use_cache=False)
+    robot = governors.gov.Robot
+    assert governors.schema["Robot"]["states"] == list(sim_iocs.DEFAULT_GOVERNORS["Robot"]["transitions"])
+    assert robot.state.get() == "M"
+
+    robot.set("SE").wait(5)
+    assert robot.state.get() == "SE"
+    assert list(robot.reachable.get()) == sim_iocs.DEFAULT_GOVERNORS["Robot"]["transitions"]["SE"]
+    # XF is not reachable from M, the IOC rejects the put
+    robot.set("M").wait(5)
+    robot.setpoint.put("XF", wait=True, timeout=5)
+    assert robot.state.get() == "M"
+
+
+def test_batch_put_of_coerced_value(sim_iocs):
+    zebra = Zebra(sim_iocs.ZEBRA_PREFIX, name="sim_zebra")
+    zebra.wait_for_connection(timeout=5)
+    # PC_PULSE_MAX is an integer PV: the IOC stores 2, which must not keep the batch waiting
+    for _ in range(2):
+        PutBatch(timeout=2).put(zebra.pc.pulse.max, 2.4).wait()
+        assert zebra.pc.pulse.max.get(use_monitor=False) == 2
+
+
+@pytest.fixture
+def raster_devices(sim_iocs):
+    vector = VectorProgram(sim_iocs.VECTOR_PREFIX, name="sim_vector")
+    zebra = Zebra(sim_iocs.ZEBRA_PREFIX, name="sim_zebra")
+    eiger = EigerSingleTriggerV26(sim_iocs.EIGER_PREFIX, name="sim_eiger")
+    for device in (vector, zebra, eiger):
+        device.wait_for_connection(timeout=5)
+    yield vector, zebra, eiger
+    # the stopped or failed rasters leave the detector waiting for frames
+    eiger.cam.acquire.put(0)
+    wait_for_readback(eiger.cam.armed, 0, timeout=5)
+
+
+class MotionWatch:
+    """Count the rows started, and record whether the vector program was moving at each write of ``signals``."""
+
+    def __init__(self, vector, signals, monkeypatch):
+        self.vector = vector
+        self.rows_started = 0
+        self.writes = []
+        vector.active.subscribe(self._update, run=False)
+        for signal in signals:
+            monkeypatch.setattr(signal, "put", self._spy(signal, signal.put))
+
+    def _update(self, value, old_value, **kwargs):
+        if old_value == 0 and value == 1:
+            self.rows_started += 1
+
+    def _spy(self, signal, put):
+        def spied_put(value, **kwargs):
+            self.writes.append((signal.attr_name, self.vector.active.get(use_monitor=False) == 1))
+            return put(value, **kwargs)
+
+        return spied_put
+
+    def written_while_moving(self, attr_name):
+        return [moving for name, moving in self.writes if name == attr_name]
+
+
+def test_pipelined_raster_hands_off_rows(raster_devices, tmp_path, monkeypatch):
+    vector, zebra, eiger = raster_devices
+    watch = MotionWatch(vector, [vector.hold, vector.start.y], monkeypatch)
+    flyer = MXRasterFlyer(vector, zebra, eiger, pipelined=True)
+    rows = [dict(RASTER, **row) for row in RASTER_ROWS]
+    flyer.update_parameters(**rows[0])
+    flyer.detector_arm(**RASTER, data_directory_name=str(tmp_path)).wait(5)
+    docs = []
+
+    @bpp.run_decorator()
+    def plan():
+        for i in range(len(rows)):
+            yield from bps.kickoff(flyer, wait=True)
+            if i + 1 < len(rows):
+                flyer.update_parameters(**rows[i + 1])  # staged while row i moves
+            yield from bps.complete(flyer, wait=True)
+            yield from bps.collect(flyer)
+
+    RunEngine()(plan(), lambda name, doc: docs.append((name, doc)))
+
+    assert watch.rows_started == 3
+    # the setpoints of the next rows are written during the motion, the hold never is
+    assert watch.written_while_moving("y") == [False, True, True]
+    assert watch.written_while_moving("hold") and not any(watch.written_while_moving("hold"))
+    datums = [doc["datum_kwargs"] for name, doc in docs if name == "datum"]
+    assert [(d["frame_start"], d["frame_stop"]) for d in datums] == [(0, 10), (10, 20), (20, 30)]
+    pages = [doc["data"] for name, doc in docs if name == "event_page"]
+    np.testing.assert_allclose([page["zebra_y"][0] for page in pages], [[0] * 10, [10] * 10, [20] * 10])
+    np.testing.assert_allclose(pages[0]["zebra_x"][0], (np.arange(10) + 0.5) * 10, atol=1e-6)
+
+
+def test_failed_staging_stops_the_raster(raster_devices, tmp_path, monkeypatch):
+    vector, zebra, eiger = raster_devices
+    watch = MotionWatch(vector, [], monkeypatch)
+    flyer = MXRasterFlyer(vector, zebra, eiger, pipelined=True)
+    flyer.update_parameters(**dict(RASTER, **RASTER_ROWS[0]))
+    flyer.detector_arm(**RASTER, data_directory_name=str(tmp_path)).wait(5)
+
+    @bpp.run_decorator()
+    def plan():
+        yield from bps.kickoff(flyer, wait=True)
+        # no end position: the background staging of the row fails
+        flyer.update_parameters(**{key: value for key, value in RASTER.items() if key != "x_end_um"}, row_index=1)
+        yield from bps.complete(flyer, wait=True)
+        yield from bps.collect(flyer)
+        yield from bps.kickoff(flyer, wait=True)
+
+    with pytest.raises(KeyError, match="x_end_um"):
+        RunEngine()(plan())
+    assert watch.rows_started == 1
+
+
+def test_stopped_grid_starts_no_further_row(raster_devices, tmp_path, monkeypatch):
+    vector, zebra, eiger = raster_devices
+    watch = MotionWatch(vector, [], monkeypatch)
+    flyer = MXRasterFlyer(vector, zebra, eiger)
+    flyer.configure_grid(RASTER_ROWS, **RASTER)
+    flyer.detector_arm(**RASTER, data_directory_name=str(tmp_path)).wait(5)
+    first_row = SubscriptionStatus(vector.active, lambda value, **kwargs: value == 1, run=False)
+    flyer.kickoff().wait(5)
+    first_row.wait(5)
+    flyer.stop()
+    with pytest.raises(RuntimeError, match="raster grid stopped"):
+        flyer.complete().wait(5)
+    ttime.sleep(0.2)
+    assert watch.rows_started == 1
+    # the row that was moving when stopped is still collected
+    datums = [doc for name, doc in flyer.collect_asset_docs() if name == "datum"]
+    assert [(d["datum_kwargs"]["frame_start"], d["datum_kwargs"]["frame_stop"]) for d in datums] == [(0, 10)]
@@ -0,0 +1,50 @@
+import json
+
+from ophyd.status import Status
+
+from mxtools.timing import JSONLinesSink, PhaseRecorder, RingBufferSink, timed
+
+
+class Collector:
+    name = "collector"
+
+    def __init__(self, recorder):
+        self.timing = recorder
+        self.status = Status()
+
+    @timed()
+    def arm(self):
+        self.configure()
+        return self.status
+
+    @timed()
+    def configure(self):
+        pass
+
+    @timed("read")
+    def collect(self):
+        yield from range(3)
+
+
+def test_phases_are_recorded(tmp_path):
+    ring = RingBufferSink()
+    collector = Collector(PhaseRecorder([ring, JSONLinesSink(tmp_path / "timing.jsonl")]))
+
+    status = collector.arm()
+    assert [record["name"] for record in ring.records()] == ["collector.configure", "collector.arm"]
+    assert ring.records("collector.configure")[0]["parent"] == "collector.arm"
+
+    status.set_finished()
+    status.wait(1)
+    assert ring.records("collector.arm.status")[0]["success"]
+
+    assert list(collector.collect()) == [0, 1, 2]
+    assert ring.records("collector.read")[0]["duration"] >= 0
+
+    lines = (tmp_path / "timing.jsonl").read_text().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == [record["name"] for record in ring.records()]
+
+
+def test_recording_can_be_disabled():
+    collector = Collector(None)
+    assert collector.arm() is collector.status
@@ -0,0 +1,51 @@
+import threading
+import time as ttime
+
+import numpy as np
+from ophyd.sim import make_fake_device
+
+from mxtools.zebra import Zebra, frame_positions
+
+
+def test_collect_pages():
+    zebra = make_fake_device(Zebra)("ZEBRA:", name="zebra")
+    zebra.enc_of_interest.put([1, 4])
+    zebra.pc.data.time.sim_put(np.arange(5) * 0.1)
+    zebra.pc.data.enc1.sim_put(np.arange(5) * 2.0)
+    zebra.pc.data.enc4.sim_put(np.arange(8) * 10.0)  # padded waveform
+    zebra.pc.data.num_downloaded.sim_put(0)
+
+    (page,) = zebra.collect_pages()
+    assert page["data"] == {"enc1": [0, 2, 4, 6, 8], "enc4": [0, 10, 20, 30, 40]}
+    np.testing.assert_allclose(page["time"], np.arange(5) * 0.1)
+    assert page["timestamps"]["enc4"] == page["time"]
+
+
+def test_frame_positions():
+    times = np.arange(4) * 0.5
+    np.testing.assert_array_equal(frame_positions(times, [1, 2, 3, 4], 4), [1, 2, 3, 4])
+    # the capture of frame 2 is missing
+    np.testing.assert_array_equal(frame_positions(times[[0, 1, 3]], [1, 2, 4], 4, period=0.5), [1, 2, np.nan, 4])
+    assert np.isnan(frame_positions([], [], 3)).all()
+
+
+def test_iter_capture():
+    zebra = make_fake_device(Zebra)("ZEBRA:", name="zebra")
+    zebra.pc.data.num_downloaded.sim_put(0)
+    zebra.download_status.sim_put(1)
+    zebra.pc.pulse.max.sim_put(4)  # the buffer has to grow
+
+    def download():
+        for count in (3, 6):
+            ttime.sleep(0.05)
+            zebra.pc.data.time.sim_put(np.arange(count) * 0.1)
+            zebra.pc.data.enc4.sim_put(np.arange(count) * 1.0)
+            zebra.pc.data.num_downloaded.sim_put(count)
+        zebra.download_status.sim_put(0)
+
+    threading.Thread(target=download).start()
+    counts = [len(partial["enc4"]) for partial in zebra.iter_capture(poll_period=0.01, timeout=5)]
+    assert counts == [3, 6]
+    assert zebra.capture_buffer.complete
+    times, data = zebra.capture_arrays()
+    np.testing.assert_array_equal(data["enc4"], np.arange(6))
@@ -0,0 +1,160 @@
+import functools
+import inspect
+import json
+import logging
+import threading
+import time as ttime
+from collections import deque
+from contextlib import contextmanager
+
+from ophyd.status import StatusBase
+
+logger = logging.getLogger(__name__)
+
+
+class RingBufferSink:
+    """Keep the last ``maxlen`` timing records in memory."""
+
+    def __init__(self, maxlen=10000):
+        self._records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self, name=None):
+        """Return the records, optionally only those of the phase ``name``."""
+        with self._lock:
+            records = list(self._records)
+        if name is None:
+            return records
+        return [record for record in records if record["name"] == name]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+class JSONLinesSink:
+    """Append each timing record as one JSON line to the file at ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+class PhaseRecorder:
+    """Record monotonic start times and durations of named phases.
+
+    Each record is a dict with the phase ``name``, its ``parent`` phase (the
+    phase it is nested in, in the same thread), the monotonic ``start`` time,
+    the ``duration`` in seconds, the wall clock ``time`` and ``success``. It
+    is passed to every sink, which is any callable taking the record.
+
+    Parameters
+    ----------
+    sinks : list of callables, optional
+        defaults to a single :class:`RingBufferSink`
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = [RingBufferSink()] if sinks is None else list(sinks)
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, name, start, duration, parent=None, success=True, **md):
+        record = {
+            "name": name,
+            "parent": parent,
+            "start": start,
+            "duration": duration,
+            "time": ttime.time() - (ttime.monotonic() - start),
+            "success": success,
+            **md,
+        }
+        for sink in self.sinks:
+            try:
+                sink(record)
+            except Exception:
+                logger.exception(f"timing sink {sink!r} failed")
+
+    @contextmanager
+    def phase(self, name, **md):
+        """Time the body of the ``with`` statement as the phase ``name``."""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = ttime.monotonic()
+        success = True
+        try:
+            yield
+        except BaseException:
+            success = False
+            raise
+        finally:
+            stack.pop()
+            self.record(name, start, ttime.monotonic() - start, parent=parent, success=success, **md)
+
+    def track_status(self, name, status, **md):
+        """Record the time from now until ``status`` completes as the phase ``name``."""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        start = ttime.monotonic()
+
+        def done(status):
+            self.record(name, start, ttime.monotonic() - start, parent=parent, success=status.success, **md)
+
+        status.add_callback(done)
+        return status
+
+
+def timed(name=None):
+    """Decorate a method so that each call is recorded by ``self.timing``.
+
+    The phase is named ``{self.name}.{name}`` (``name`` defaults to the method
+    name). Generators are timed until they are exhausted, and when the method
+    returns a status, the time until it completes is recorded too, as the
+    ``{phase}.status`` phase. Nothing is recorded if ``self.timing`` is None.
+    """
+
+    def decorator(func):
+        phase_name = name or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                recorder = getattr(self, "timing", None)
+                if recorder is None:
+                    return (yield from func(self, *args, **kwargs))
+                with recorder.phase(f"{self.name}.{phase_name}"):
+                    return (yield from func(self, *args, **kwargs))
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                recorder = getattr(self, "timing", None)
+                if recorder is None:
+                    return func(self, *args, **kwargs)
+                full_name = f"{self.name}.{phase_name}"
+                with recorder.phase(full_name):
+                    ret = func(self, *args, **kwargs)
+                if isinstance(ret, StatusBase):
+                    recorder.track_status(f"{full_name}.status", ret)
+                return ret
+
+        return wrapper
+
+    return decorator
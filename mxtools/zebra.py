@@ -1,10 +1,73 @@
+import logging
+import queue
 import time as ttime
 
+import numpy as np
 from ophyd import Component as Cpt
 from ophyd import Device, EpicsSignal, EpicsSignalRO
 from ophyd.signal import Signal
 from ophyd.status import DeviceStatus
 
+logger = logging.getLogger(__name__)
+
+
+def frame_positions(times, positions, num_frames, period=None):
+    """Assign positions captured by the Zebra to the frames they were captured for.
+
+    The Zebra captures the positions on each detector trigger pulse. When the
+    number of captures equals ``num_frames``, capture ``i`` is frame ``i``.
+    Otherwise, each capture is assigned to the frame nearest to its time,
+    counting ``period`` seconds (by default the median interval between
+    captures) per frame from the first capture. Frames without a capture
+    are NaN.
+    """
+    times = np.asarray(times, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    num_points = min(times.size, positions.size)
+    frames = np.full(num_frames, np.nan)
+    if num_points == num_frames:
+        frames[:] = positions[:num_points]
+        return frames
+    if num_points == 0:
+        return frames
+    times, positions = times[:num_points], positions[:num_points]
+    if period is None:
+        period = np.median(np.diff(times)) if num_points > 1 else 1.0
+    index = np.rint((times - times[0]) / period).astype(np.int64)
+    valid = (index >= 0) & (index < num_frames)
+    frames[index[valid]] = positions[valid]
+    return frames
+
+
+class CaptureBuffer:
+    """Preallocated arrays holding the position capture data downloaded so far.
+
+    The arrays grow (doubling their size) if more points than expected are captured.
+    """
+
+    def __init__(self, keys, size):
+        self.arrays = {key: np.full(max(int(size), 1), np.nan) for key in keys}
+        self.count = 0
+        self.complete = False
+
+    def extend(self, segments):
+        """Append the arrays of ``segments`` (one per key, all of the same length)."""
+        num_points = min(len(segment) for segment in segments.values())
+        start = self.count
+        stop = start + num_points
+        for key, array in self.arrays.items():
+            if stop > array.size:
+                array = self.arrays[key] = np.concatenate(
+                    [array, np.full(max(stop, 2 * array.size) - array.size, np.nan)]
+                )
+            array[start:stop] = segments[key][:num_points]
+        self.count = stop
+        return num_points
+
+    def view(self):
+        """Return the data downloaded so far, as views of the buffer (no copies)."""
+        return {key: array[: self.count] for key, array in self.arrays.items()}
+
 
 class ZebraPCBase(Device):
     sel = Cpt(EpicsSignal, "SEL", kind="config", auto_monitor=True)
@@ -106,6 +169,9 @@ class Zebra(Device):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._collection_ts = 0.0
+        # filled by iter_capture, which downloads the capture data during the acquisition
+        self.capture_buffer = None
         formatted_to_be_normal = [f"{self.pc.data.name}_enc{num}" for num in self.enc_of_interest.get()]
         for cpt in self.pc.data.component_names:
             cpt_obj = getattr(self.pc.data, cpt)
@@ -130,6 +196,7 @@ class Zebra(Device):
         disarmed_signal = self.download_status
 
         self._collection_ts = ttime.time()
+        self.capture_buffer = None
 
         def armed_status_cb(value, old_value, obj, **kwargs):
             if int(old_value) == 0 and int(value) == 1:
@@ -151,26 +218,100 @@ class Zebra(Device):
 
         return armed_status
 
-    def collect(self):
-        pc = self.pc
+    def capture_arrays(self, encoders=None):
+        """Return the capture timestamps and the captured positions of ``encoders``.
 
-        # Array of timestamps
-        ts = pc.data.time.get() + self._collection_ts
+        ``encoders`` are encoder numbers, 1 to 4, and default to ``enc_of_interest``.
 
-        # Arrays of captured positions
-        data = {
-            f"enc{i}": getattr(pc.data, f"enc{i}").get()
-            for i in self.enc_of_interest.get()
-            if getattr(pc, f"capture_enc{i}").get()
+        All the arrays are cut to the number of points downloaded (or to the
+        shortest array, as the waveforms may be padded).
+        """
+        pc = self.pc
+        encoders = self.enc_of_interest.get() if encoders is None else encoders
+        buffer = self.capture_buffer
+        if buffer is not None and buffer.complete and all(f"enc{i}" in buffer.arrays for i in encoders):
+            # already downloaded during the acquisition by iter_capture
+            data = buffer.view()
+            return data["time"] + self._collection_ts, {f"enc{i}": data[f"enc{i}"] for i in encoders}
+        times = np.asarray(pc.data.time.get(), dtype=float)
+        data = {f"enc{i}": np.asarray(getattr(pc.data, f"enc{i}").get()) for i in encoders}
+        num_points = min([times.size] + [array.size for array in data.values()])
+        num_downloaded = int(pc.data.num_downloaded.get() or 0)
+        if 0 < num_downloaded < num_points:
+            num_points = num_downloaded
+        return times[:num_points] + self._collection_ts, {key: array[:num_points] for key, array in data.items()}
+
+    def iter_capture(self, encoders=None, size=None, poll_period=0.1, timeout=None):
+        """Download the position capture data while the acquisition is in progress.
+
+        ``NUM_DOWN`` is monitored and the newly downloaded points of the time
+        and encoder arrays are appended to a preallocated :class:`CaptureBuffer`
+        (of ``size`` points, by default the number of pulses). After each
+        download, the data so far is yielded as a dict of arrays, keyed by
+        ``time`` and ``enc{i}``. The generator ends when the Zebra finishes
+        downloading, or after ``timeout`` seconds without a new point. The
+        complete buffer is then reused by :meth:`collect_pages`.
+        """
+        pc = self.pc
+        encoders = self.enc_of_interest.get() if encoders is None else encoders
+        signals = {"time": pc.data.time, **{f"enc{i}": getattr(pc.data, f"enc{i}") for i in encoders}}
+        if size is None:
+            size = int(pc.pulse.max.get() or 0) or 1024
+        self.capture_buffer = buffer = CaptureBuffer(signals, size)
+        updates = queue.Queue()
+
+        def downloaded(value, **kwargs):
+            updates.put(value)
+
+        def acquiring(value, old_value, **kwargs):
+            if old_value is not None and int(old_value) == 1 and int(value) == 0:
+                updates.put(None)  # the download is finished
+
+        downloaded_cid = pc.data.num_downloaded.subscribe(downloaded, run=True)
+        acquiring_cid = self.download_status.subscribe(acquiring, run=False)
+        try:
+            finished = False
+            last_update = ttime.monotonic()
+            while not finished:
+                try:
+                    values = [updates.get(timeout=poll_period)]
+                except queue.Empty:
+                    if timeout is not None and ttime.monotonic() - last_update > timeout:
+                        logger.warning(f"no position capture data downloaded for {timeout} s")
+                        break
+                    continue
+                while not updates.empty():  # only read the arrays once for all the pending updates
+                    values.append(updates.get_nowait())
+                finished = None in values
+                count = int(pc.data.num_downloaded.get() or 0)
+                if count <= buffer.count:
+                    continue
+                arrays = {key: np.asarray(signal.get(), dtype=float) for key, signal in signals.items()}
+                available = min([count] + [array.size for array in arrays.values()])
+                if available <= buffer.count:
+                    continue
+                done = buffer.count
+                buffer.extend({key: array[done:available] for key, array in arrays.items()})
+                last_update = ttime.monotonic()
+                yield buffer.view()
+            # complete only if the arrays held every point downloaded
+            buffer.complete = finished and buffer.count >= int(pc.data.num_downloaded.get() or 0)
+        finally:
+            pc.data.num_downloaded.unsubscribe(downloaded_cid)
+            self.download_status.unsubscribe(acquiring_cid)
+
+    def collect_pages(self):
+        ts, data = self.capture_arrays()
+        if not ts.size:
+            return
+        # one event page for all the captured points, built from the arrays without a loop per point
+        ts = ts.tolist()
+        yield {
+            "data": {key: array.tolist() for key, array in data.items()},
+            "timestamps": {key: ts for key in data},
+            "time": ts,
         }
 
-        for i, timestamp in enumerate(ts):
-            yield {
-                "data": {k: v[i] for k, v in data.items()},
-                "timestamps": {k: timestamp for k in data.keys()},
-                "time": timestamp,
-            }
-
     def describe_collect(self):
         return {
             "primary": {
@@ -180,6 +321,5 @@ class Zebra(Device):
                     "dtype": "number",
                 }
                 for i in self.enc_of_interest.get()
-                if getattr(self.pc, f"capture_enc{i}").get()
             }
         }